@@ -0,0 +1,360 @@
+"""
+Batched writer for sensor_data inserts.
+
+Rows are collected in memory and flushed with one multi-row
+`psycopg2.extras.execute_values` INSERT and a single commit when either
+WRITER_BATCH_SIZE rows are pending or WRITER_FLUSH_INTERVAL seconds have
+passed since the first pending row, whichever comes first.
+
+An optional `prepare(cursor)` hook (e.g. a schema migration) runs once before
+the first insert and is retried with the next batch if it fails.
+
+With a spool (api/spool.py), batches that cannot reach PostgreSQL are written
+to disk instead of being dropped, and so are all later batches until the
+replayer has drained the backlog. When more than WRITER_MAX_PENDING rows wait
+in memory because the database is slow, the oldest batch is spilled as well.
+
+Rows may be added with an `ack` callback (the MQTT acknowledgement of the
+message they came from). Acks run only after the row's batch has committed or
+been written to the spool, so a message is never acknowledged before it is
+durable. When PostgreSQL rejects a batch (e.g. one row with a value out of
+range), it is retried row by row under savepoints, so only the rejected rows
+are lost. Rows that will never be stored are acked too, since redelivery
+would not help; rows lost because the database is
+unreachable and no spool is configured stay unacknowledged, so the broker
+redelivers them after the next reconnect. Because the broker stops sending once
+MQTT_MAX_INFLIGHT messages await their ack (mosquitto's max_inflight_messages),
+a batch is also flushed as soon as that many of its rows hold an ack; otherwise
+a persistent-session backlog would drain one in-flight window per flush
+interval.
+
+With WRITER_PARTITIONS > 1, make_batch_writer() returns a
+PartitionedBatchWriter: that many BatchWriters, each with its own thread and
+pooled connection, and rows routed by device_id. Several ingest threads (e.g.
+MQTT shared-subscription workers) then flush concurrently, while all rows of
+one device still go through one writer, in the order they were added, and
+are never inserted by two transactions at once.
+"""
+
+import os
+import time
+import zlib
+import threading
+import logging
+import psycopg2
+import psycopg2.extras
+
+from api.spool import SpoolReplayer, insert_row_by_row
+
+WRITER_BATCH_SIZE = int(os.getenv('WRITER_BATCH_SIZE', '500'))
+WRITER_FLUSH_INTERVAL = float(os.getenv('WRITER_FLUSH_INTERVAL', '1.0'))  # seconds
+WRITER_MAX_PENDING = int(os.getenv('WRITER_MAX_PENDING', '10000'))  # rows held in memory before spilling to the spool
+WRITER_PARTITIONS = max(1, int(os.getenv('WRITER_PARTITIONS', '1')))  # device-keyed writer threads
+MQTT_MAX_INFLIGHT = int(os.getenv('MQTT_MAX_INFLIGHT', '20'))  # unacked rows that trigger a flush; 0 = no limit
+
+writer_logger = logging.getLogger("batch_writer")
+
+
+class BatchWriter:
+    """Collects row tuples matching `columns` (default timestamp, device_id, raw_data) and flushes them in batches."""
+
+    def __init__(self, connection_factory, table, batch_size=WRITER_BATCH_SIZE, flush_interval=WRITER_FLUSH_INTERVAL,
+                 columns=('timestamp', 'device_id', 'raw_data'), prepare=None, template=None, spool=None,
+                 max_pending=WRITER_MAX_PENDING, max_unacked=MQTT_MAX_INFLIGHT, replay=True, name="BatchWriterThread"):
+        self.connection_factory = connection_factory
+        self.table = table
+        self.columns = tuple(columns)
+        # Rows already stored (same device_id, timestamp) are skipped by the table's unique key
+        self._insert_sql = f"INSERT INTO {table} ({', '.join(self.columns)}) VALUES %s ON CONFLICT DO NOTHING"
+        self._prepare = prepare
+        self._prepare_lock = threading.Lock()
+        self._template = template  # execute_values row template, e.g. to add casts
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.spool = spool
+        self.max_pending = max(self.batch_size, max_pending)
+        self.max_unacked = max_unacked
+        self.name = name
+        self.replayer = None
+        if spool is not None and replay:
+            self.replayer = SpoolReplayer(spool, connection_factory, table,
+                                          template_for=lambda cols: template if tuple(cols) == self.columns else None,
+                                          prepare=self._ensure_prepared)
+        self._rows = []
+        self._acks = []  # Ack callback (or None) per pending row, aligned with _rows
+        self._unacked = 0  # Pending rows with an ack callback
+        self._batch_started = None
+        self._cond = threading.Condition()
+        self._stop = False
+        self._thread = None
+        self.rows_written = 0
+        self.batches_written = 0
+        self.rows_failed = 0
+        self.rows_spooled = 0
+        self.rows_duplicate = 0
+        self.last_flush_ms = 0.0
+
+    def add(self, row, ack=None):
+        """Queue one row for the next batch; `ack()` runs once it is durable. Starts the writer thread on first use."""
+        spill = None
+        with self._cond:
+            if not self._rows:
+                self._batch_started = time.monotonic()
+            self._rows.append(row)
+            self._acks.append(ack)
+            if ack is not None:
+                self._unacked += 1
+            # Wake the writer when a batch starts (it waits without timeout while idle) or is due
+            if len(self._rows) == 1 or self._batch_due():
+                self._cond.notify()
+            if self.spool is not None and len(self._rows) > self.max_pending:
+                # PostgreSQL is not keeping up: move the oldest batch to disk rather than grow without bound
+                spill = self._take_batch()
+        if spill:
+            self._spool(*spill, "writer backlog over limit")
+        if not (self._thread and self._thread.is_alive()):
+            self.start()
+
+    def _batch_due(self):
+        """True if the pending rows fill a batch or hold the broker's whole in-flight window. Caller holds self._cond."""
+        return len(self._rows) >= self.batch_size or (0 < self.max_unacked <= self._unacked)
+
+    def start(self):
+        with self._cond:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop = False
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+        if self.replayer:
+            self.replayer.start()
+        writer_logger.info(f"{self.name}: batch writer started (batch size {self.batch_size}, flush interval {self.flush_interval}s).")
+
+    def stop(self, timeout=10.0):
+        """Flush pending rows and stop the writer thread."""
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout)
+        if self.replayer:
+            self.replayer.stop()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stop:
+                    if self._batch_due():
+                        break
+                    if self._rows:
+                        remaining = self.flush_interval - (time.monotonic() - self._batch_started)
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    else:
+                        self._cond.wait()
+                if self._stop and not self._rows:
+                    break
+                batch, acks = self._take_batch()
+                self._batch_started = time.monotonic() if self._rows else None
+            self._flush(batch, acks)
+        writer_logger.info("Batch writer stopped.")
+
+    def _take_batch(self):
+        """Remove and return (rows, acks) of the oldest batch. Caller holds self._cond."""
+        rows, acks = self._rows[:self.batch_size], self._acks[:self.batch_size]
+        self._rows, self._acks = self._rows[self.batch_size:], self._acks[self.batch_size:]
+        self._unacked -= sum(1 for ack in acks if ack is not None)
+        return rows, acks
+
+    def _release(self, acks):
+        """Run the ack callbacks of a batch whose outcome is final."""
+        for ack in acks:
+            if ack is None:
+                continue
+            try:
+                ack()
+            except Exception as e:
+                writer_logger.warning(f"⚠️ Could not acknowledge message: {e}")
+
+    def _ensure_prepared(self, conn, cursor):
+        """Run the prepare hook once (shared by flushes and spool replay)."""
+        with self._prepare_lock:
+            if self._prepare:
+                self._prepare(cursor)
+                conn.commit()
+                self._prepare = None
+
+    def _spool(self, batch, acks, reason):
+        try:
+            self.spool.append(batch, self.columns)
+            self.rows_spooled += len(batch)
+            writer_logger.warning(f"⚠️ Spooled {len(batch)} rows to disk ({reason}).")
+            self._release(acks)
+            return True
+        except OSError as e:
+            self.rows_failed += len(batch)
+            writer_logger.error(f"❌ Could not spool {len(batch)} rows ({reason}): {e}. Rows not stored.")
+            return False
+
+    def _flush(self, batch, acks=()):
+        started = time.monotonic()
+        if self.spool is not None and self.spool.has_backlog():
+            # Keep arrival order: new rows queue behind the spooled ones until the replayer catches up
+            return self._spool(batch, acks, "spool backlog pending")
+        conn = None
+        cursor = None
+        try:
+            conn = self.connection_factory()
+            if not conn:
+                if self.spool is not None:
+                    return self._spool(batch, acks, "no PostgreSQL connection")
+                self.rows_failed += len(batch)
+                writer_logger.error(f"❌ Failed to get PostgreSQL connection for batch insert. {len(batch)} rows not stored.")
+                return False
+            cursor = conn.cursor()
+            self._ensure_prepared(conn, cursor)
+            rejected = []
+            try:
+                psycopg2.extras.execute_values(
+                    cursor,
+                    self._insert_sql,
+                    batch,
+                    template=self._template,
+                    page_size=len(batch)
+                )
+                inserted = cursor.rowcount  # One page per batch, so this covers the whole batch
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                raise
+            except psycopg2.Error as e:
+                # One bad row fails the whole statement; find it instead of losing the other rows with it
+                conn.rollback()
+                writer_logger.warning(f"⚠️ Batch of {len(batch)} rows rejected by PostgreSQL ({e}); retrying it row by row.")
+                inserted, rejected = insert_row_by_row(cursor, self._insert_sql, self._template, batch)
+            conn.commit()
+            for row, error in rejected:
+                writer_logger.error(f"❌ Row rejected by PostgreSQL, not stored: {error}. Row: {str(row)[:200]}")
+            self.rows_written += inserted
+            self.rows_failed += len(rejected)
+            self.rows_duplicate += len(batch) - inserted - len(rejected)
+            self.batches_written += 1
+            writer_logger.info(f"✅ Stored batch of {inserted} rows in PostgreSQL table {self.table} "
+                               f"({len(batch) - inserted - len(rejected)} duplicates skipped, {len(rejected)} rejected).")
+            # Rejected rows are acked too: a redelivery would be rejected the same way
+            self._release(acks)
+            return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as db_err:
+            if conn:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    pass
+            if self.spool is not None:
+                return self._spool(batch, acks, f"PostgreSQL unavailable: {db_err}")
+            self.rows_failed += len(batch)
+            writer_logger.error(f"❌ PostgreSQL Error during batch insert of {len(batch)} rows into {self.table}: {db_err}")
+            return False
+        except psycopg2.Error as db_err:
+            # Not caused by a row (those are retried one by one above), e.g. the schema hook failed
+            if conn:
+                conn.rollback()
+            self.rows_failed += len(batch)
+            writer_logger.error(f"❌ PostgreSQL Error during batch insert of {len(batch)} rows into {self.table}: {db_err}")
+            self._release(acks)  # Redelivering rows PostgreSQL rejected would fail the same way
+            return False
+        except Exception as e:
+            if conn:
+                conn.rollback()
+            self.rows_failed += len(batch)
+            writer_logger.error(f"❌ Unexpected error during batch insert of {len(batch)} rows into {self.table}: {e}")
+            self._release(acks)
+            return False
+        finally:
+            self.last_flush_ms = (time.monotonic() - started) * 1000
+            if cursor:
+                cursor.close()
+            if conn:
+                conn.close()
+
+    def stats(self):
+        with self._cond:
+            pending = len(self._rows)
+            unacked = self._unacked
+        return {
+            'pending_rows': pending,
+            'unacked_rows': unacked,
+            'max_unacked': self.max_unacked,
+            'batch_size': self.batch_size,
+            'flush_interval': self.flush_interval,
+            'rows_written': self.rows_written,
+            'batches_written': self.batches_written,
+            'rows_failed': self.rows_failed,
+            'rows_spooled': self.rows_spooled,
+            'rows_duplicate': self.rows_duplicate,
+            'last_flush_ms': round(self.last_flush_ms, 2),
+            'spool': self.replayer.stats() if self.replayer else None,
+        }
+
+
+class PartitionedBatchWriter:
+    """`partitions` BatchWriters; a row goes to the writer picked by its `key_column` (device_id)."""
+
+    def __init__(self, partitions, connection_factory, table, columns=('timestamp', 'device_id', 'raw_data'),
+                 key_column='device_id', prepare=None, spool=None, **kwargs):
+        self.columns = tuple(columns)
+        self._key_index = self.columns.index(key_column)
+        self._prepare = prepare
+        self._prepare_lock = threading.Lock()
+        self.writers = [
+            # Partitions share the spool (it is thread-safe); only the first one replays it
+            BatchWriter(connection_factory, table, columns=columns, prepare=self._prepare_once if prepare else None,
+                        spool=spool, replay=(i == 0), name=f"BatchWriterThread-{i}", **kwargs)
+            for i in range(max(1, partitions))
+        ]
+        self.replayer = self.writers[0].replayer
+
+    def _prepare_once(self, cursor):
+        """Run the schema hook in one partition only; the others wait for it instead of racing its DDL."""
+        with self._prepare_lock:
+            if self._prepare:
+                self._prepare(cursor)
+                cursor.connection.commit()  # Visible before any other partition inserts
+                self._prepare = None
+
+    def partition_for(self, key):
+        """Index of the writer for `key`, stable across processes and restarts."""
+        return zlib.crc32(str(key).encode('utf-8')) % len(self.writers)
+
+    def add(self, row, ack=None):
+        self.writers[self.partition_for(row[self._key_index])].add(row, ack)
+
+    def start(self):
+        for writer in self.writers:
+            writer.start()
+
+    def stop(self, timeout=10.0):
+        for writer in self.writers:
+            writer.stop(timeout)
+
+    def stats(self):
+        partitions = [writer.stats() for writer in self.writers]
+        stats = {key: sum(p[key] for p in partitions)
+                 for key in ('pending_rows', 'unacked_rows', 'rows_written', 'batches_written', 'rows_failed', 'rows_spooled',
+                             'rows_duplicate')}
+        stats.update({
+            'batch_size': self.writers[0].batch_size,
+            'max_unacked': self.writers[0].max_unacked,
+            'flush_interval': self.writers[0].flush_interval,
+            'last_flush_ms': max(p['last_flush_ms'] for p in partitions),
+            'spool': partitions[0]['spool'],
+            'partitions': [{key: p[key] for key in ('pending_rows', 'rows_written', 'batches_written', 'last_flush_ms')}
+                           for p in partitions],
+        })
+        return stats
+
+
+def make_batch_writer(connection_factory, table, partitions=WRITER_PARTITIONS, **kwargs):
+    """A BatchWriter, or a PartitionedBatchWriter when `partitions` > 1."""
+    if partitions > 1:
+        return PartitionedBatchWriter(partitions, connection_factory, table, **kwargs)
+    return BatchWriter(connection_factory, table, **kwargs)
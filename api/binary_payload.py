@@ -0,0 +1,153 @@
+"""
+Compact binary MQTT payloads for the bulk topic, decoded via register_config.yaml.
+
+JSON messages repeat every register name in every sample. A binary frame
+instead carries the raw 16-bit register words of a contiguous address range,
+the way they are read from the Modbus device:
+
+    offset  size  field
+    0       1     marker 0xB1 (JSON payloads start with '{' or whitespace)
+    1       1     length N of device_id in bytes
+    2       8     timestamp, float64 seconds since the epoch (0 = use receive time)
+    10      2     start address (uint16)
+    12      2     register count C (uint16)
+    14      N     device_id (UTF-8)
+    14+N    2*C   register words (uint16)
+
+All fields are big-endian (Modbus byte order). decode_mqtt_payload() sniffs
+the first byte, so JSON and binary publishers can share a topic. Binary
+frames decode in one struct.unpack with a plan precompiled from
+REGISTER_CONFIG['by_address'] per address window: `sint16` words are
+sign-converted, `bool` is 0/1 and everything else is unsigned. The result is
+the same flat {'timestamp', 'device_id', <register name>: value} dict a JSON
+publisher sends; like JSON values they are stored unscaled, and
+RegisterDecoder (api/register_decoder.py) applies `scale` on read. Unconfigured
+addresses are skipped. When register_config.yaml is reloaded the decode
+table is rebuilt and the compiled plans are dropped.
+"""
+
+import json
+import struct
+from datetime import datetime, timezone
+
+from api.config_loader import REGISTER_CONFIG, CONFIG_REGISTRY
+
+BINARY_FORMAT_MARKER = 0xB1
+_HEADER = struct.Struct('>BBdHH')
+
+
+def build_decode_table(by_address):
+    """Return {address: (name, kind)} with kind 'bool', 'signed' or 'unsigned'."""
+    table = {}
+    for address, reg in by_address.items():
+        data_type = reg.get('dataType')
+        kind = 'bool' if data_type == 'bool' else 'signed' if data_type == 'sint16' else 'unsigned'
+        table[address] = (reg['name'], kind)
+    return table
+
+
+DECODE_TABLE = build_decode_table(REGISTER_CONFIG['by_address'])
+
+
+class _DecodePlan:
+    """Decoder for one (start address, count) window, compiled from the decode table."""
+
+    def __init__(self, table, start_address, count):
+        formats = []
+        self.names = []
+        self.bools = []
+        for address in range(start_address, start_address + count):
+            entry = table.get(address)
+            if entry is None:
+                formats.append('2x')  # Unconfigured address: skipped by struct
+                continue
+            name, kind = entry
+            if kind == 'bool':
+                self.bools.append(len(self.names))
+            self.names.append(name)
+            formats.append('h' if kind == 'signed' else 'H')
+        self.struct = struct.Struct('>' + ''.join(formats))
+
+    def decode(self, buffer, offset=0):
+        values = list(self.struct.unpack_from(buffer, offset))
+        for index in self.bools:
+            values[index] = 1 if values[index] else 0
+        return dict(zip(self.names, values))
+
+
+_MAX_PLANS = 64
+# (decode table, {(start address, count): _DecodePlan}); replaced as a pair on reload.
+# Publishers use a handful of windows.
+_compiled = (DECODE_TABLE, {})
+
+
+def _plan(start_address, count):
+    table, plans = _compiled
+    plan = plans.get((start_address, count))
+    if plan is None:
+        if len(plans) >= _MAX_PLANS:
+            plans.clear()
+        plan = plans[(start_address, count)] = _DecodePlan(table, start_address, count)
+    return plan
+
+
+def _rebuild_decode_table(config):
+    global DECODE_TABLE, _compiled
+    DECODE_TABLE = build_decode_table(config['by_address'])
+    _compiled = (DECODE_TABLE, {})
+
+
+CONFIG_REGISTRY.subscribe(_rebuild_decode_table)
+
+
+def decode_register_words(start_address, words):
+    """Convert raw uint16 register words starting at `start_address` into {register name: value}."""
+    words = [int(word) & 0xFFFF for word in words]
+    return _plan(start_address, len(words)).decode(struct.pack(f'>{len(words)}H', *words))
+
+
+# Largest frame timestamp datetime can represent (0 or negative means "not set")
+_MAX_TIMESTAMP = datetime(9999, 12, 31, 23, 59, 59, tzinfo=timezone.utc).timestamp()
+
+
+def decode_binary_payload(payload):
+    """Decode one binary frame into a flat message dict. Raises ValueError if it is malformed."""
+    if len(payload) < _HEADER.size:
+        raise ValueError(f"binary frame too short ({len(payload)} bytes)")
+    marker, id_length, timestamp, start_address, count = _HEADER.unpack_from(payload)
+    if marker != BINARY_FORMAT_MARKER:
+        raise ValueError(f"unknown binary frame marker 0x{marker:02X}")
+    offset = _HEADER.size
+    expected = offset + id_length + 2 * count
+    if len(payload) != expected:
+        raise ValueError(f"binary frame is {len(payload)} bytes, header describes {expected}")
+    device_id = bytes(payload[offset:offset + id_length]).decode('utf-8')
+    message = _plan(start_address, count).decode(payload, offset + id_length)
+    if not timestamp <= _MAX_TIMESTAMP:  # Also rejects NaN and infinity
+        raise ValueError("timestamp out of range")
+    if timestamp > 0:
+        message['timestamp'] = datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+    if device_id:
+        message['device_id'] = device_id
+    return message
+
+
+def encode_binary_payload(device_id, words, start_address=0, timestamp=None):
+    """Build a binary frame from raw register words (for publishers and tests)."""
+    device = (device_id or '').encode('utf-8')
+    if len(device) > 255:
+        raise ValueError("device_id is longer than 255 bytes")
+    if timestamp is None:
+        timestamp = 0.0
+    elif isinstance(timestamp, datetime):
+        timestamp = timestamp.timestamp()
+    words = [int(word) & 0xFFFF for word in words]
+    return (_HEADER.pack(BINARY_FORMAT_MARKER, len(device), float(timestamp), start_address, len(words))
+            + device + struct.pack(f'>{len(words)}H', *words))
+
+
+def decode_mqtt_payload(payload):
+    """Decode an MQTT message body: a binary frame or JSON. Raises ValueError if it is neither."""
+    if payload[:1] == bytes((BINARY_FORMAT_MARKER,)):
+        return decode_binary_payload(payload)
+    return json.loads(payload.decode('utf-8'))
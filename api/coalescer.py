@@ -0,0 +1,170 @@
+"""
+Coalesces per-sensor MQTT messages (vflow/sensors/<register>) into sample rows.
+
+Publishers on the per-sensor topics only send a register when it changes.
+Each device keeps its last known register values (seeded from the live
+cache, so per-sensor updates merge onto the latest bulk sample). Values are
+grouped into time slots of SENSOR_COALESCE_INTERVAL seconds; when a slot
+closes, one full row (last known state with the slot's changes applied) is
+emitted with the timestamp of the newest value in the slot. A slot-aligned
+timestamp would land on the (device_id, timestamp) of any bulk sample sent on
+a whole second, and the row would be dropped as a duplicate. A slot closes
+when a value for a later slot arrives, or SENSOR_COALESCE_GRACE seconds after
+it ends.
+
+Ack callbacks of the merged messages are combined and handed on with the row,
+so they are acknowledged together once the row is stored.
+"""
+
+import os
+import time
+import math
+import threading
+import logging
+from datetime import datetime, timezone
+
+# Width of a coalesced sample slot (seconds)
+SENSOR_COALESCE_INTERVAL = float(os.getenv('SENSOR_COALESCE_INTERVAL', '1.0'))
+# Extra wait for late messages before an idle slot is emitted (seconds)
+SENSOR_COALESCE_GRACE = float(os.getenv('SENSOR_COALESCE_GRACE', '0.5'))
+
+coalescer_logger = logging.getLogger("coalescer")
+
+
+def combine_acks(acks):
+    """Return one callback running every ack in `acks`, or None if there are none."""
+    acks = [ack for ack in acks if ack is not None]
+    if not acks:
+        return None
+
+    def ack_all():
+        for ack in acks:
+            try:
+                ack()
+            except Exception as e:
+                coalescer_logger.warning(f"⚠️ Could not acknowledge message: {e}")
+    return ack_all
+
+
+def _parse_timestamp(value):
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, timezone.utc)
+    if isinstance(value, str):
+        try:
+            parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+            return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+        except ValueError:
+            pass
+    return datetime.now(timezone.utc)
+
+
+class _DeviceSlot:
+    __slots__ = ('data', 'slot', 'latest', 'opened', 'acks')
+
+    def __init__(self, data):
+        self.data = data  # Last known {register: value} of the device
+        self.slot = None  # Start (epoch seconds) of the open slot, None if nothing is pending
+        self.latest = 0.0  # Newest value timestamp (epoch seconds) of the open slot
+        self.opened = 0.0  # time.monotonic() when the open slot received its first value
+        self.acks = []
+
+
+class SampleCoalescer:
+    """Merges single-register updates per device into time-aligned rows passed to `emit(payload, ack)`."""
+
+    def __init__(self, emit, seed=None, interval=SENSOR_COALESCE_INTERVAL, grace=SENSOR_COALESCE_GRACE):
+        self.emit = emit
+        self.seed = seed  # seed(device_id) -> last known 'data' dict or None
+        self.interval = max(0.001, interval)
+        self.grace = grace
+        self._devices = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.values_received = 0
+        self.rows_emitted = 0
+
+    def add(self, device_id, register, value, timestamp=None, ack=None):
+        """Apply one register value; may emit the device's previous slot."""
+        ts = _parse_timestamp(timestamp).timestamp()
+        slot = math.floor(ts / self.interval) * self.interval
+        ready = None
+        with self._lock:
+            self.values_received += 1
+            state = self._devices.get(device_id)
+            if state is None:
+                seeded = self.seed(device_id) if self.seed else None
+                state = self._devices[device_id] = _DeviceSlot(dict(seeded or {}))
+            if state.slot is not None and slot > state.slot:
+                ready = self._close(device_id, state)
+            if state.slot is None:
+                state.slot = slot
+                state.latest = ts
+                state.opened = time.monotonic()
+            state.latest = max(state.latest, ts)
+            # Late values (older slot than the open one) are folded into the open slot
+            state.data[register] = value
+            state.acks.append(ack)
+        if ready:
+            self.emit(*ready)
+        if not (self._thread and self._thread.is_alive()):
+            self.start()
+
+    def _close(self, device_id, state):
+        """Build (payload, ack) of the open slot and reset it. Caller holds self._lock."""
+        payload = {
+            'timestamp': datetime.fromtimestamp(state.latest, timezone.utc).isoformat(),
+            'device_id': device_id,
+            'data': dict(state.data),
+        }
+        ack = combine_acks(state.acks)
+        state.slot = None
+        state.acks = []
+        self.rows_emitted += 1
+        return payload, ack
+
+    def flush(self, force=False):
+        """Emit every slot that has been open longer than interval + grace (all of them if `force`)."""
+        now = time.monotonic()
+        ready = []
+        with self._lock:
+            for device_id, state in self._devices.items():
+                if state.slot is not None and (force or now - state.opened >= self.interval + self.grace):
+                    ready.append(self._close(device_id, state))
+        for payload, ack in ready:
+            try:
+                self.emit(payload, ack)
+            except Exception as e:
+                coalescer_logger.error(f"❌ Failed to emit coalesced sample for {payload['device_id']}: {e}", exc_info=True)
+
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name="SampleCoalescerThread", daemon=True)
+            self._thread.start()
+        coalescer_logger.info(f"Sample coalescer started (slot {self.interval}s, grace {self.grace}s).")
+
+    def stop(self, timeout=5.0):
+        """Stop the flush thread and emit whatever is still open."""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self.flush(force=True)
+
+    def _run(self):
+        tick = min(0.25, self.interval / 2)
+        while not self._stop_event.wait(tick):
+            self.flush()
+
+    def stats(self):
+        with self._lock:
+            pending = sum(1 for state in self._devices.values() if state.slot is not None)
+            return {
+                'devices': len(self._devices),
+                'open_slots': pending,
+                'interval': self.interval,
+                'values_received': self.values_received,
+                'rows_emitted': self.rows_emitted,
+            }
@@ -1,23 +1,70 @@
 # filepath: c:\\Users\\LeeJR\\Desktop\\VFlow\\Webpage\\V4\\api\\config_loader.py
 import yaml
 import os
+import marshal
+import hashlib
+import threading
+import logging
 from collections import defaultdict
+from collections.abc import Mapping
 
 CONFIG_PATH = os.path.join(os.path.dirname(__file__), '..', 'register_config.yaml') # Path relative to this file
+# Seconds between checks of register_config.yaml for changes (0 disables hot reload)
+CONFIG_WATCH_INTERVAL = float(os.getenv('CONFIG_WATCH_INTERVAL', '2.0'))
+# Parsed register_config.yaml cached by content hash, so a restart skips the YAML parse (empty = no cache)
+CONFIG_CACHE_PATH = os.getenv('CONFIG_CACHE_PATH',
+                              os.path.join(os.path.dirname(__file__), '__pycache__', 'register_config.cache'))
 
-def load_register_config():
+_CACHE_FORMAT = 1
+# libyaml's C parser when PyYAML was built with it; the pure-Python parser is several times slower
+_YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+config_logger = logging.getLogger("config_loader")
+
+def _read_config_data(path):
+    """Return (parsed YAML of `path`, 'compiled cache' or 'yaml')."""
+    with open(path, 'rb') as f:
+        raw = f.read()
+    digest = hashlib.sha256(raw).hexdigest()
+    if CONFIG_CACHE_PATH:
+        try:
+            with open(CONFIG_CACHE_PATH, 'rb') as f:
+                cache_format, cached_digest, config_data = marshal.load(f)
+            if cache_format == _CACHE_FORMAT and cached_digest == digest:
+                return config_data, 'compiled cache'
+        except (OSError, EOFError, ValueError, TypeError):
+            pass  # Missing, stale format or corrupt: parse the YAML
+    config_data = yaml.load(raw, Loader=_YAML_LOADER)
+    if CONFIG_CACHE_PATH:
+        tmp_path = f"{CONFIG_CACHE_PATH}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(CONFIG_CACHE_PATH), exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                marshal.dump((_CACHE_FORMAT, digest, config_data), f)
+            os.replace(tmp_path, CONFIG_CACHE_PATH)
+        except (OSError, ValueError) as e:  # Read-only install, or values marshal cannot store
+            config_logger.debug(f"register_config.yaml cache not written: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return config_data, 'yaml'
+
+def load_register_config(path=None):
     """Loads and processes the register_config.yaml configuration."""
-    if not os.path.exists(CONFIG_PATH):
-        raise FileNotFoundError(f"Configuration file not found: {CONFIG_PATH}")
+    return _load_register_config(path)[0]
+
+def _load_register_config(path=None):
+    """load_register_config() plus where the parsed YAML came from."""
+    path = path or CONFIG_PATH
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Configuration file not found: {path}")
 
-    with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
-        config_data = yaml.safe_load(f)
+    config_data, source = _read_config_data(path)
 
     if not config_data:
         raise ValueError("Configuration file is empty or invalid.")
 
-    registers = config_data.get('registers', [])
-    modbus_config = config_data.get('modbus', {}) # Load modbus section
+    registers = config_data.get('registers') or []
+    modbus_config = config_data.get('modbus') or {} # Load modbus section
 
     if not registers: # It's okay if registers are empty, but modbus section might be needed
         # Depending on requirements, you might want to raise an error if 'registers' is critical
@@ -73,11 +120,200 @@ def load_register_config():
         'min_address': min_address, # Add min_address
         'total_register_count': total_register_count, # Use the range-based count
         'modbus_ip': modbus_config.get('ip'), # Add Modbus IP
-        'modbus_port': modbus_config.get('port') # Add Modbus Port
-    }
+        'modbus_port': modbus_config.get('port'), # Add Modbus Port
+        'modbus_units': modbus_config.get('units') or [] # Optional list of polled units (api/modbus_poller.py)
+    }, source
+
+def validate_register_config(config):
+    """Raise ValueError if a loaded configuration cannot be served (checked before a reload is applied)."""
+    if not isinstance(config['raw'], list):
+        raise ValueError("'registers' must be a list")
+    addresses = set()
+    for index, reg in enumerate(config['raw']):
+        if not isinstance(reg, dict) or not isinstance(reg.get('name'), str) or not reg['name']:
+            raise ValueError(f"register #{index + 1} needs a 'name'")
+        address = reg.get('address')
+        if not isinstance(address, int) or isinstance(address, bool) or not 0 <= address <= 0xFFFF:
+            raise ValueError(f"register '{reg['name']}' needs an integer 'address' between 0 and 65535")
+        if address in addresses:
+            raise ValueError(f"address {address} is used by more than one register")
+        addresses.add(address)
+        scale = reg.get('scale', 1)
+        if scale is not None and (not isinstance(scale, (int, float)) or isinstance(scale, bool) or scale == 0):
+            raise ValueError(f"register '{reg['name']}' has an invalid 'scale' ({scale!r})")
+        if not isinstance(reg.get('ui', {}), dict):
+            raise ValueError(f"register '{reg['name']}': 'ui' must be a mapping")
+    if not isinstance(config['modbus_units'], list):
+        raise ValueError("'modbus.units' must be a list")
+
+def _compile_decoder(config):
+    from api.register_decoder import RegisterDecoder  # Imports NumPy
+    return RegisterDecoder(config['raw'])
+
+class ConfigRegistry:
+    """Holds the current register configuration and reloads it when register_config.yaml changes.
+
+    A reload parses and validates the file, rebuilds the indexes and the
+    RegisterDecoder, and runs the subscribers' validators, all before
+    anything is replaced; the new (config, decoder) pair is then swapped in
+    with one assignment, so readers see either the old or the new version,
+    never a mix. At startup the decoder is only compiled on first use, which
+    keeps NumPy out of the boot path. Subscribers are notified afterwards to rebuild their own
+    precomputed structures (decode plans, Modbus block plans, ...). An
+    invalid file is logged and the previous configuration stays active.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or CONFIG_PATH
+        self._signature = self._file_signature()
+        config, self.source = _load_register_config(self.path)
+        validate_register_config(config)
+        self._current = (config, None)  # Decoder compiled on first use
+        self.version = 1
+        self._subscribers = []  # (on_change, validate)
+        self._reload_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.reloads = 0
+        self.rejected = 0
+        self.last_error = None
+
+    @property
+    def config(self):
+        return self._current[0]
+
+    @property
+    def decoder(self):
+        config, decoder = self._current
+        if decoder is None:
+            with self._reload_lock:
+                config, decoder = self._current
+                if decoder is None:
+                    decoder = _compile_decoder(config)
+                    self._current = (config, decoder)
+        return decoder
+
+    def subscribe(self, on_change, validate=None):
+        """Call `on_change(config)` after each reload; `validate(config)` may reject one with ValueError."""
+        self._subscribers.append((on_change, validate))
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.path)
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    def reload(self):
+        """Load the file and swap it in. Returns True if the new configuration is active."""
+        with self._reload_lock:
+            self._signature = self._file_signature()
+            try:
+                config, self.source = _load_register_config(self.path)
+                validate_register_config(config)
+                decoder = _compile_decoder(config)
+                for _, validate in self._subscribers:
+                    if validate:
+                        validate(config)
+            except (OSError, yaml.YAMLError, ValueError, KeyError, TypeError) as e:
+                self.rejected += 1
+                self.last_error = str(e)
+                config_logger.error(f"❌ register_config.yaml not reloaded, keeping version {self.version}: {e}")
+                return False
+            self._current = (config, decoder)
+            self.version += 1
+            self.reloads += 1
+            self.last_error = None
+            subscribers = list(self._subscribers)
+        config_logger.info(f"🔄 register_config.yaml reloaded (version {self.version}, {len(config['raw'])} registers).")
+        self._notify(subscribers, config)
+        return True
+
+    def install(self, config):
+        """Swap in a configuration validated elsewhere (the parent's, in a worker process) and notify subscribers."""
+        with self._reload_lock:
+            self._current = (config, None)
+            self.version += 1
+            subscribers = list(self._subscribers)
+        self._notify(subscribers, config)
+
+    @staticmethod
+    def _notify(subscribers, config):
+        for on_change, _ in subscribers:
+            try:
+                on_change(config)
+            except Exception as e:
+                config_logger.error(f"❌ Config subscriber {getattr(on_change, '__name__', on_change)} failed: {e}", exc_info=True)
+
+    def check(self):
+        """Reload if the file changed since the last load. Returns True if a new configuration was applied."""
+        if self._file_signature() == self._signature:
+            return False
+        return self.reload()
+
+    def start_watching(self, interval=CONFIG_WATCH_INTERVAL):
+        if interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._watch, args=(interval,), name="ConfigWatcherThread", daemon=True)
+        self._thread.start()
+        config_logger.info(f"👀 Watching {os.path.basename(self.path)} for changes every {interval}s.")
+
+    def stop_watching(self, timeout=5.0):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _watch(self, interval):
+        while not self._stop_event.wait(interval):
+            try:
+                self.check()
+            except Exception as e:
+                config_logger.error(f"❌ Config watcher error: {e}", exc_info=True)
+
+    def stats(self):
+        return {
+            'version': self.version,
+            'registers': len(self.config['raw']),
+            'reloads': self.reloads,
+            'rejected': self.rejected,
+            'last_error': self.last_error,
+            'watching': bool(self._thread and self._thread.is_alive()),
+        }
+
+
+class _CurrentConfig(Mapping):
+    """Read-only view of the registry's current configuration dict (each lookup sees the latest version)."""
+
+    def __init__(self, registry):
+        self._registry = registry
+
+    def __getitem__(self, key):
+        return self._registry.config[key]
+
+    def __iter__(self):
+        return iter(self._registry.config)
+
+    def __len__(self):
+        return len(self._registry.config)
+
+
+class _CurrentDecoder:
+    """Forwards to the registry's current RegisterDecoder."""
+
+    def __init__(self, registry):
+        self._registry = registry
+
+    def __getattr__(self, name):
+        return getattr(self._registry.decoder, name)
+
 
-# --- Load the configuration ONCE when the module is imported ---
-REGISTER_CONFIG = load_register_config()
+# --- Load the configuration when the module is imported; CONFIG_REGISTRY swaps in later edits ---
+CONFIG_REGISTRY = ConfigRegistry()
+# Code that needs several lookups from one version should take CONFIG_REGISTRY.config once
+REGISTER_CONFIG = _CurrentConfig(CONFIG_REGISTRY)
+# Compiled with each configuration version; shared by the API endpoints
+REGISTER_DECODER = _CurrentDecoder(CONFIG_REGISTRY)
 
 # --- Optional: Print loaded config details for verification ---
 # print(f"✅ Register config loaded. Min Addr: {REGISTER_CONFIG['min_address']}, Max Addr: {REGISTER_CONFIG['max_address']}, Count: {REGISTER_CONFIG['total_register_count']}")
@@ -0,0 +1,256 @@
+"""
+Shared PostgreSQL connection pool.
+
+Single place where the PostgreSQL configuration is read from the environment.
+live_data, hist_data, the batch writer and the retention job in app.py all
+check connections out of the same pool instead of calling psycopg2.connect
+per request.
+
+`get_connection()` returns a pooled connection (or None on failure, like the
+old per-module helpers). Calling `close()` on it returns it to the pool, so
+existing `conn.close()` call sites keep working unchanged.
+"""
+
+import os
+import time
+import threading
+import logging
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+
+POSTGRES_CONFIG = {
+    'host': os.getenv('POSTGRES_HOST', 'localhost'),
+    'port': int(os.getenv('POSTGRES_PORT', '5432')),
+    'database': os.getenv('POSTGRES_DATABASE', 'sensor_data_rpi'), # Default to 'sensor_data_rpi' for consistency
+    'user': os.getenv('POSTGRES_USER', 'sensor_user'),         # Default to sensor_user
+    'password': os.getenv('POSTGRES_PASSWORD', 'Master123')   # Default to Master123
+}
+POSTGRES_TABLE = os.getenv('POSTGRES_TABLE', 'sensor_data_rpi')
+
+POOL_MIN_SIZE = int(os.getenv('POSTGRES_POOL_MIN', '1'))
+POOL_MAX_SIZE = int(os.getenv('POSTGRES_POOL_MAX', '5'))
+POOL_CHECKOUT_TIMEOUT = float(os.getenv('POSTGRES_POOL_TIMEOUT', '5.0'))  # seconds to wait for a free connection
+POOL_HEALTHCHECK_IDLE = float(os.getenv('POSTGRES_POOL_HEALTHCHECK_IDLE', '5.0'))  # ping connections idle longer than this
+
+pool_logger = logging.getLogger("db_pool")
+
+
+class PoolTimeout(psycopg2.pool.PoolError):
+    """Raised when no connection becomes available within the checkout timeout."""
+
+
+class PooledConnection:
+    """Thin proxy around a psycopg2 connection; close() returns it to the pool."""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        if name in ('_pool', '_conn'):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._conn, name, value)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self._conn.commit()
+        else:
+            self._conn.rollback()
+        self.close()
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.putconn(conn)
+
+    def __del__(self):
+        # Safety net for call sites that forget to close on an early return
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class PostgresPool:
+    """Thread-safe bounded pool with blocking checkout, health checks and usage stats."""
+
+    def __init__(self, config, minconn=POOL_MIN_SIZE, maxconn=POOL_MAX_SIZE,
+                 checkout_timeout=POOL_CHECKOUT_TIMEOUT, healthcheck_idle=POOL_HEALTHCHECK_IDLE):
+        self.config = config
+        self.minconn = max(0, minconn)
+        self.maxconn = max(1, maxconn, self.minconn)
+        self.checkout_timeout = checkout_timeout
+        self.healthcheck_idle = healthcheck_idle
+        self._idle = []  # list of (connection, returned_at)
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.health_check_failures = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+        for _ in range(self.minconn):
+            self._idle.append((self._connect(), time.monotonic()))
+
+    def _connect(self):
+        return psycopg2.connect(**self.config)
+
+    @property
+    def size(self):
+        return len(self._idle) + self._in_use
+
+    def _is_healthy(self, conn, idle_seconds):
+        if conn.closed:
+            return False
+        if idle_seconds < self.healthcheck_idle:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self, timeout=None):
+        """Check out a raw connection, waiting up to `timeout` seconds for one to free up."""
+        timeout = self.checkout_timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        with self._cond:
+            while not self._idle and self._in_use >= self.maxconn:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeout(f"No PostgreSQL connection available within {timeout}s (pool max {self.maxconn})")
+                self._cond.wait(remaining)
+            candidate = self._idle.pop() if self._idle else None
+            self._in_use += 1
+
+        # Connect / health check outside the lock so other threads are not blocked by network I/O
+        try:
+            if candidate is not None:
+                conn, returned_at = candidate
+                if not self._is_healthy(conn, time.monotonic() - returned_at):
+                    self.health_check_failures += 1
+                    pool_logger.warning("⚠️ Discarding unhealthy pooled PostgreSQL connection.")
+                    self._discard(conn)
+                    conn = self._connect()
+            else:
+                conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        wait_ms = (time.monotonic() - started) * 1000
+        with self._cond:
+            self.checkouts += 1
+            self.total_wait_ms += wait_ms
+            self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+        return conn
+
+    def putconn(self, conn):
+        """Return a connection to the pool, resetting any session state left by the caller."""
+        keep = not conn.closed
+        if keep:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                if conn.autocommit:
+                    conn.autocommit = False
+            except psycopg2.Error:
+                keep = False
+        with self._cond:
+            self._in_use -= 1
+            if keep and len(self._idle) < self.maxconn:
+                self._idle.append((conn, time.monotonic()))
+                conn = None
+            self._cond.notify()
+        if conn is not None:
+            self._discard(conn)
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def closeall(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'min_size': self.minconn,
+                'max_size': self.maxconn,
+                'size': self.size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'utilization': round(self._in_use / self.maxconn, 3),
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'health_check_failures': self.health_check_failures,
+                'avg_wait_ms': round(self.total_wait_ms / self.checkouts, 3) if self.checkouts else 0.0,
+                'max_wait_ms': round(self.max_wait_ms, 3),
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the process-wide pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = PostgresPool(POSTGRES_CONFIG)
+                pool_logger.info(f"PostgreSQL pool created for {POSTGRES_CONFIG['database']} (min {_pool.minconn}, max {_pool.maxconn}).")
+    return _pool
+
+
+def get_connection(timeout=None):
+    """Check out a pooled connection. Returns None (and logs) if PostgreSQL is unavailable."""
+    try:
+        return PooledConnection(get_pool(), get_pool().getconn(timeout))
+    except psycopg2.Error as e:
+        logging.error(f"❌ Failed to get PostgreSQL connection (DB: {POSTGRES_CONFIG.get('database')}): {e}")
+        return None
+
+
+def pool_stats():
+    return get_pool().stats() if _pool is not None else {'size': 0, 'in_use': 0, 'utilization': 0.0}
+
+
+def table_columns(table=POSTGRES_TABLE):
+    """Return the set of column names of `table`, or None if PostgreSQL is unavailable."""
+    conn = get_connection()
+    if not conn:
+        return None
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT column_name FROM information_schema.columns
+                WHERE table_schema = 'public' AND table_name = %s;
+            """, (table,))
+            return {row[0] for row in cursor.fetchall()}
+    except psycopg2.Error as e:
+        conn.rollback()
+        pool_logger.warning(f"⚠️ Could not read columns of {table}: {e}")
+        return None
+    finally:
+        conn.close()
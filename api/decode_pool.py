@@ -0,0 +1,328 @@
+"""
+Process-pool decode stage for MQTT bulk messages.
+
+Decoding a bulk message (JSON or binary frame), wrapping it in a live payload
+and building its batch writer row (raw_data JSON plus the typed register
+columns, or the packed array) is pure CPU work that otherwise runs under the
+GIL on the ingestion worker thread. With DECODE_WORKERS > 0, app.py hands
+bulk payloads to a DecodePool instead:
+
+    submit() -> micro-batch of up to DECODE_BATCH_SIZE messages, sent at the
+                latest DECODE_BATCH_WAIT seconds after its first message
+             -> ProcessPoolExecutor with DECODE_WORKERS processes
+             -> collector thread: batches are taken in submission order
+             -> on_result(payload, row, ack): dedup, live cache, SSE, writer
+
+Batches finish out of order, but the collector hands them on in the order
+they were submitted. Each device's samples therefore reach the writer in the
+order they were received. At most 4 batches per worker are in the pool at a
+time; beyond that submit() waits, which backs up into the bounded ingestion
+queue.
+
+Worker processes start with the parent's register configuration and
+storage layout (api/packed_storage.storage_layout), so their rows match the
+parent's batch writer. restart() replaces them after a reload of
+register_config.yaml. If the pool breaks, the affected batch is decoded in
+the collector thread instead.
+"""
+
+import os
+import time
+import threading
+import logging
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+from api.config_loader import CONFIG_REGISTRY
+from api.binary_payload import decode_mqtt_payload
+from api.packed_storage import sensor_row, storage_layout
+
+DECODE_WORKERS = int(os.getenv('DECODE_WORKERS', '0'))  # 0 = decode on the ingestion worker thread
+DECODE_BATCH_SIZE = int(os.getenv('DECODE_BATCH_SIZE', '64'))  # messages per micro-batch
+DECODE_BATCH_WAIT = float(os.getenv('DECODE_BATCH_WAIT', '0.005'))  # seconds a partial batch may wait
+DECODE_START_METHOD = os.getenv('DECODE_START_METHOD', 'spawn')  # worker processes never inherit app threads
+
+decode_logger = logging.getLogger("decode_pool")
+
+_worker_layout = None  # Storage layout of the parent, set in each worker process
+
+
+def build_live_payload(data):
+    """Wrap a decoded MQTT message in the structure POST /api/live-data expects."""
+    return {
+        'timestamp': data.get('timestamp', datetime.now(timezone.utc).isoformat()),
+        'device_id': data.get('device_id', 'unknown_device'),
+        'data': data # This is the original data from MQTT
+    }
+
+
+def transform_bulk(payload, layout=None):
+    """(live payload, batch writer row) of one bulk message. Raises ValueError if it cannot be decoded."""
+    data = decode_mqtt_payload(payload)
+    if not isinstance(data, dict):
+        raise ValueError(f"bulk message is a {type(data).__name__}, not an object")
+    live_payload = build_live_payload(data)
+    return live_payload, sensor_row(live_payload, layout)
+
+
+def _init_worker(config, layout):
+    global _worker_layout
+    CONFIG_REGISTRY.install(config)  # Binary frame plans follow the parent's configuration
+    _worker_layout = layout
+
+
+def _transform_batch(payloads):
+    """Runs in a worker process: [(True, result) or (False, error)] per payload, and the seconds it took."""
+    started = time.perf_counter()
+    results = []
+    for payload in payloads:
+        try:
+            results.append((True, transform_bulk(payload, _worker_layout)))
+        except Exception as e:  # Not only ValueError: one odd message (e.g. RecursionError) must not fail the batch
+            results.append((False, f"{type(e).__name__}: {e}"))
+    return results, time.perf_counter() - started
+
+
+class _StageTimer:
+    """Count, average and maximum duration of one pipeline stage."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds, count=1):
+        self.count += count
+        self.total += seconds * count
+        self.max = max(self.max, seconds)
+
+    def stats(self):
+        return {
+            'avg_ms': round(self.total / self.count * 1000, 3) if self.count else None,
+            'max_ms': round(self.max * 1000, 3),
+        }
+
+
+class _Batch:
+    def __init__(self):
+        self.payloads = []
+        self.acks = []
+        self.submitted = []  # monotonic time each message was submitted
+        self.future = None
+        self.executor = None
+        self.dispatched = None
+        self.done = None  # monotonic time the worker process finished it
+        self.delivered = 0  # Messages the collector has handed on or acknowledged
+
+
+class DecodePool:
+    """Decodes bulk messages in worker processes and hands them to `on_result(payload, row, ack)` in order."""
+
+    def __init__(self, on_result, workers=DECODE_WORKERS, batch_size=DECODE_BATCH_SIZE, batch_wait=DECODE_BATCH_WAIT,
+                 start_method=DECODE_START_METHOD):
+        self.on_result = on_result
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.batch_wait = batch_wait
+        self.max_inflight = self.workers * 4
+        self._context = multiprocessing.get_context(start_method)
+        self._executor = None
+        self._open = None  # Batch being filled
+        self._inflight = deque()  # Dispatched batches, in submission order
+        self._cond = threading.Condition()
+        self._stop = False
+        self._thread = None
+        self.submitted_count = 0
+        self.decoded_count = 0
+        self.invalid_count = 0
+        self.failed_count = 0
+        self.batch_count = 0
+        self.fallback_batches = 0
+        self.restarts = 0
+        self._timers = {stage: _StageTimer() for stage in ('batch_wait', 'decode', 'reorder_wait', 'ingest')}
+
+    def _new_executor(self):
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=self._context, initializer=_init_worker,
+                                   initargs=(CONFIG_REGISTRY.config, storage_layout()))
+
+    def start(self):
+        with self._cond:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop = False
+            if self._executor is None:
+                self._executor = self._new_executor()
+            self._thread = threading.Thread(target=self._run, name="DecodeCollectorThread", daemon=True)
+            self._thread.start()
+        decode_logger.info(f"Decode pool started ({self.workers} processes, batches of {self.batch_size}).")
+
+    def restart(self, config=None):
+        """Replace the worker processes (e.g. after a config reload); batches already sent still complete."""
+        with self._cond:
+            if self._executor is None:  # Not started: the processes get the current configuration anyway
+                return
+            old, self._executor = self._executor, self._new_executor()
+            self.restarts += 1
+        if old is not None:
+            old.shutdown(wait=False)
+        decode_logger.info("🔄 Decode pool restarted with the current register configuration.")
+
+    def stop(self, timeout=10.0):
+        """Decode and deliver what is already submitted, then stop the collector and the worker processes."""
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def submit(self, payload, ack=None):
+        """Add one raw bulk message to the current micro-batch; waits while too many batches are in flight."""
+        if not (self._thread and self._thread.is_alive()):
+            self.start()
+        with self._cond:
+            if self._open is None:
+                self._open = _Batch()
+            batch = self._open
+            batch.payloads.append(payload)
+            batch.acks.append(ack)
+            batch.submitted.append(time.monotonic())
+            self.submitted_count += 1
+            if len(batch.payloads) >= self.batch_size:
+                while len(self._inflight) >= self.max_inflight and not self._stop:
+                    self._cond.wait()
+                self._dispatch()
+            elif len(batch.payloads) == 1:
+                self._cond.notify_all()  # The collector times the new batch's wait
+
+    def _dispatch(self):
+        """Send the open batch to the pool. Caller holds self._cond."""
+        batch, self._open = self._open, None
+        if batch is None:
+            return
+        batch.dispatched = time.monotonic()
+        for submitted in batch.submitted:
+            self._timers['batch_wait'].add(batch.dispatched - submitted)
+        try:
+            batch.executor = self._executor
+            batch.future = self._executor.submit(_transform_batch, batch.payloads)
+            batch.future.add_done_callback(lambda future, batch=batch: self._batch_done(batch))
+        except RuntimeError as e:  # Pool broken or shut down: the collector decodes the batch itself
+            decode_logger.error(f"❌ Decode pool unavailable, decoding in-process: {e}")
+            batch.future = None
+        self._inflight.append(batch)
+        self.batch_count += 1
+        self._cond.notify_all()
+
+    def _batch_done(self, batch):
+        with self._cond:
+            batch.done = time.monotonic()
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._open is not None:
+                        age = time.monotonic() - self._open.submitted[0]
+                        if age >= self.batch_wait or self._stop:
+                            self._dispatch()
+                    head = self._inflight[0] if self._inflight else None
+                    if head is not None and (head.future is None or head.done is not None):
+                        break
+                    if self._stop and head is None and self._open is None:
+                        return
+                    self._cond.wait(self.batch_wait if self._open is not None else None)
+            try:
+                self._deliver(head)
+            except Exception as e:
+                # The head batch must still leave the queue, or the collector stops and ingestion hangs
+                decode_logger.error(f"❌ Could not deliver a decoded batch: {e}", exc_info=True)
+                self.failed_count += len(head.acks) - head.delivered
+                for ack in head.acks[head.delivered:]:
+                    self._ack(ack)
+            with self._cond:
+                self._inflight.popleft()
+                self._cond.notify_all()  # Room for a waiting submit()
+
+    def _results(self, batch):
+        """Results of a finished batch; decoded in this thread if the worker process failed."""
+        if batch.future is not None:
+            try:
+                results, seconds = batch.future.result(timeout=0)
+                self._timers['decode'].add(seconds / len(batch.payloads), len(batch.payloads))
+                self._timers['reorder_wait'].add(time.monotonic() - batch.done)
+                return results
+            except Exception as e:
+                decode_logger.error(f"❌ Decode worker failed ({e!r}); decoding the batch in-process.")
+                if batch.executor is self._executor:  # Later batches of the same broken pool need no new restart
+                    self._restart_broken()
+        self.fallback_batches += 1
+        results = []
+        for payload in batch.payloads:
+            try:
+                results.append((True, transform_bulk(payload)))
+            except Exception as e:
+                results.append((False, f"{type(e).__name__}: {e}"))
+        return results
+
+    def _restart_broken(self):
+        try:
+            self.restart()
+        except Exception as e:
+            decode_logger.error(f"❌ Could not restart the decode pool: {e}")
+
+    @staticmethod
+    def _ack(ack):
+        if ack:
+            try:
+                ack()
+            except Exception as e:
+                decode_logger.warning(f"⚠️ Could not acknowledge message: {e}")
+
+    def _deliver(self, batch):
+        results = self._results(batch)
+        started = time.monotonic()
+        for index, (payload, ack, (ok, result)) in enumerate(zip(batch.payloads, batch.acks, results)):
+            batch.delivered = index
+            if not ok:
+                # Undecodable payload: acknowledge it, a redelivery would fail the same way
+                self.invalid_count += 1
+                decode_logger.error(f"❌ Invalid bulk payload: {result}. Payload: {bytes(payload)[:200]!r}")
+                self._ack(ack)
+                continue
+            try:
+                live_payload, row = result
+                self.on_result(live_payload, row, ack)
+                self.decoded_count += 1
+            except Exception as e:
+                self.failed_count += 1
+                decode_logger.error(f"❌ Could not ingest a decoded bulk message: {e}", exc_info=True)
+                self._ack(ack)
+        batch.delivered = len(batch.payloads)
+        self._timers['ingest'].add((time.monotonic() - started) / len(batch.payloads), len(batch.payloads))
+
+    def stats(self):
+        with self._cond:
+            open_messages = len(self._open.payloads) if self._open else 0
+            inflight_messages = sum(len(batch.payloads) for batch in self._inflight)
+            inflight_batches = len(self._inflight)
+        return {
+            'workers': self.workers,
+            'batch_size': self.batch_size,
+            'queue_depth': open_messages + inflight_messages,
+            'inflight_batches': inflight_batches,
+            'max_inflight_batches': self.max_inflight,
+            'submitted': self.submitted_count,
+            'decoded': self.decoded_count,
+            'invalid': self.invalid_count,
+            'failed': self.failed_count,
+            'batches': self.batch_count,
+            'fallback_batches': self.fallback_batches,
+            'restarts': self.restarts,
+            'latency': {stage: timer.stats() for stage, timer in self._timers.items()},
+        }
@@ -0,0 +1,75 @@
+"""
+In-memory filter for recently ingested (device_id, timestamp) keys.
+
+Broker redeliveries and reconnect replays resend samples that were already
+ingested. The filter remembers the last DEDUP_RECENT_KEYS timestamps per
+device, so these replays are dropped before they touch the cache, the SSE
+stream or the batch writer. Anything older than the window still reaches the
+database, where the (device_id, timestamp) unique index and
+ON CONFLICT DO NOTHING discard it.
+
+A key only counts as stored once the writer has committed or spooled its row
+(stored() runs from the row's ack). Until then a repeat is still queued for
+the writer with its own ack: if the original is lost while PostgreSQL is down
+and unacknowledged, the broker's redelivery must not be acked and dropped.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+# Timestamps remembered per device (about an hour of 1 Hz samples by default)
+DEDUP_RECENT_KEYS = int(os.getenv('DEDUP_RECENT_KEYS', '4096'))
+
+
+class RecentKeyFilter:
+    """Bounded per-device set of recent timestamps; the oldest key is evicted first."""
+
+    NEW = 'new'
+    PENDING = 'pending'  # Seen, row not durable yet
+    STORED = 'stored'  # Row committed or spooled
+
+    def __init__(self, max_keys=DEDUP_RECENT_KEYS):
+        self.max_keys = max_keys
+        self._keys = {}  # device_id -> OrderedDict(timestamp -> stored flag)
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.duplicates = 0
+        self.pending_repeats = 0
+
+    def check(self, device_id, timestamp):
+        """Return NEW (and record the key as pending), PENDING or STORED."""
+        if self.max_keys <= 0:
+            return self.NEW
+        with self._lock:
+            self.checked += 1
+            keys = self._keys.get(device_id)
+            if keys is None:
+                keys = self._keys[device_id] = OrderedDict()
+            elif timestamp in keys:
+                if keys[timestamp]:
+                    self.duplicates += 1
+                    return self.STORED
+                self.pending_repeats += 1
+                return self.PENDING
+            keys[timestamp] = False
+            if len(keys) > self.max_keys:
+                keys.popitem(last=False)
+            return self.NEW
+
+    def stored(self, device_id, timestamp):
+        """Mark a key as durable; later repeats are dropped."""
+        with self._lock:
+            keys = self._keys.get(device_id)
+            if keys is not None and timestamp in keys:
+                keys[timestamp] = True
+
+    def stats(self):
+        with self._lock:
+            return {
+                'devices': len(self._keys),
+                'max_keys_per_device': self.max_keys,
+                'checked': self.checked,
+                'duplicates_dropped': self.duplicates,
+                'repeats_while_pending': self.pending_repeats,
+            }
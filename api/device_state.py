@@ -0,0 +1,193 @@
+"""
+Latest status of each device, fed by the MQTT status topic (vflow/status).
+
+Status messages (online/offline, alarms, firmware info, ...) are small and
+rare, so they are not written as sensor rows. Each message upserts one row
+per device in `<POSTGRES_TABLE>_device_state`; an older message never
+overwrites a newer one. GET /api/device-status returns the table.
+
+The upserts run on DeviceStateWriter's own thread, so a slow or unreachable
+database never stalls the ingestion worker. While PostgreSQL is unavailable
+the messages wait (unacknowledged) and are retried every
+DEVICE_STATE_RETRY_INTERVAL seconds, in arrival order.
+"""
+
+import os
+import json
+import threading
+import logging
+from collections import deque
+from datetime import datetime, timezone
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from api.db_pool import POSTGRES_TABLE, get_connection
+
+DEVICE_STATE_TABLE = f"{POSTGRES_TABLE}_device_state"
+DEVICE_STATE_RETRY_INTERVAL = float(os.getenv('DEVICE_STATE_RETRY_INTERVAL', '5.0'))  # seconds
+DEVICE_STATE_MAX_PENDING = int(os.getenv('DEVICE_STATE_MAX_PENDING', '1000'))  # queued messages before the oldest is dropped
+
+state_logger = logging.getLogger("device_state")
+
+_table_ready = False
+
+
+def ensure_device_state_table(cursor):
+    """Create the device state table if it does not exist."""
+    global _table_ready
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {DEVICE_STATE_TABLE} (
+            device_id VARCHAR(100) PRIMARY KEY,
+            state TEXT,
+            status JSONB NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL,
+            received_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+    _table_ready = True
+
+
+def update_device_state(status):
+    """Upsert one decoded status message. Returns True once it is committed (or known to be stale)."""
+    device_id = status.get('device_id', 'unknown_device')
+    state = status.get('status', status.get('state'))
+    updated_at = status.get('timestamp') or datetime.now(timezone.utc).isoformat()
+    conn = get_connection()
+    if not conn:
+        state_logger.error(f"❌ Failed to get PostgreSQL connection for status of {device_id}.")
+        return False
+    try:
+        with conn.cursor() as cursor:
+            if not _table_ready:
+                ensure_device_state_table(cursor)
+            cursor.execute(f"""
+                INSERT INTO {DEVICE_STATE_TABLE} AS s (device_id, state, status, updated_at, received_at)
+                VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP)
+                ON CONFLICT (device_id) DO UPDATE SET
+                    state = EXCLUDED.state,
+                    status = EXCLUDED.status,
+                    updated_at = EXCLUDED.updated_at,
+                    received_at = EXCLUDED.received_at
+                WHERE s.updated_at <= EXCLUDED.updated_at;
+            """, (device_id, None if state is None else str(state), json.dumps(status), updated_at))
+        conn.commit()
+        state_logger.info(f"✅ Device state of {device_id} updated ({state}).")
+        return True
+    except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            pass
+        state_logger.error(f"❌ PostgreSQL unavailable while storing status of {device_id}: {e}")
+        return False
+    except psycopg2.Error as e:
+        conn.rollback()
+        # Not retryable (e.g. an unparsable timestamp); report it as handled so it is not redelivered forever
+        state_logger.error(f"❌ PostgreSQL rejected status of {device_id}: {e}")
+        return True
+    finally:
+        conn.close()
+
+
+class DeviceStateWriter:
+    """Applies status messages with update_device_state() on a background thread; `ack()` runs once stored."""
+
+    def __init__(self, retry_interval=DEVICE_STATE_RETRY_INTERVAL, max_pending=DEVICE_STATE_MAX_PENDING):
+        self.retry_interval = retry_interval
+        self.max_pending = max(1, max_pending)
+        self._pending = deque()  # (status, ack) in arrival order
+        self._cond = threading.Condition()
+        self._stop = False
+        self._thread = None
+        self.stored = 0
+        self.retries = 0
+        self.dropped = 0
+
+    def add(self, status, ack=None):
+        """Queue one decoded status message. Starts the writer thread on first use."""
+        with self._cond:
+            if len(self._pending) >= self.max_pending:
+                # Left unacknowledged, so the broker redelivers it after a reconnect
+                self._pending.popleft()
+                self.dropped += 1
+                state_logger.warning("⚠️ Device state queue full; dropped the oldest status message.")
+            self._pending.append((status, ack))
+            self._cond.notify()
+        if not (self._thread and self._thread.is_alive()):
+            self.start()
+
+    def start(self):
+        with self._cond:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop = False
+            self._thread = threading.Thread(target=self._run, name="DeviceStateWriterThread", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5.0):
+        """Stop the thread; messages still queued stay unacknowledged."""
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stop:
+                    self._cond.wait()
+                if self._stop:
+                    return
+                status, ack = self._pending[0]
+            stored = update_device_state(status)
+            with self._cond:
+                if not stored:
+                    # PostgreSQL unavailable: keep the message at the head and retry it later
+                    self.retries += 1
+                    self._cond.wait(self.retry_interval)
+                    continue
+                if self._pending and self._pending[0][0] is status:
+                    self._pending.popleft()
+                self.stored += 1
+            if ack:
+                try:
+                    ack()
+                except Exception as e:
+                    state_logger.warning(f"⚠️ Could not acknowledge status message: {e}")
+
+    def stats(self):
+        with self._cond:
+            pending = len(self._pending)
+        return {
+            'pending': pending,
+            'stored': self.stored,
+            'retries': self.retries,
+            'dropped': self.dropped,
+        }
+
+
+device_state_writer = DeviceStateWriter()
+
+
+def read_device_states():
+    """Return all device state rows, most recently updated first."""
+    conn = get_connection()
+    if not conn:
+        return None
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            if not _table_ready:
+                ensure_device_state_table(cursor)
+                conn.commit()
+            cursor.execute(f"""
+                SELECT device_id, state, status, updated_at, received_at
+                FROM {DEVICE_STATE_TABLE} ORDER BY updated_at DESC;
+            """)
+            rows = [dict(row) for row in cursor.fetchall()]
+        for row in rows:
+            row['updated_at'] = row['updated_at'].isoformat()
+            row['received_at'] = row['received_at'].isoformat()
+        return rows
+    finally:
+        conn.close()
@@ -0,0 +1,126 @@
+"""
+Server-side downsampling for historical chart data.
+
+Each register is decimated independently so the chart shape is preserved:
+  - 'lttb':   Largest-Triangle-Three-Buckets (visually faithful line shape)
+  - 'minmax': min and max point of each equal-width time bucket (keeps spikes)
+
+`downsample_rows` works on the row dicts returned by /api/historical-data and
+returns at most ~max_points samples per register. Rows only carry the
+registers whose selected point falls on that timestamp.
+"""
+
+DOWNSAMPLE_METHODS = ('lttb', 'minmax')
+
+
+def lttb_indices(xs, ys, threshold):
+    """Return the indices selected by Largest-Triangle-Three-Buckets."""
+    n = len(xs)
+    if threshold >= n or n <= 2:
+        return list(range(n))
+    if threshold < 3:
+        return [0, n - 1]
+
+    selected = [0]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # Average point of the next bucket
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, n)
+        avg_len = avg_end - avg_start
+        avg_x = sum(xs[avg_start:avg_end]) / avg_len
+        avg_y = sum(ys[avg_start:avg_end]) / avg_len
+
+        # Point in the current bucket forming the largest triangle with a and the average
+        range_start = int(i * every) + 1
+        range_end = int((i + 1) * every) + 1
+        ax = xs[a]
+        ay = ys[a]
+        dx = ax - avg_x
+        dy = avg_y - ay
+        max_area = -1.0
+        next_a = range_start
+        for j in range(range_start, range_end):
+            area = abs(dx * (ys[j] - ay) - (ax - xs[j]) * dy)
+            if area > max_area:
+                max_area = area
+                next_a = j
+        selected.append(next_a)
+        a = next_a
+    selected.append(n - 1)
+    return selected
+
+
+def minmax_indices(xs, ys, n_buckets):
+    """Return the indices of the min and max point in each equal-width time bucket."""
+    n = len(xs)
+    if n <= 2 * n_buckets or n_buckets < 1:
+        return list(range(n))
+    x_min = xs[0]
+    width = (xs[-1] - x_min) / n_buckets or 1.0
+    selected = []
+    bucket = None
+    lo = hi = 0
+    for i in range(n):
+        b = min(int((xs[i] - x_min) / width), n_buckets - 1)
+        if b != bucket:
+            if bucket is not None:
+                selected.extend(sorted({lo, hi}))
+            bucket = b
+            lo = hi = i
+        else:
+            if ys[i] < ys[lo]:
+                lo = i
+            if ys[i] > ys[hi]:
+                hi = i
+    selected.extend(sorted({lo, hi}))
+    return selected
+
+
+def downsample_rows(rows, xs, max_points, method='lttb'):
+    """Decimate each register of `rows` to about `max_points` samples.
+
+    rows: list of dicts with 'timestamp' plus one key per register
+    xs:   numeric time (e.g. epoch seconds) for each row, ascending
+    """
+    if len(rows) <= max_points:
+        return rows
+
+    registers = []
+    seen = {'timestamp'}
+    for row in rows:
+        for key in row:
+            if key not in seen:
+                seen.add(key)
+                registers.append(key)
+
+    keep = {}  # row index -> list of registers to keep at that row
+    for reg in registers:
+        idx = []
+        ys = []
+        for i, row in enumerate(rows):
+            value = row.get(reg)
+            if isinstance(value, bool):
+                value = int(value)
+            if isinstance(value, (int, float)):
+                idx.append(i)
+                ys.append(value)
+        if not idx:
+            continue
+        reg_xs = [xs[i] for i in idx]
+        if method == 'minmax':
+            chosen = minmax_indices(reg_xs, ys, max(1, max_points // 2))
+        else:
+            chosen = lttb_indices(reg_xs, ys, max_points)
+        for k in chosen:
+            keep.setdefault(idx[k], []).append(reg)
+
+    result = []
+    for i in sorted(keep):
+        row = rows[i]
+        out = {'timestamp': row.get('timestamp')}
+        for reg in keep[i]:
+            out[reg] = row[reg]
+        result.append(out)
+    return result
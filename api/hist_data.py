@@ -3,27 +3,17 @@ from flask_login import login_required, current_user
 from datetime import datetime, timedelta, timezone
 import io
 import csv
+import itertools
 import logging
 import psycopg2
 import psycopg2.extras
 import json
 import os
-# from dotenv import load_dotenv # Already imported but will be part of the new block
 
 # --- Environment Variable Loading ---
 # Assuming this file (hist_data.py) is in the 'api' subdirectory
-project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
-dotenv_path = os.path.join(project_root, '.env')
-try:
-    from dotenv import load_dotenv
-    if os.path.exists(dotenv_path):
-        load_dotenv(dotenv_path=dotenv_path, override=True)
-        # Use a unique print statement to confirm which file is loading
-        print(f"✅ api/hist_data.py: Environment variables loaded from {dotenv_path}")
-    else:
-        print(f"⚠️ api/hist_data.py: .env file not found at {dotenv_path}. Using system environment variables only.")
-except ImportError:
-    print("⚠️ api/hist_data.py: python-dotenv not available, using system environment variables only")
+from api.startup import load_env
+load_env("api/hist_data.py")  # No-op if app.py already loaded .env
 # --- End Environment Variable Loading ---
 
 
@@ -32,26 +22,17 @@ from api.config_loader import REGISTER_CONFIG
 
 # Import centralized timezone configuration
 from api.timezone_config import set_timezone
+from api.db_pool import POSTGRES_TABLE, get_connection
+from api.queries import parse_variables_param, register_projection, projected_values
+from api.packed_storage import packed_select_sql, row_payload
+
+# Rows fetched per round trip by the server-side cursor behind the CSV export
+EXPORT_ITERSIZE = int(os.getenv('EXPORT_ITERSIZE', '2000'))
 
 # PostgreSQL connection helper
 def get_db_connection():
-    """Get PostgreSQL database connection"""
-    try:
-        # Load database configuration from environment
-        # from dotenv import load_dotenv # load_dotenv() is now at the top of the file
-        # load_dotenv() # No longer needed here
-        
-        conn = psycopg2.connect(
-            host=os.getenv('POSTGRES_HOST', 'localhost'),
-            database=os.getenv('POSTGRES_DATABASE', 'sensor_data'), # Default to sensor_data
-            user=os.getenv('POSTGRES_USER', 'sensor_user'),         # Default to sensor_user
-            password=os.getenv('POSTGRES_PASSWORD', 'Master123'),   # Default to Master123
-            port=int(os.getenv('POSTGRES_PORT', '5432'))          # Ensure port is int
-        )
-        return conn
-    except Exception as e:
-        logging.error(f"Failed to connect to PostgreSQL in hist_data: {e}")
-        return None
+    """Get a pooled PostgreSQL connection; close() returns it to the pool"""
+    return get_connection()
 
 def parse_mqtt_data(raw_data):
     """Parse raw_data JSONB field from PostgreSQL to extract sensor values"""
@@ -59,7 +40,7 @@ def parse_mqtt_data(raw_data):
         if isinstance(raw_data, str):
             data = json.loads(raw_data)
         else:
-            data = raw_data
+            data = raw_data or {}
         
         # Extract sensor data from MQTT JSON structure
         sensor_data = {}
@@ -94,6 +75,7 @@ def export_historical_csv():
     range_param = request.args.get('range', '30d')
     start_date_str = request.args.get('start')
     end_date_str = request.args.get('end')
+    variables = parse_variables_param(request.args.get('variables'))
     
     now = datetime.now(set_timezone)
     start_time = None
@@ -129,71 +111,54 @@ def export_historical_csv():
         return jsonify({"error": "Database connection failed"}), 500
 
     try:
-        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        # Server-side cursor so the export is read EXPORT_ITERSIZE rows at a time
+        cur = conn.cursor(name='export_csv_stream', cursor_factory=psycopg2.extras.RealDictCursor)
+        cur.itersize = EXPORT_ITERSIZE
         
-        # Query sensor data within time range
-        query = """
-            SELECT timestamp, device_id, raw_data 
-            FROM sensor_data 
-            WHERE timestamp >= %s AND timestamp <= %s 
-            ORDER BY timestamp ASC
-        """
-        
-        cur.execute(query, (start_time, end_time))
-        records = cur.fetchall()
-        
-        if not records:
-            return jsonify({"error": "No data found for the specified range"}), 404
-
-        # Create CSV data
-        csv_buffer = io.StringIO()
-        
-        # Get all possible sensor names from register config for CSV headers
-        all_sensor_names = set()
-        historical_sensors = REGISTER_CONFIG.get('by_view', {}).get('historical', [])
-        for reg in historical_sensors:
-            all_sensor_names.add(reg['name'])
-        
-        # Also check actual data to get any additional sensor names
-        for record in records[:10]:  # Check first 10 records for sensor names
-            mqtt_data = parse_mqtt_data(record['raw_data'])
-            all_sensor_names.update(mqtt_data.keys())
-        
-        all_sensor_names = sorted(list(all_sensor_names))
-        
-        # Create CSV headers
-        headers = ['timestamp', 'device_id'] + all_sensor_names
-        writer = csv.DictWriter(csv_buffer, fieldnames=headers)
-        writer.writeheader()
-        
-        # Write data rows
-        for record in records:
-            mqtt_data = parse_mqtt_data(record['raw_data'])
+        if variables:
+            # Only the selected registers are extracted from raw_data, in SQL
+            projection_sql, projection_params = register_projection(variables)
+            query = f"""
+                SELECT timestamp, device_id, {projection_sql} 
+                FROM {POSTGRES_TABLE} 
+                WHERE timestamp >= %s AND timestamp <= %s 
+                ORDER BY timestamp ASC
+            """
+            cur.execute(query, projection_params + [start_time, end_time])
+            first_records = cur.fetchmany(10)
+            all_sensor_names = variables
+        else:
+            # Query sensor data within time range
+            query = f"""
+                SELECT timestamp, device_id, raw_data{packed_select_sql()} 
+                FROM {POSTGRES_TABLE} 
+                WHERE timestamp >= %s AND timestamp <= %s 
+                ORDER BY timestamp ASC
+            """
             
-            row = {
-                'timestamp': record['timestamp'].isoformat(),
-                'device_id': record['device_id']
-            }
+            cur.execute(query, (start_time, end_time))
+            first_records = cur.fetchmany(10)  # First 10 records are also used to discover sensor names
             
-            # Add sensor values
-            for sensor_name in all_sensor_names:
-                row[sensor_name] = mqtt_data.get(sensor_name, '')
+            # Get all possible sensor names from register config for CSV headers
+            all_sensor_names = set()
+            historical_sensors = REGISTER_CONFIG.get('by_view', {}).get('historical', [])
+            for reg in historical_sensors:
+                all_sensor_names.add(reg['name'])
             
-            writer.writerow(row)
-        
-        cur.close()
-        conn.close()
-        
-        # Create response
-        csv_content = csv_buffer.getvalue()
-        csv_buffer.close()
+            # Also check actual data to get any additional sensor names
+            for record in first_records:
+                mqtt_data = parse_mqtt_data(row_payload(record))
+                all_sensor_names.update(mqtt_data.keys())
+            
+            all_sensor_names = sorted(list(all_sensor_names))
         
-        response = make_response(csv_content)
-        response.headers['Content-Type'] = 'text/csv'
-        response.headers['Content-Disposition'] = f'attachment; filename=sensor_data_{range_param}.csv'
+        if not first_records:
+            cur.close()
+            conn.close()
+            return jsonify({"error": "No data found for the specified range"}), 404
         
-        logging.info(f"Exported {len(records)} records for range {range_param}")
-        return response
+        # Create CSV headers
+        headers = ['timestamp', 'device_id'] + all_sensor_names
         
     except Exception as e:
         logging.error(f"Error exporting CSV: {e}")
@@ -201,6 +166,51 @@ def export_historical_csv():
             conn.close()
         return jsonify({"error": f"Export failed: {str(e)}"}), 500
 
+    def generate():
+        # One reusable line buffer; each CSV line is yielded as soon as it is written
+        line_buffer = io.StringIO()
+        writer = csv.DictWriter(line_buffer, fieldnames=headers)
+
+        def flush_line():
+            line = line_buffer.getvalue()
+            line_buffer.seek(0)
+            line_buffer.truncate(0)
+            return line
+
+        record_count = 0
+        try:
+            writer.writeheader()
+            yield flush_line()
+            for record in itertools.chain(first_records, cur):
+                if variables:
+                    mqtt_data = projected_values(record, variables)
+                else:
+                    mqtt_data = parse_mqtt_data(row_payload(record))
+                
+                row = {
+                    'timestamp': record['timestamp'].isoformat(),
+                    'device_id': record['device_id']
+                }
+                
+                # Add sensor values
+                for sensor_name in all_sensor_names:
+                    value = mqtt_data.get(sensor_name)
+                    row[sensor_name] = '' if value is None else value
+                
+                writer.writerow(row)
+                record_count += 1
+                yield flush_line()
+            logging.info(f"Exported {record_count} records for range {range_param}")
+        except Exception as e:
+            logging.error(f"Error streaming CSV export after {record_count} records: {e}")
+        finally:
+            cur.close()
+            conn.close()
+
+    response = Response(generate(), mimetype='text/csv')
+    response.headers['Content-Disposition'] = f'attachment; filename=sensor_data_{range_param}.csv'
+    return response
+
 @historical_data_api.route('/historical-data/columns', methods=['GET'])
 @login_required
 def get_available_columns():
@@ -213,9 +223,9 @@ def get_available_columns():
         cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
         
         # Get recent records to determine available sensor columns
-        query = """
-            SELECT raw_data 
-            FROM sensor_data 
+        query = f"""
+            SELECT timestamp, device_id, raw_data{packed_select_sql()} 
+            FROM {POSTGRES_TABLE} 
             ORDER BY timestamp DESC 
             LIMIT 50
         """
@@ -226,7 +236,7 @@ def get_available_columns():
         # Extract all unique sensor names
         all_sensors = set()
         for record in records:
-            mqtt_data = parse_mqtt_data(record['raw_data'])
+            mqtt_data = parse_mqtt_data(row_payload(record))
             all_sensors.update(mqtt_data.keys())
         
         cur.close()
@@ -275,7 +285,7 @@ def get_latest_timestamp():
     try:
         cur = conn.cursor()
         
-        query = "SELECT MAX(timestamp) as latest_timestamp FROM sensor_data"
+        query = f"SELECT MAX(timestamp) as latest_timestamp FROM {POSTGRES_TABLE}"
         cur.execute(query)
         result = cur.fetchone()
         
@@ -0,0 +1,211 @@
+"""
+In-process ingestion queue for live sensor data.
+
+The MQTT client in app.py used to POST every message back to
+http://localhost:<port>/api/live-data. Messages are now handed to a bounded
+queue instead and a single worker thread drains it, calling the same
+cache/store path as the POST endpoint (which is kept for external producers).
+The paho network thread therefore never blocks on the API or the database.
+
+A payload may carry an `ack` callback (the MQTT PUBACK of a QoS 1 message).
+It is handed on to the handler, which calls it once the sample is stored; the
+queue itself acks messages it drops or fails to process, so the broker's
+in-flight window never fills up with messages nobody will acknowledge.
+
+With `partitions` > 1 the queue has one bounded queue and worker thread per
+partition, and `submit(..., key=...)` picks the partition. app.py keys
+messages by MQTT subscriber worker, so each subscriber connection is drained
+by its own worker, in the order the broker delivered its messages.
+
+TopicRouter maps MQTT topics to handlers. The MQTT client queues raw
+(topic, payload) messages and the worker dispatches them, so even JSON
+decoding happens off the network thread.
+"""
+
+import os
+import queue
+import threading
+import logging
+
+# Maximum number of messages waiting for the worker before new ones are dropped
+INGEST_QUEUE_MAXSIZE = int(os.getenv('INGEST_QUEUE_MAXSIZE', '10000'))
+
+# Distinct concrete topics whose wildcard match is remembered by TopicRouter
+TOPIC_ROUTE_CACHE_SIZE = 4096
+
+ingestion_logger = logging.getLogger("ingestion")
+
+
+def _call_ack(ack):
+    """Run an ack callback, logging (not raising) if it fails."""
+    if ack is None:
+        return
+    try:
+        ack()
+    except Exception as e:
+        ingestion_logger.warning(f"⚠️ Could not acknowledge message: {e}")
+
+
+class IngestionQueue:
+    """Bounded queue(s) drained by worker threads that call `handler(payload, ack=ack)`."""
+
+    def __init__(self, handler, maxsize=INGEST_QUEUE_MAXSIZE, partitions=1):
+        self.handler = handler
+        self._queues = [queue.Queue(maxsize=maxsize) for _ in range(max(1, partitions))]
+        self._stop_event = threading.Event()
+        self._threads = []
+        self._count_lock = threading.Lock()
+        self.enqueued_count = 0
+        self.processed_count = 0
+        self.dropped_count = 0
+        self.fail_count = 0
+
+    def submit(self, payload, ack=None, key=None):
+        """Queue a payload (in the partition of `key`) without blocking. Returns False if that queue is full."""
+        work_queue = self._queues[hash(key) % len(self._queues)] if key is not None else self._queues[0]
+        try:
+            work_queue.put_nowait((payload, ack))
+        except queue.Full:
+            with self._count_lock:
+                self.dropped_count += 1
+            ingestion_logger.warning(f"⚠️ Ingestion queue full ({work_queue.maxsize}). Dropped message #{self.dropped_count}.")
+            _call_ack(ack)
+            return False
+        with self._count_lock:
+            self.enqueued_count += 1
+        return True
+
+    def start(self):
+        if any(thread.is_alive() for thread in self._threads):
+            return
+        self._stop_event.clear()
+        self._threads = []
+        for i, work_queue in enumerate(self._queues):
+            name = "IngestionWorkerThread" if len(self._queues) == 1 else f"IngestionWorkerThread-{i}"
+            thread = threading.Thread(target=self._run, args=(work_queue,), name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        ingestion_logger.info(f"Ingestion worker(s) started ({len(self._queues)} x queue size {self._queues[0].maxsize}).")
+
+    def stop(self, timeout=5.0):
+        """Stop the workers after they have drained what is already queued."""
+        self._stop_event.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _run(self, work_queue):
+        while not (self._stop_event.is_set() and work_queue.empty()):
+            try:
+                payload, ack = work_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                if ack is None:
+                    self.handler(payload)
+                else:
+                    self.handler(payload, ack=ack)
+                with self._count_lock:
+                    self.processed_count += 1
+            except Exception as e:
+                with self._count_lock:
+                    self.fail_count += 1
+                ingestion_logger.error(f"❌ Ingestion worker failed to process message: {e}", exc_info=True)
+                _call_ack(ack)
+            finally:
+                work_queue.task_done()
+        ingestion_logger.info("Ingestion worker stopped.")
+
+    def stats(self):
+        stats = {
+            'queue_depth': sum(work_queue.qsize() for work_queue in self._queues),
+            'queue_maxsize': sum(work_queue.maxsize for work_queue in self._queues),
+            'enqueued': self.enqueued_count,
+            'processed': self.processed_count,
+            'dropped': self.dropped_count,
+            'failed': self.fail_count,
+        }
+        if len(self._queues) > 1:
+            stats['partition_depths'] = [work_queue.qsize() for work_queue in self._queues]
+        return stats
+
+
+class TopicRouter:
+    """Precompiled MQTT topic -> handler dispatch table.
+
+    `routes` maps subscription patterns (with MQTT '+' and '#' wildcards) to
+    `handler(payload, params, ack)`, where `params` are the topic levels
+    matched by the wildcards. Exact topics are a dict lookup; wildcard
+    matches are cached per concrete topic.
+    """
+
+    def __init__(self, routes):
+        self.topics = tuple(routes)
+        self._exact = {}
+        self._wildcards = []  # (pattern levels, handler), in registration order
+        for pattern, handler in routes.items():
+            if '+' in pattern or '#' in pattern:
+                self._wildcards.append((tuple(pattern.split('/')), handler))
+            else:
+                self._exact[pattern] = handler
+        self._cache = {}
+        self.dispatched = {}
+        self.unrouted = 0
+
+    @staticmethod
+    def _match(levels, parts):
+        params = []
+        for i, level in enumerate(levels):
+            if level == '#':
+                params.append('/'.join(parts[i:]))
+                return params
+            if i >= len(parts):
+                return None
+            if level == '+':
+                params.append(parts[i])
+            elif level != parts[i]:
+                return None
+        return params if len(parts) == len(levels) else None
+
+    def route(self, topic):
+        """Return (pattern, handler, params) for `topic`, or None if no route matches."""
+        handler = self._exact.get(topic)
+        if handler is not None:
+            return topic, handler, ()
+        cached = self._cache.get(topic)
+        if cached is not None:
+            return cached
+        parts = topic.split('/')
+        for levels, handler in self._wildcards:
+            params = self._match(levels, parts)
+            if params is not None:
+                cached = ('/'.join(levels), handler, tuple(params))
+                if len(self._cache) >= TOPIC_ROUTE_CACHE_SIZE:
+                    self._cache.clear()
+                self._cache[topic] = cached
+                return cached
+        return None
+
+    def dispatch(self, message, ack=None):
+        """IngestionQueue handler: route one (topic, payload) message."""
+        topic, payload = message
+        routed = self.route(topic)
+        if routed is None:
+            self.unrouted += 1
+            ingestion_logger.debug(f"No handler for MQTT topic {topic}; message ignored.")
+            _call_ack(ack)
+            return
+        pattern, handler, params = routed
+        self.dispatched[pattern] = self.dispatched.get(pattern, 0) + 1
+        try:
+            handler(payload, params, ack)
+        except ValueError as e:
+            # Undecodable payload: acknowledge it, a redelivery would fail the same way
+            ingestion_logger.error(f"❌ Invalid payload on {topic}: {e}. Payload: {bytes(payload)[:200]!r}")
+            _call_ack(ack)
+
+    def stats(self):
+        return {
+            'topics': list(self.topics),
+            'dispatched': dict(self.dispatched),
+            'unrouted': self.unrouted,
+        }
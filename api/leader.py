@@ -0,0 +1,205 @@
+"""
+Single ingestion leader across WSGI worker processes.
+
+With several workers (gunicorn, see wsgi.py) every worker imports app.py, but
+only one may run the MQTT subscriber, the Modbus scheduler and the
+background jobs, or each sample would be ingested once per worker.
+IngestionLeader elects that process with an exclusive lock:
+
+  - 'file' (default): an flock on INGEST_LEADER_LOCK_FILE. The kernel drops
+    it when the process dies, so no stale lock survives a crash or power cut.
+  - 'postgres': pg_try_advisory_lock(INGEST_LEADER_LOCK_KEY) on a dedicated
+    connection, for processes on several hosts sharing one database. The
+    lock is lost with the connection; the leader checks it every
+    LEADER_RETRY_INTERVAL seconds and reports the loss via `on_lost`.
+
+Workers that lose the election serve HTTP only and retry every
+LEADER_RETRY_INTERVAL seconds, so another worker takes over when the
+leader's process exits.
+"""
+
+import os
+import tempfile
+import threading
+import logging
+from datetime import datetime, timezone
+import psycopg2
+
+from api.db_pool import POSTGRES_CONFIG
+
+# 'file' or 'postgres'
+INGEST_LEADER_LOCK = os.getenv('INGEST_LEADER_LOCK', 'file').lower()
+INGEST_LEADER_LOCK_FILE = os.getenv('INGEST_LEADER_LOCK_FILE',
+                                    os.path.join(tempfile.gettempdir(), 'vflow_ingest_leader.lock'))
+INGEST_LEADER_LOCK_KEY = int(os.getenv('INGEST_LEADER_LOCK_KEY', '7321001'))  # advisory lock id
+LEADER_RETRY_INTERVAL = float(os.getenv('LEADER_RETRY_INTERVAL', '5.0'))  # seconds
+
+leader_logger = logging.getLogger("leader")
+
+
+class FileLeaderLock:
+    """Exclusive, non-blocking lock on a file, held while the file stays open."""
+
+    def __init__(self, path=INGEST_LEADER_LOCK_FILE):
+        self.path = path
+        self._file = None
+
+    def try_acquire(self):
+        if self._file is not None:
+            return True
+        lock_file = open(self.path, 'a+')
+        try:
+            _lock_file(lock_file)
+        except OSError:
+            lock_file.close()
+            return False
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(f"{os.getpid()}\n")
+        lock_file.flush()
+        self._file = lock_file
+        return True
+
+    def is_held(self):
+        return self._file is not None  # flock cannot be taken away from a live process
+
+    def release(self):
+        if self._file is not None:
+            self._file.close()  # Closing the file drops the lock
+            self._file = None
+
+    def describe(self):
+        return f"lock file {self.path}"
+
+
+def _lock_file(lock_file):
+    try:
+        import fcntl
+    except ImportError:  # Windows (waitress): lock the first byte instead
+        import msvcrt
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        return
+    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+
+class PostgresLeaderLock:
+    """Session-level PostgreSQL advisory lock on its own (unpooled) connection."""
+
+    def __init__(self, key=INGEST_LEADER_LOCK_KEY, connect=None):
+        self.key = key
+        self._connect = connect or (lambda: psycopg2.connect(**POSTGRES_CONFIG, connect_timeout=5))
+        self._conn = None
+
+    def try_acquire(self):
+        if self._conn is not None:
+            return self.is_held()
+        try:
+            conn = self._connect()
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT pg_try_advisory_lock(%s);", (self.key,))
+                acquired = cursor.fetchone()[0]
+        except psycopg2.Error as e:
+            leader_logger.warning(f"⚠️ Could not try the leader lock in PostgreSQL: {e}")
+            return False
+        if not acquired:
+            conn.close()
+            return False
+        self._conn = conn
+        return True
+
+    def is_held(self):
+        """True while the lock's connection is alive (a dead connection has released the lock)."""
+        if self._conn is None:
+            return False
+        try:
+            with self._conn.cursor() as cursor:
+                cursor.execute("SELECT 1;")
+            return True
+        except psycopg2.Error:
+            self.release()
+            return False
+
+    def release(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()  # Ends the session, which releases the advisory lock
+            except psycopg2.Error:
+                pass
+            self._conn = None
+
+    def describe(self):
+        return f"PostgreSQL advisory lock {self.key}"
+
+
+def make_leader_lock(kind=INGEST_LEADER_LOCK):
+    if kind == 'postgres':
+        return PostgresLeaderLock()
+    if kind == 'file':
+        return FileLeaderLock()
+    raise ValueError(f"INGEST_LEADER_LOCK must be 'file' or 'postgres', not '{kind}'")
+
+
+class IngestionLeader:
+    """Runs `on_elected()` once in the process that wins the leader lock; `on_lost()` if it is lost."""
+
+    def __init__(self, on_elected, on_lost=None, lock=None, retry_interval=LEADER_RETRY_INTERVAL):
+        self.on_elected = on_elected
+        self.on_lost = on_lost
+        self.lock = lock or make_leader_lock()
+        self.retry_interval = retry_interval
+        self.is_leader = False
+        self.elected_at = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Try to become leader right away; keep trying (or keep checking the lock) in the background."""
+        if self._thread and self._thread.is_alive():
+            return self.is_leader
+        self._stop_event.clear()
+        self._try_elect()
+        self._thread = threading.Thread(target=self._run, name="IngestionLeaderThread", daemon=True)
+        self._thread.start()
+        return self.is_leader
+
+    def stop(self, timeout=5.0):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+        if self.is_leader:
+            self.lock.release()
+            self.is_leader = False
+
+    def _try_elect(self):
+        if not self.lock.try_acquire():
+            return
+        self.is_leader = True
+        self.elected_at = datetime.now(timezone.utc).isoformat()
+        leader_logger.info(f"👑 Process {os.getpid()} is the ingestion leader ({self.lock.describe()}).")
+        self.on_elected()
+
+    def _run(self):
+        if not self.is_leader:
+            leader_logger.info(f"Process {os.getpid()} serves HTTP only; ingestion runs in the leader process.")
+        while not self._stop_event.wait(self.retry_interval):
+            try:
+                if not self.is_leader:
+                    self._try_elect()
+                elif not self.lock.is_held():
+                    self.is_leader = False
+                    leader_logger.critical(f"❌ Process {os.getpid()} lost the ingestion leader lock.")
+                    if self.on_lost:
+                        self.on_lost()
+                    return  # Ingestion threads cannot be restarted safely in this process
+            except Exception as e:
+                leader_logger.error(f"❌ Leader election error: {e}", exc_info=True)
+
+    def stats(self):
+        return {
+            'pid': os.getpid(),
+            'is_leader': self.is_leader,
+            'lock': self.lock.describe(),
+            'elected_at': self.elected_at,
+        }
@@ -0,0 +1,132 @@
+"""
+Per-device latest-value cache for GET /api/live-data.
+
+Every ingested payload replaces the cached entry for its device_id, unless
+its sample timestamp is older than that of the entry (a redelivered or
+out-of-order message; a stale entry is always replaced, so a device whose
+clock went back recovers). Reads return the entry only while it is younger
+than the staleness threshold, so the dashboard poll is answered from memory
+while data is flowing and falls back to PostgreSQL only when a device has
+gone quiet.
+"""
+
+import os
+import time
+import threading
+from datetime import datetime, timezone
+
+# Cached entries older than this (seconds) are treated as stale
+LIVE_CACHE_STALE_SECONDS = float(os.getenv('LIVE_CACHE_STALE_SECONDS', '30'))
+
+
+def _sample_time(value):
+    """Epoch seconds of a payload timestamp (ISO 8601 string or epoch number), None if unparseable."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+        return (parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)).timestamp()
+    return None
+
+
+class LatestValueCache:
+    """Thread-safe map of device_id -> latest payload with receive time."""
+
+    def __init__(self, stale_after=LIVE_CACHE_STALE_SECONDS):
+        self.stale_after = stale_after
+        self._entries = {}  # device_id -> (payload, received_monotonic)
+        self._sample_times = {}  # device_id -> epoch seconds of the cached payload's timestamp
+        self._latest_device = None
+        self._lock = threading.Lock()
+        self.version = 0  # Incremented on every update (change detection for api/shared_state.py)
+        self.hits = 0
+        self.misses = 0
+        self.out_of_order = 0  # Payloads not cached because the device's entry had a newer timestamp
+
+    def _keeps_newer(self, device_id, sample_time, now):
+        """True if the fresh cached entry of `device_id` is newer than `sample_time`. Caller holds the lock."""
+        cached_time = self._sample_times.get(device_id)
+        if sample_time is None or cached_time is None or sample_time >= cached_time:
+            return False
+        return now - self._entries[device_id][1] < self.stale_after
+
+    def _store(self, device_id, entry, received, sample_time):
+        self._entries[device_id] = (entry, received)
+        if sample_time is None:
+            self._sample_times.pop(device_id, None)
+        else:
+            self._sample_times[device_id] = sample_time
+        self._latest_device = device_id
+        self.version += 1
+
+    def update(self, payload):
+        """Store a payload as the latest value for its device and return the cached entry.
+
+        Returns None (and caches nothing) if the device's cached entry has a newer timestamp.
+        """
+        entry = dict(payload)
+        entry['received_at_server'] = datetime.now(timezone.utc).isoformat()
+        device_id = entry.get('device_id', 'unknown_device')
+        sample_time = _sample_time(entry.get('timestamp'))
+        with self._lock:
+            now = time.monotonic()
+            if self._keeps_newer(device_id, sample_time, now):
+                self.out_of_order += 1
+                return None
+            self._store(device_id, entry, now, sample_time)
+        return entry
+
+    def restore(self, entry, age_seconds):
+        """Store an entry received `age_seconds` ago by another process, unless the cached one is newer."""
+        device_id = entry.get('device_id', 'unknown_device')
+        sample_time = _sample_time(entry.get('timestamp'))
+        with self._lock:
+            now = time.monotonic()
+            if self._keeps_newer(device_id, sample_time, now):
+                return
+            self._store(device_id, entry, now - age_seconds, sample_time)
+
+    def snapshot(self):
+        """Return (version, latest device, {device_id: (entry, age_seconds)})."""
+        now = time.monotonic()
+        with self._lock:
+            entries = {device_id: (entry, now - received) for device_id, (entry, received) in self._entries.items()}
+            return self.version, self._latest_device, entries
+
+    def get(self, device_id=None, max_age=None):
+        """Return the fresh payload for a device (or the most recent device if None), else None."""
+        max_age = self.stale_after if max_age is None else max_age
+        with self._lock:
+            key = device_id if device_id is not None else self._latest_device
+            cached = self._entries.get(key) if key is not None else None
+            if cached and (time.monotonic() - cached[1]) < max_age:
+                self.hits += 1
+                return cached[0]
+            self.misses += 1
+            return None
+
+    def devices(self):
+        """Return {device_id: {'timestamp', 'age_seconds', 'stale'}} for all cached devices."""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                device_id: {
+                    'timestamp': entry.get('timestamp'),
+                    'age_seconds': round(now - received, 3),
+                    'stale': (now - received) >= self.stale_after,
+                }
+                for device_id, (entry, received) in self._entries.items()
+            }
+
+    def stats(self):
+        with self._lock:
+            return {
+                'devices': len(self._entries),
+                'stale_after': self.stale_after,
+                'hits': self.hits,
+                'misses': self.misses,
+                'out_of_order': self.out_of_order,
+            }
@@ -1,7 +1,9 @@
 import os
 import sys
 import json
-from flask import Blueprint, jsonify, request
+import queue
+import atexit
+from flask import Blueprint, jsonify, request, Response, stream_with_context
 # Removed: from flask_sqlalchemy import SQLAlchemy - using PostgreSQL directly
 from datetime import datetime, timezone, timedelta # Import timedelta
 # Removed: from sqlalchemy.exc import IntegrityError - using PostgreSQL directly
@@ -9,63 +11,77 @@ from datetime import datetime, timezone, timedelta # Import timedelta
 import logging # Import logging
 import psycopg2
 import psycopg2.extras
-# from dotenv import load_dotenv # Already imported but will be part of the new block
 
 # --- Environment Variable Loading ---
 # Assuming this file (live_data.py) is in the 'api' subdirectory
-project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..')) 
-dotenv_path = os.path.join(project_root, '.env')
-try:
-    from dotenv import load_dotenv
-    if os.path.exists(dotenv_path):
-        load_dotenv(dotenv_path=dotenv_path, override=True)
-        # Use a unique print statement to confirm which file is loading
-        print(f"✅ api/live_data.py: Environment variables loaded from {dotenv_path}")
-    else:
-        print(f"⚠️ api/live_data.py: .env file not found at {dotenv_path}. Using system environment variables only.")
-except ImportError:
-    print("⚠️ api/live_data.py: python-dotenv not available, using system environment variables only")
-# --- End Environment Variable Loading ---
-
-
-# Calculate the project root # This was for sys.path, can be removed if project_root above is sufficient
-# project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..')) # Redundant with above
-if project_root not in sys.path: # Use project_root defined for dotenv
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
     sys.path.insert(0, project_root)
+from api.startup import load_env
+load_env("api/live_data.py")  # No-op if app.py already loaded .env
+# --- End Environment Variable Loading ---
 
 # --- Use the new config loader ---
-from api.config_loader import REGISTER_CONFIG
+from api.config_loader import REGISTER_CONFIG, REGISTER_DECODER
 # Removed: from api.modbus_client import read_modbus_data - no longer needed for PostgreSQL
 # Removed: from api.extensions import db - PostgreSQL handled directly
 
 # Import centralized timezone configuration
 from api.timezone_config import set_timezone
-
-# PostgreSQL configuration (should match mqtt_subscriber.py)
-POSTGRES_CONFIG = {
-    'host': os.getenv('POSTGRES_HOST', 'localhost'),
-    'port': int(os.getenv('POSTGRES_PORT', '5432')),
-    'database': os.getenv('POSTGRES_DATABASE', 'sensor_data_rpi'), # Default to 'sensor_data_rpi' for consistency
-    'user': os.getenv('POSTGRES_USER', 'sensor_user'),         # Default to sensor_user
-    'password': os.getenv('POSTGRES_PASSWORD', 'Master123')   # Default to Master123
-}
-POSTGRES_TABLE = os.getenv('POSTGRES_TABLE', 'sensor_data_rpi')
+from api.batch_writer import make_batch_writer
+from api.spool import Spool, SPOOL_ENABLED
+from api.register_columns import SENSOR_INSERT_COLUMNS, ensure_register_columns
+from api.packed_storage import (SENSOR_STORAGE_FORMAT, PACKED_INSERT_COLUMNS, PACKED_INSERT_TEMPLATE,
+                                ensure_packed_schema, sensor_row, row_payload, packed_select_sql)
+from api.live_cache import LatestValueCache
+from api.dedup import RecentKeyFilter
+from api.device_state import read_device_states
+from api.queries import parse_variables_param, register_projection, projected_values
+from api.rollups import choose_rollup, read_rollup_rows
+from api.downsample import downsample_rows, DOWNSAMPLE_METHODS
+from api.live_stream import LiveStreamBroker, LIVE_STREAM_KEEPALIVE, format_sse_event
+
+# PostgreSQL configuration and connections come from the shared pool
+from api.db_pool import POSTGRES_CONFIG, POSTGRES_TABLE, get_connection, pool_stats
 
 # Define Blueprint
 live_data_api = Blueprint('live_data_api', __name__)
 
-# Global variable to store the latest live data received via POST
-latest_live_data = None
+# Per-device cache of the latest payload (staleness threshold via LIVE_CACHE_STALE_SECONDS)
+latest_cache = LatestValueCache()
+# Recently ingested (device_id, timestamp) keys, to drop broker redeliveries cheaply
+recent_keys = RecentKeyFilter()
+
+# Rows fetched per round trip by the server-side cursor behind /api/historical-data
+HISTORICAL_ITERSIZE = int(os.getenv('HISTORICAL_ITERSIZE', '2000'))
+
+# Fan-out of ingested samples to /api/live-data/stream clients
+live_stream = LiveStreamBroker()
 
 # PostgreSQL connection helper
 def get_postgres_connection():
-    """Get PostgreSQL connection"""
-    try:
-        connection = psycopg2.connect(**POSTGRES_CONFIG)
-        return connection
-    except psycopg2.Error as e:
-        logging.error(f"❌ Failed to connect to PostgreSQL (DB: {POSTGRES_CONFIG.get('database')}): {e}")
-        return None
+    """Get a pooled PostgreSQL connection; close() returns it to the pool"""
+    return get_connection()
+
+# Batched writer for sensor rows (size/time flush configured via WRITER_BATCH_SIZE / WRITER_FLUSH_INTERVAL)
+def prepare_sensor_table(cursor):
+    """Bring the sensor table schema up to date before the first insert (typed and packed columns)."""
+    ensure_register_columns(cursor)
+    ensure_packed_schema(cursor)
+
+# Rows that cannot reach PostgreSQL are spooled to disk and replayed later,
+# in a slot of SPOOL_DIR that no other worker process uses
+ingest_spool = Spool() if SPOOL_ENABLED else None
+
+# JSONB mode fills raw_data plus the typed register columns; packed mode only the packed array
+# (WRITER_PARTITIONS > 1 splits the writer into device-keyed partitions)
+if SENSOR_STORAGE_FORMAT == 'packed':
+    batch_writer = make_batch_writer(get_postgres_connection, POSTGRES_TABLE, columns=PACKED_INSERT_COLUMNS,
+                                     prepare=prepare_sensor_table, template=PACKED_INSERT_TEMPLATE, spool=ingest_spool)
+else:
+    batch_writer = make_batch_writer(get_postgres_connection, POSTGRES_TABLE, columns=SENSOR_INSERT_COLUMNS,
+                                     prepare=prepare_sensor_table, spool=ingest_spool)
+atexit.register(batch_writer.stop) # Flush pending rows on interpreter shutdown
 
 # Helper function to parse MQTT JSON data structure
 def parse_mqtt_data(raw_data_json):
@@ -116,70 +132,69 @@ def parse_mqtt_data(raw_data_json):
         return None
 
 
+def _stored_ack(device_id, timestamp, ack):
+    """Ack callback for the writer that also marks the key as stored in the duplicate filter."""
+    def stored():
+        recent_keys.stored(device_id, timestamp)
+        if ack:
+            ack()
+    return stored
+
+
+def ingest_live_data(data, ack=None, row=None):
+    """Update the live cache and queue one payload for the batch writer.
+
+    Shared by POST /api/live-data (external producers) and the in-process
+    ingestion worker fed by the MQTT client in app.py. `row` is the payload's
+    batch writer row when it was already built (api/decode_pool.py). `ack` (the MQTT
+    acknowledgement) runs once the sample is stored, or right away if it
+    repeats an already stored sample or cannot be stored.
+    Returns True if the payload was queued for storage (or was a recent duplicate).
+    """
+    # Redeliveries of stored samples are dropped here; older replays are caught by ON CONFLICT in the writer
+    key_state = None
+    if data.get('timestamp') and data.get('device_id'):
+        key_state = recent_keys.check(data['device_id'], data['timestamp'])
+        if key_state == RecentKeyFilter.STORED:
+            logging.debug(f"Duplicate live data dropped: {data['device_id']}, Timestamp: {data['timestamp']}")
+            if ack:
+                ack()
+            return True
+        ack = _stored_ack(data['device_id'], data['timestamp'], ack)
+
+    # Update the per-device in-memory cache that serves GET /api/live-data
+    # and push the sample to connected SSE clients (a repeat of a pending sample was already shown,
+    # and a sample older than the cached one would move the dashboard back in time)
+    if key_state != RecentKeyFilter.PENDING:
+        entry = latest_cache.update(data)
+        if entry is not None:
+            live_stream.publish(entry)
+
+    logging.info(f"Live data received: {data.get('device_id', 'unknown_device')}, Timestamp: {data.get('timestamp', 'N/A')}")
+
+    db_timestamp = data.get('timestamp')
+    db_device_id = data.get('device_id')
+    if not (db_timestamp and db_device_id):
+        logging.warning(f"⚠️ Missing 'timestamp' or 'device_id' in received data. Payload: {data}. Data not stored in DB.")
+        if ack:
+            ack()
+        return False
+
+    # Rows are written by the batch writer (built here unless the decode pool already did)
+    batch_writer.add(row or sensor_row(data), ack)
+    return True
+
+
 @live_data_api.route('/live-data', methods=['POST'])
 def receive_live_data():
-    """Receive live data from MQTT subscriber, update cache, and store in PostgreSQL"""
-    global latest_live_data
+    """Receive live data from external producers, update cache, and store in PostgreSQL"""
     try:
         data = request.get_json()
         if not data:
             logging.warning("POST /api/live-data: No JSON payload received.")
             return jsonify({"error": "No JSON payload received"}), 400
 
-        # Update in-memory cache (optional, but can be useful for immediate live view)
-        latest_live_data = data.copy() # Use .copy() to avoid modifying the original if adding 'received_at' only to cache
-        latest_live_data['received_at_server'] = datetime.now(timezone.utc).isoformat() 
-
-        logging.info(f"POST /api/live-data: Data received: {data.get('device_id', 'unknown_device')}, Timestamp: {data.get('timestamp', 'N/A')}")
-
-        # --- Store data in PostgreSQL ---
-        conn = None
-        cursor = None
-        try:
-            conn = get_postgres_connection()
-            if conn:
-                cursor = conn.cursor()
-                
-                db_timestamp = data.get('timestamp')
-                db_device_id = data.get('device_id')
-                
-                # Ensure raw_data is stored as a JSON string
-                db_raw_data_json = json.dumps(data) 
-
-                if db_timestamp and db_device_id:
-                    insert_query = f"""
-                    INSERT INTO {POSTGRES_TABLE} (timestamp, device_id, raw_data)
-                    VALUES (%s, %s, %s)
-                    -- ON CONFLICT (timestamp, device_id) DO NOTHING; 
-                    """ 
-                    # The ON CONFLICT clause is commented out because the table may not have the required unique constraint.
-                    # This might lead to duplicate entries if source data contains them or if messages are replayed.
-                    
-                    cursor.execute(insert_query, (db_timestamp, db_device_id, db_raw_data_json))
-                    conn.commit()
-                    logging.info(f"✅ Data from {db_device_id} at {db_timestamp} stored in PostgreSQL table {POSTGRES_TABLE}.")
-                else:
-                    logging.warning(f"⚠️ Missing 'timestamp' or 'device_id' in received data. Payload: {data}. Data not stored in DB.")
-            else:
-                logging.error("❌ Failed to get PostgreSQL connection for data insertion. Data not stored.")
-        
-        except psycopg2.Error as db_err:
-            if conn:
-                conn.rollback()
-            logging.error(f"❌ PostgreSQL Error during data insertion into {POSTGRES_TABLE}: {db_err}. Payload: {data}")
-            # Optionally, you might want to return 500 if DB storage is critical
-            # return jsonify({"error": "Failed to store data in database"}), 500
-        except Exception as e_db:
-            if conn:
-                conn.rollback()
-            logging.error(f"❌ Unexpected error during data insertion into {POSTGRES_TABLE}: {e_db}. Payload: {data}")
-            # return jsonify({"error": "Internal server error during data storage"}), 500
-        finally:
-            if cursor:
-                cursor.close()
-            if conn:
-                conn.close()
-        # --- End DB Insertion ---
+        ingest_live_data(data)
 
         return jsonify({"message": "Data received and processed"}), 200 # Changed message to reflect processing
 
@@ -188,22 +203,42 @@ def receive_live_data():
         return jsonify({"error": "Failed to process request"}), 500
 
 
+def _engineering_units():
+    """True if the request asks for values converted by REGISTER_DECODER (?units=engineering)."""
+    return request.args.get('units', 'raw').lower() == 'engineering'
+
+
+def _expand_bits():
+    return request.args.get('bits', '').lower() in ('1', 'true', 'yes')
+
+
+def _live_response(payload):
+    """jsonify a live payload, converting its 'data' to engineering units if requested."""
+    if _engineering_units() and isinstance(payload.get('data'), dict):
+        payload = dict(payload, data=REGISTER_DECODER.decode_sample(payload['data'], _expand_bits()))
+    return jsonify(payload)
+
+
 @live_data_api.route('/live-data', methods=['GET'])
 def live_data():
-    """Get the latest sensor data - prioritize live cache, fallback to PostgreSQL database"""
-    
-    # Check if we have fresh live data from MQTT subscriber (within last 30 seconds)
-    global latest_live_data
-    if latest_live_data:
-        try:
-            received_at = datetime.fromisoformat(latest_live_data['received_at'].replace('Z', '+00:00'))
-            age_seconds = (datetime.now(timezone.utc) - received_at).total_seconds()
-            
-            if age_seconds < 30:  # Use live data if less than 30 seconds old
-                logging.debug("✅ Returning fresh live data from cache")
-                return jsonify(latest_live_data)
-        except Exception as e:
-            logging.warning(f"⚠️ Error checking live data age: {e}")
+    """Get the latest sensor data - prioritize live cache, fallback to PostgreSQL database
+
+    Query parameters:
+        device_id: device to return (default: the most recently updated device)
+        max_age: staleness threshold in seconds (default: LIVE_CACHE_STALE_SECONDS)
+        units: 'engineering' applies dataType, scale and offset server-side (default: stored values)
+        bits: with units=engineering, add '<register>_bits' for bitmask registers
+    """
+    device_id = request.args.get('device_id') or None
+    try:
+        max_age = float(request.args['max_age']) if 'max_age' in request.args else None
+    except ValueError:
+        return jsonify({"error": "Invalid max_age parameter. Use seconds, e.g. 30"}), 400
+
+    cached = latest_cache.get(device_id, max_age)
+    if cached is not None:
+        logging.debug("✅ Returning fresh live data from cache")
+        return _live_response(cached)
     
     # Fallback to database if no fresh live data
     logging.debug("📊 Falling back to database for live data")
@@ -215,13 +250,15 @@ def live_data():
     
     try:
         cursor = connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        where_clause = "WHERE device_id = %s" if device_id else ""
         query = f"""
-        SELECT raw_data, timestamp as db_timestamp, device_id as db_device_id 
+        SELECT raw_data, timestamp as db_timestamp, device_id as db_device_id{packed_select_sql()}
         FROM {POSTGRES_TABLE}
+        {where_clause}
         ORDER BY timestamp DESC
         LIMIT 1
         """
-        cursor.execute(query)
+        cursor.execute(query, (device_id,) if device_id else None)
         result = cursor.fetchone()
     except psycopg2.Error as db_err:
         logging.error(f"❌ Database query error in /live-data: {db_err}")
@@ -235,6 +272,8 @@ def live_data():
         return jsonify({"error": "No data available"}), 404 # Return 404 if no data found
     
     db_record = dict(result)
+    if not db_record.get('raw_data') and db_record.get('packed_values') is not None:
+        db_record['raw_data'] = row_payload(db_record) # Packed rows are decoded into the same payload shape
     
     if db_record.get('raw_data'):
         try:
@@ -242,7 +281,7 @@ def live_data():
             if "timestamp" in mqtt_message_obj and "data" in mqtt_message_obj and "device_id" in mqtt_message_obj:
                 if isinstance(mqtt_message_obj["timestamp"], datetime):
                     mqtt_message_obj["timestamp"] = mqtt_message_obj["timestamp"].isoformat()
-                return jsonify(mqtt_message_obj)
+                return _live_response(mqtt_message_obj)
             else:
                 logging.warning(f"Live data endpoint: raw_data for latest entry has unexpected structure: {mqtt_message_obj}. Attempting reconstruction for /live-data.")
                 # Attempt to reconstruct into {"timestamp": ..., "device_id": ..., "data": {...}}
@@ -257,7 +296,7 @@ def live_data():
                     "device_id": mqtt_message_obj.get('device_id') or db_record.get('db_device_id', 'unknown_device'),
                     "data": nested_data_values
                 }
-                return jsonify(response_data)
+                return _live_response(response_data)
         except json.JSONDecodeError as e:
             logging.error(f"Error parsing raw_data JSON from DB in /live-data: {e}. Raw data: {db_record['raw_data']}")
         except Exception as e:
@@ -291,14 +330,179 @@ def live_data():
     return jsonify(fallback_response)
 
 
+@live_data_api.route('/live-data/stream', methods=['GET'])
+def live_data_stream():
+    """Server-Sent Events stream of new live samples
+
+    Query parameters:
+        device_id: only stream samples from this device
+        registers: comma-separated register names to keep in each sample's 'data'
+    """
+    device_id = request.args.get('device_id') or None
+    registers = [name for name in request.args.get('registers', '').split(',') if name] or None
+
+    def generate():
+        client = live_stream.subscribe()
+        try:
+            # Send the current value straight away so the dashboard does not wait for the next sample
+            cached = latest_cache.get(device_id)
+            if cached is not None:
+                yield format_sse_event(cached, json.dumps(cached), registers)
+            while True:
+                try:
+                    payload, encoded = client.get(timeout=LIVE_STREAM_KEEPALIVE)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if device_id and payload.get('device_id') != device_id:
+                    continue
+                yield format_sse_event(payload, encoded, registers)
+        finally:
+            live_stream.unsubscribe(client)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@live_data_api.route('/live-data/devices', methods=['GET'])
+def live_data_devices():
+    """List devices held in the live cache with their age and staleness"""
+    return jsonify({
+        "devices": latest_cache.devices(),
+        "cache": latest_cache.stats(),
+        "stream": live_stream.stats()
+    })
+
+
+def _build_historical_row(row_data):
+    """Convert one sensor table row into the flat dict expected by historical.js"""
+    # Parse raw MQTT data (or the decoded packed sample) if available to get full sensor data
+    payload = row_payload(row_data)
+    if payload:
+        parsed_data = parse_mqtt_data(payload)
+        if parsed_data and 'raw_data' in parsed_data:
+            mqtt_data = parsed_data['raw_data']
+            if 'data' in mqtt_data:
+                # Use all the MQTT sensor data
+                processed_row = mqtt_data['data'].copy()
+                # Ensure timestamp is properly formatted
+                if mqtt_data.get('timestamp'):
+                    processed_row['timestamp'] = mqtt_data['timestamp']
+                else:
+                    processed_row['timestamp'] = row_data['timestamp'].isoformat()
+                return processed_row
+    
+    # Fallback to database fields - map back to MQTT field names for frontend compatibility
+    processed_row = {
+        'timestamp': row_data['timestamp'].isoformat() if row_data.get('timestamp') else None,
+        'SOC1': row_data.get('cl1_soc'),
+        'SOC2': row_data.get('cl2_soc'),
+        'Cluster_1_Voltage': row_data.get('cl1_voltage'),
+        'Cluster_2_Voltage': row_data.get('cl2_voltage'),
+        'Cluster_1_Current': row_data.get('cl1_current'),
+        'Cluster_2_Current': row_data.get('cl2_current'),
+        'OCV_1': row_data.get('cl1_temperature'),
+        'OCV_2': row_data.get('cl2_temperature'),
+        'Total_Cluster_Power': row_data.get('system_power'),
+        'System Condition': row_data.get('system_status'),
+        # Add other common MQTT fields with default values
+        'Digital Status Reg 1': 0,
+        'Digital Status Reg 2': 0,
+        'Digital Status Reg 3': 0,
+        'Digital Status Reg 4': 0,
+        'Pressure_1': 0,
+        'Pressure_2': 0,
+        'Pressure_3': 0,
+        'Pressure_4': 0,
+        'HVDC_Voltage': 0,
+        'HVDC_Current': 0,
+        'HVDC_Power': 0,
+        'Primary_Pump_Ramp_PID_SP_FB': 0,
+        'Secondary_Pump_Ramp_PID_SP_FB': 0,
+        'Cluster_1_Power': 0,
+        'Cluster_2_Power': 0,
+        'Cluster-1 Condition': 3,
+        'Cluster-2 Condition': 3,
+        'Zekalab system State': 1,
+        'Battery Status': 1,
+        'CL_1 PowerMode': 2,
+        'CL_2 PowerMode': 2
+    }
+    return processed_row
+
+
+def _build_projected_row(row_data, variables):
+    """Build a historical.js row from a query that projected only `variables` in SQL"""
+    processed_row = projected_values(row_data, variables)
+    processed_row['timestamp'] = row_data.get('payload_timestamp') or row_data['timestamp'].isoformat()
+    return processed_row
+
+
 @live_data_api.route('/historical-data', methods=['GET'])
 def historical_data():
-    """Get historical sensor data from PostgreSQL database - compatible with existing frontend"""
+    """Get historical sensor data from PostgreSQL database - compatible with existing frontend
+
+    Rows are read through a server-side named cursor (HISTORICAL_ITERSIZE rows per
+    round trip) and streamed to the client as a JSON array, so memory stays flat
+    regardless of the range. With max_points the rows are downsampled first.
+    With variables=a,b only those registers are extracted from raw_data in SQL.
+    With units=engineering each block of rows is converted by REGISTER_DECODER
+    (sign, scale, offset; bits=1 adds bitmask expansions), so clients can plot directly.
+    """
     # Get query parameters - matching the existing hist_data.py API
     range_param = request.args.get('range', '30m')
     start_date_str = request.args.get('start')
     end_date_str = request.args.get('end')
     device_id = request.args.get('device_id', None)
+    variables = parse_variables_param(request.args.get('variables'))
+    # Optional server-side downsampling: max_points (alias: points) per register, method lttb|minmax
+    max_points_param = request.args.get('max_points', request.args.get('points'))
+    downsample_method = request.args.get('downsample', 'lttb')
+    engineering_units, expand_bits = _engineering_units(), _expand_bits()
+    max_points = None
+    if max_points_param:
+        try:
+            max_points = int(max_points_param)
+            if max_points < 3:
+                raise ValueError
+        except ValueError:
+            return jsonify({"error": "Invalid max_points parameter. Use an integer >= 3"}), 400
+        if downsample_method not in DOWNSAMPLE_METHODS:
+            return jsonify({"error": f"Invalid downsample method. Use one of: {', '.join(DOWNSAMPLE_METHODS)}"}), 400
+    
+    # Parse time range like the original hist_data.py
+    now = datetime.now(set_timezone)
+    start_time = None
+    end_time = now
+    
+    if range_param == 'custom' and start_date_str and end_date_str:
+        try:
+            start_time = datetime.strptime(start_date_str, '%Y-%m-%dT%H:%M').replace(tzinfo=set_timezone)
+            end_time = datetime.strptime(end_date_str, '%Y-%m-%dT%H:%M').replace(tzinfo=set_timezone)
+        except ValueError:
+            logging.error(f"Invalid custom date format: start={start_date_str}, end={end_date_str}")
+            return jsonify({"error": "Invalid custom date format. Use YYYY-MM-DDTHH:MM"}), 400
+    else:
+        try:
+            num = int(range_param[:-1])
+            unit = range_param[-1]
+            if unit == 'm': 
+                delta = timedelta(minutes=num)
+            elif unit == 'h': 
+                delta = timedelta(hours=num)
+            elif unit == 'd': 
+                delta = timedelta(days=num)
+            elif unit == 'w': 
+                delta = timedelta(weeks=num)
+            else: 
+                delta = timedelta(minutes=30)  # Default fallback
+            start_time = now - delta
+        except ValueError:
+            logging.error(f"Invalid range parameter: {range_param}")
+            return jsonify({"error": "Invalid range parameter format. Use e.g., 30m, 1h, 7d, 4w"}), 400
+    
+    if not start_time:
+        start_time = now - timedelta(minutes=30)  # Default if something went wrong
     
     connection = get_postgres_connection()
     cursor = None
@@ -306,47 +510,27 @@ def historical_data():
         return jsonify({"error": "Failed to connect to database"}), 500
     
     try:
-        cursor = connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        
-        # Parse time range like the original hist_data.py
-        now = datetime.now(set_timezone)
-        start_time = None
-        end_time = now
-        
-        if range_param == 'custom' and start_date_str and end_date_str:
-            try:
-                start_time = datetime.strptime(start_date_str, '%Y-%m-%dT%H:%M').replace(tzinfo=set_timezone)
-                end_time = datetime.strptime(end_date_str, '%Y-%m-%dT%H:%M').replace(tzinfo=set_timezone)
-            except ValueError:
-                logging.error(f"Invalid custom date format: start={start_date_str}, end={end_date_str}")
-                return jsonify({"error": "Invalid custom date format. Use YYYY-MM-DDTHH:MM"}), 400
-        else:
-            try:
-                num = int(range_param[:-1])
-                unit = range_param[-1]
-                if unit == 'm': 
-                    delta = timedelta(minutes=num)
-                elif unit == 'h': 
-                    delta = timedelta(hours=num)
-                elif unit == 'd': 
-                    delta = timedelta(days=num)
-                elif unit == 'w': 
-                    delta = timedelta(weeks=num)
-                else: 
-                    delta = timedelta(minutes=30)  # Default fallback
-                start_time = now - delta
-            except ValueError:
-                logging.error(f"Invalid range parameter: {range_param}")
-                return jsonify({"error": "Invalid range parameter format. Use e.g., 30m, 1h, 7d, 4w"}), 400
-        
-        if not start_time:
-            start_time = now - timedelta(minutes=30)  # Default if something went wrong
-        
-        logging.info(f"📅 Querying historical data from {start_time.isoformat()} to {end_time.isoformat()}")
+        # Long downsampled ranges are answered from the coarsest rollup that still meets
+        # the requested resolution; raw rows are only read after the rollup watermark
+        rollup_rows, rollup_times = [], []
+        raw_start_time = start_time
+        if max_points and downsample_method == 'lttb':
+            rollup = choose_rollup((end_time - start_time).total_seconds(), max_points)
+            if rollup:
+                rollup_result = read_rollup_rows(connection, rollup[0], start_time, end_time, device_id, variables, set_timezone)
+                if rollup_result:
+                    rollup_rows, rollup_times, raw_start_time = rollup_result
+                    logging.info(f"📦 Using {rollup[0]} rollup: {len(rollup_rows)} buckets until {raw_start_time.isoformat()}")
+        
+        # Server-side cursor: rows are fetched from PostgreSQL in chunks of itersize
+        cursor = connection.cursor(name='historical_data_stream', cursor_factory=psycopg2.extras.RealDictCursor)
+        cursor.itersize = HISTORICAL_ITERSIZE
+        
+        logging.info(f"📅 Querying historical data from {raw_start_time.isoformat()} to {end_time.isoformat()}")
         
         # Build query with time filtering
         where_conditions = ["timestamp >= %s", "timestamp <= %s"]
-        params = [start_time, end_time]
+        params = [raw_start_time, end_time]
         
         # Device filter
         if device_id:
@@ -355,80 +539,42 @@ def historical_data():
         
         where_clause = " AND ".join(where_conditions)
         
+        if variables:
+            # Register projection pushed into SQL: only the requested fields leave PostgreSQL
+            projection_sql, projection_params = register_projection(variables)
+            select_list = f"timestamp, raw_data->>'timestamp' AS payload_timestamp, {projection_sql}"
+            params = projection_params + params
+            build_row = lambda row: _build_projected_row(row, variables)
+        else:
+            select_list = "*"
+            build_row = _build_historical_row
+        
         query = f"""
-        SELECT * FROM {POSTGRES_TABLE}
+        SELECT {select_list} FROM {POSTGRES_TABLE}
         WHERE {where_clause}
         ORDER BY timestamp ASC
         """
         
         cursor.execute(query, params)
-        results = cursor.fetchall()
         
-        # Process results to match frontend expectations
-        historical_data = []
-        for row in results:
-            row_data = dict(row)
+        if max_points:
+            # Downsampling needs every row of the range; rows still arrive itersize at a time
+            historical_data = rollup_rows
+            row_times = rollup_times # Epoch seconds per returned row, used by the downsampler
+            for row in cursor:
+                row_times.append(row['timestamp'].timestamp() if row.get('timestamp') else 0.0)
+                historical_data.append(build_row(row))
+            cursor.close()
+            connection.close()
             
-            # Parse raw MQTT data if available to get full sensor data
-            processed_row = {}
-            if row_data.get('raw_data'):
-                parsed_data = parse_mqtt_data(row_data['raw_data'])
-                if parsed_data and 'raw_data' in parsed_data:
-                    mqtt_data = parsed_data['raw_data']
-                    if 'data' in mqtt_data:
-                        # Use all the MQTT sensor data
-                        processed_row = mqtt_data['data'].copy()
-                        # Ensure timestamp is properly formatted
-                        if mqtt_data.get('timestamp'):
-                            processed_row['timestamp'] = mqtt_data['timestamp']
-                        else:
-                            processed_row['timestamp'] = row_data['timestamp'].isoformat()
-                        historical_data.append(processed_row)
-                        continue
+            original_count = len(historical_data)
+            historical_data = downsample_rows(historical_data, row_times, max_points, downsample_method)
+            logging.info(f"📉 Downsampled historical data ({downsample_method}): {original_count} -> {len(historical_data)} rows")
+            if engineering_units:
+                REGISTER_DECODER.decode_rows(historical_data, expand_bits)
             
-            # Fallback to database fields - map back to MQTT field names for frontend compatibility
-            processed_row = {
-                'timestamp': row_data['timestamp'].isoformat() if row_data.get('timestamp') else None,
-                'SOC1': row_data.get('cl1_soc'),
-                'SOC2': row_data.get('cl2_soc'),
-                'Cluster_1_Voltage': row_data.get('cl1_voltage'),
-                'Cluster_2_Voltage': row_data.get('cl2_voltage'),
-                'Cluster_1_Current': row_data.get('cl1_current'),
-                'Cluster_2_Current': row_data.get('cl2_current'),
-                'OCV_1': row_data.get('cl1_temperature'),
-                'OCV_2': row_data.get('cl2_temperature'),
-                'Total_Cluster_Power': row_data.get('system_power'),
-                'System Condition': row_data.get('system_status'),
-                # Add other common MQTT fields with default values
-                'Digital Status Reg 1': 0,
-                'Digital Status Reg 2': 0,
-                'Digital Status Reg 3': 0,
-                'Digital Status Reg 4': 0,
-                'Pressure_1': 0,
-                'Pressure_2': 0,
-                'Pressure_3': 0,
-                'Pressure_4': 0,
-                'HVDC_Voltage': 0,
-                'HVDC_Current': 0,
-                'HVDC_Power': 0,
-                'Primary_Pump_Ramp_PID_SP_FB': 0,
-                'Secondary_Pump_Ramp_PID_SP_FB': 0,
-                'Cluster_1_Power': 0,
-                'Cluster_2_Power': 0,
-                'Cluster-1 Condition': 3,
-                'Cluster-2 Condition': 3,
-                'Zekalab system State': 1,
-                'Battery Status': 1,
-                'CL_1 PowerMode': 2,
-                'CL_2 PowerMode': 2
-            }
-            historical_data.append(processed_row)
-        
-        cursor.close()
-        connection.close()
-        
-        # Return in the format expected by historical.js (just an array of data points)
-        return jsonify(historical_data)
+            # Return in the format expected by historical.js (just an array of data points)
+            return jsonify(historical_data)
         
     except psycopg2.Error as e:
         logging.error(f"❌ Database error: {e}")
@@ -440,6 +586,31 @@ def historical_data():
         if connection:
             connection.close()
         return jsonify({"error": "Internal server error"}), 500
+    
+    def generate():
+        # Same JSON array historical.js expects, emitted one row at a time
+        row_count = 0
+        try:
+            yield '['
+            while True:
+                # One block per server-side fetch, so unit conversion is vectorized per block
+                block = [build_row(row) for row in cursor.fetchmany(HISTORICAL_ITERSIZE)]
+                if not block:
+                    break
+                if engineering_units:
+                    REGISTER_DECODER.decode_rows(block, expand_bits)
+                for built in block:
+                    yield (',' if row_count else '') + json.dumps(built, default=str)
+                    row_count += 1
+            yield ']'
+            logging.info(f"📤 Streamed {row_count} historical rows")
+        except psycopg2.Error as e:
+            logging.error(f"❌ Database error while streaming historical data after {row_count} rows: {e}")
+        finally:
+            cursor.close()
+            connection.close()
+    
+    return Response(generate(), mimetype='application/json')
 
 
 @live_data_api.route('/sensor-summary')
@@ -578,6 +749,33 @@ def add_dynamic_columns():
     pass
 
 
+@live_data_api.route('/db-pool-stats')
+def db_pool_stats():
+    """Connection pool wait-time and utilization statistics"""
+    return jsonify(pool_stats())
+
+
+@live_data_api.route('/writer-stats')
+def writer_stats():
+    """Batch writer throughput, on-disk spool backlog and duplicate filter counts"""
+    stats = batch_writer.stats()
+    stats['recent_key_filter'] = recent_keys.stats()
+    return jsonify(stats)
+
+
+@live_data_api.route('/device-status')
+def device_status():
+    """Latest status message of every device (from the MQTT status topic)"""
+    try:
+        states = read_device_states()
+    except psycopg2.Error as e:
+        logging.error(f"❌ Database error reading device status: {e}")
+        return jsonify({"error": "Database query failed"}), 500
+    if states is None:
+        return jsonify({"error": "Failed to connect to database"}), 500
+    return jsonify({"devices": states})
+
+
 @live_data_api.route('/test-blueprint')
 def test_blueprint_route():
     return jsonify({"message": "Live Data Blueprint test OK"}), 200
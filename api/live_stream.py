@@ -0,0 +1,80 @@
+"""
+Server-Sent Events fan-out for live data.
+
+The ingestion path publishes every payload once; each connected
+/api/live-data/stream client has its own small bounded queue. A slow client
+loses its oldest samples instead of holding up ingestion or other clients.
+"""
+
+import os
+import json
+import queue
+import threading
+
+# Samples buffered per client before the oldest ones are dropped
+LIVE_STREAM_CLIENT_QUEUE = int(os.getenv('LIVE_STREAM_CLIENT_QUEUE', '100'))
+# Seconds between SSE keepalive comments when no data is flowing
+LIVE_STREAM_KEEPALIVE = float(os.getenv('LIVE_STREAM_KEEPALIVE', '15'))
+
+
+class LiveStreamBroker:
+    """Publishes live payloads to all subscribed SSE client queues."""
+
+    def __init__(self, client_queue_size=LIVE_STREAM_CLIENT_QUEUE):
+        self.client_queue_size = client_queue_size
+        self._clients = set()
+        self._lock = threading.Lock()
+        self.published_count = 0
+        self.dropped_count = 0
+
+    def subscribe(self):
+        client = queue.Queue(maxsize=self.client_queue_size)
+        with self._lock:
+            self._clients.add(client)
+        return client
+
+    def unsubscribe(self, client):
+        with self._lock:
+            self._clients.discard(client)
+
+    def publish(self, payload):
+        """Queue a payload for every client. JSON is encoded once and shared."""
+        with self._lock:
+            clients = list(self._clients)
+        if not clients:
+            return
+        item = (payload, json.dumps(payload))
+        for client in clients:
+            try:
+                client.put_nowait(item)
+            except queue.Full:
+                # Drop the oldest sample for this slow client and keep the newest
+                try:
+                    client.get_nowait()
+                except queue.Empty:
+                    pass
+                try:
+                    client.put_nowait(item)
+                except queue.Full:
+                    pass
+                self.dropped_count += 1
+        self.published_count += 1
+
+    def stats(self):
+        with self._lock:
+            clients = len(self._clients)
+        return {
+            'clients': clients,
+            'published': self.published_count,
+            'dropped': self.dropped_count,
+        }
+
+
+def format_sse_event(payload, encoded, registers=None):
+    """Return one SSE `data:` frame, keeping only `registers` from payload['data'] if given."""
+    if registers:
+        data = payload.get('data') or {}
+        payload = dict(payload)
+        payload['data'] = {name: data[name] for name in registers if name in data}
+        encoded = json.dumps(payload)
+    return f"data: {encoded}\n\n"
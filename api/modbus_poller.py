@@ -0,0 +1,373 @@
+"""
+Built-in Modbus TCP poller for the registers in register_config.yaml.
+
+A Pi next to the PLC can read the registers itself instead of relying on an
+external MQTT publisher. plan_block_reads() turns the configured addresses
+into the fewest "read registers" requests: addresses are merged into one
+block across gaps of up to MODBUS_MAX_GAP unused registers, and no block is
+longer than the protocol limit of 125 registers.
+
+ModbusScheduler polls many units (register_config.yaml `modbus.units`)
+from one asyncio event loop in a single thread, decodes the words with the
+compiled plans of api/binary_payload.py (sint16 sign, bool) and hands one
+sample per unit and cycle to `on_sample(payload)`. Each unit has its own
+interval, timeout, register subset and jitter; its start phase is spread
+randomly over the interval and every poll is delayed by up to `jitter` of
+the interval, so units sharing a network do not burst in step. Per unit it
+counts polls, failures and missed deadlines (a poll still running when the
+next one was due) and tracks read latency. app.py runs the scheduler with
+`on_sample` = ingest_live_data, the same path MQTT messages take.
+
+The Modbus TCP framing is implemented here (function codes 3 and 4 only), so
+no Modbus library is needed; see build_read_request()/parse_read_response().
+"""
+
+import os
+import time
+import random
+import asyncio
+import socket
+import struct
+import threading
+import logging
+from datetime import datetime, timezone
+
+from api.config_loader import REGISTER_CONFIG
+from api.binary_payload import decode_register_words
+
+# Set MODBUS_ENABLED=true to poll the device in register_config.yaml's modbus: section
+MODBUS_ENABLED = os.getenv('MODBUS_ENABLED', 'false').lower() == 'true'
+MODBUS_POLL_INTERVAL = float(os.getenv('MODBUS_POLL_INTERVAL', '1.0'))  # seconds between polls
+MODBUS_TIMEOUT = float(os.getenv('MODBUS_TIMEOUT', '2.0'))  # socket timeout per request (seconds)
+MODBUS_UNIT_ID = int(os.getenv('MODBUS_UNIT_ID', '1'))
+# 3 = read holding registers, 4 = read input registers
+MODBUS_FUNCTION = int(os.getenv('MODBUS_FUNCTION', '3'))
+# Unused registers a block may span to save a request
+MODBUS_MAX_GAP = int(os.getenv('MODBUS_MAX_GAP', '8'))
+# device_id of polled samples (default: modbus_<ip>)
+MODBUS_DEVICE_ID = os.getenv('MODBUS_DEVICE_ID')
+# Random delay of each poll, as a fraction of the unit's interval (per-unit `jitter` overrides it)
+MODBUS_JITTER = float(os.getenv('MODBUS_JITTER', '0.1'))
+
+MAX_REGISTERS_PER_READ = 125  # Modbus limit for function codes 3/4
+
+_MBAP = struct.Struct('>HHHB')  # transaction id, protocol id (0), length, unit id
+
+modbus_logger = logging.getLogger("modbus_poller")
+
+
+class ModbusError(Exception):
+    """Modbus exception response or malformed frame."""
+
+
+def plan_block_reads(addresses, max_gap=MODBUS_MAX_GAP, max_count=MAX_REGISTERS_PER_READ):
+    """Return [(start, count)] covering `addresses` with the fewest reads."""
+    blocks = []
+    start = end = None
+    for address in sorted(set(addresses)):
+        if start is not None and address - end - 1 <= max_gap and address - start < max_count:
+            end = address
+            continue
+        if start is not None:
+            blocks.append((start, end - start + 1))
+        start = end = address
+    if start is not None:
+        blocks.append((start, end - start + 1))
+    return blocks
+
+
+def build_read_request(transaction_id, unit_id, function, start, count):
+    """Modbus TCP ADU for a read holding/input registers request."""
+    return _MBAP.pack(transaction_id & 0xFFFF, 0, 6, unit_id) + struct.pack('>BHH', function, start, count)
+
+
+def parse_read_response(header, body, transaction_id, function, count):
+    """Return the register words of a response (`header` = 7-byte MBAP, `body` = the PDU)."""
+    tid, protocol, _, _ = _MBAP.unpack(header)
+    if tid != transaction_id & 0xFFFF or protocol != 0:
+        raise ModbusError(f"unexpected response (transaction {tid}, protocol {protocol})")
+    if not body:
+        raise ModbusError("empty response")
+    if body[0] == function | 0x80:
+        raise ModbusError(f"exception code {body[1] if len(body) > 1 else '?'} for function {function}")
+    if body[0] != function or len(body) < 2 or body[1] != 2 * count or len(body) != 2 + 2 * count:
+        raise ModbusError(f"malformed response to function {function} ({len(body)} bytes)")
+    return struct.unpack(f'>{count}H', body[2:])
+
+
+class AsyncModbusTCPClient:
+    """Minimal asyncio Modbus TCP client (one request in flight per connection)."""
+
+    def __init__(self, host, port=502, unit_id=MODBUS_UNIT_ID, timeout=MODBUS_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.unit_id = unit_id
+        self.timeout = timeout
+        self._reader = None
+        self._writer = None
+        self._transaction_id = 0
+
+    async def connect(self):
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.timeout)
+            sock = self._writer.get_extra_info('socket')
+            if sock is not None:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._reader = self._writer = None
+
+    async def _read_registers(self, start, count, function):
+        await self.connect()
+        self._transaction_id = (self._transaction_id + 1) & 0xFFFF
+        self._writer.write(build_read_request(self._transaction_id, self.unit_id, function, start, count))
+        await self._writer.drain()
+        try:
+            header = await self._reader.readexactly(_MBAP.size)
+            body = await self._reader.readexactly(_MBAP.unpack(header)[2] - 1)
+        except asyncio.IncompleteReadError:
+            raise ConnectionError("connection closed by Modbus server")
+        return parse_read_response(header, body, self._transaction_id, function, count)
+
+    async def read_registers(self, start, count, function=MODBUS_FUNCTION):
+        """Read `count` registers from `start`. Raises ModbusError, OSError or asyncio.TimeoutError."""
+        return await asyncio.wait_for(self._read_registers(start, count, function), self.timeout)
+
+
+def _resolve_addresses(unit_config, by_name, by_group):
+    """Addresses of a unit's `registers` (names or addresses) and `groups`; None means all registers."""
+    registers = unit_config.get('registers')
+    groups = unit_config.get('groups')
+    if registers is None and groups is None:
+        return None
+    addresses = set()
+    for entry in registers or []:
+        if isinstance(entry, int):
+            addresses.add(entry)
+        elif entry in by_name:
+            addresses.add(by_name[entry]['address'])
+        else:
+            raise ValueError(f"unknown register '{entry}'")
+    for group in groups or []:
+        if group not in by_group:
+            raise ValueError(f"unknown register group '{group}'")
+        addresses.update(reg['address'] for reg in by_group[group])
+    if not addresses:
+        raise ValueError("no registers selected")
+    return sorted(addresses)
+
+
+class ModbusUnit:
+    """One polled endpoint: connection settings, block plan and per-unit counters."""
+
+    def __init__(self, name, host, port=502, unit_id=MODBUS_UNIT_ID, addresses=None, device_id=None,
+                 interval=MODBUS_POLL_INTERVAL, timeout=MODBUS_TIMEOUT, jitter=MODBUS_JITTER,
+                 function=MODBUS_FUNCTION, max_gap=MODBUS_MAX_GAP):
+        if interval <= 0 or timeout <= 0 or not 0 <= jitter <= 1:
+            raise ValueError(f"unit '{name}': interval and timeout must be > 0 and jitter within 0..1")
+        if function not in (3, 4):
+            raise ValueError(f"unit '{name}': function must be 3 or 4")
+        self.name = name
+        self.device_id = device_id or name
+        self.timeout = timeout
+        self.interval = interval
+        self.jitter = jitter
+        self.function = function
+        if addresses is None:
+            addresses = REGISTER_CONFIG['by_address'].keys()
+        self.blocks = plan_block_reads(addresses, max_gap)
+        self.client = AsyncModbusTCPClient(host, port, unit_id, timeout)
+        self.polls = 0
+        self.failures = 0
+        self.missed_deadlines = 0
+        self.last_error = None
+        self.last_latency_ms = 0.0
+        self.max_latency_ms = 0.0
+        self._total_latency_ms = 0.0
+
+    async def poll_once(self):
+        """Read every planned block and return the decoded sample payload."""
+        timestamp = datetime.now(timezone.utc)
+        started = time.monotonic()
+        data = {}
+        try:
+            for start, count in self.blocks:
+                words = await self.client.read_registers(start, count, self.function)
+                data.update(decode_register_words(start, words))
+        except (OSError, ModbusError, asyncio.TimeoutError):
+            self.client.close()  # Reconnect on the next poll
+            raise
+        latency_ms = (time.monotonic() - started) * 1000
+        self.last_latency_ms = latency_ms
+        self.max_latency_ms = max(self.max_latency_ms, latency_ms)
+        self._total_latency_ms += latency_ms
+        return {'timestamp': timestamp.isoformat(), 'device_id': self.device_id, 'data': data}
+
+    def settings(self):
+        """Everything that defines how the unit is polled; equal settings need no restart on reload."""
+        return (self.client.host, self.client.port, self.client.unit_id, self.device_id, self.interval,
+                self.timeout, self.jitter, self.function, tuple(self.blocks))
+
+    def stats(self):
+        return {
+            'name': self.name,
+            'host': self.client.host,
+            'port': self.client.port,
+            'unit_id': self.client.unit_id,
+            'device_id': self.device_id,
+            'interval': self.interval,
+            'blocks': [list(block) for block in self.blocks],
+            'polls': self.polls,
+            'failures': self.failures,
+            'missed_deadlines': self.missed_deadlines,
+            'last_latency_ms': round(self.last_latency_ms, 2),
+            'avg_latency_ms': round(self._total_latency_ms / self.polls, 2) if self.polls else 0.0,
+            'max_latency_ms': round(self.max_latency_ms, 2),
+            'last_error': self.last_error,
+        }
+
+
+def build_units(config=None):
+    """ModbusUnits from register_config.yaml: `modbus.units`, else the single `modbus.ip`/`port`.
+
+    Raises ValueError for an invalid unit entry.
+    """
+    config = config or REGISTER_CONFIG
+    unit_configs = config.get('modbus_units') or []
+    if not unit_configs:
+        if not config.get('modbus_ip'):
+            return []
+        unit_configs = [{'ip': config['modbus_ip'], 'port': config.get('modbus_port'),
+                         'device_id': MODBUS_DEVICE_ID or f"modbus_{config['modbus_ip']}"}]
+    units = []
+    for index, unit_config in enumerate(unit_configs):
+        if not isinstance(unit_config, dict) or not unit_config.get('ip'):
+            raise ValueError(f"Modbus unit #{index + 1} needs an 'ip'")
+        unit_id = int(unit_config.get('unit_id', MODBUS_UNIT_ID))
+        name = str(unit_config.get('name') or f"{unit_config['ip']}/{unit_id}")
+        try:
+            addresses = _resolve_addresses(unit_config, config['by_name'], config['by_group'])
+        except ValueError as e:
+            raise ValueError(f"Modbus unit '{name}': {e}")
+        if addresses is None:
+            addresses = list(config['by_address'])
+        units.append(ModbusUnit(
+            name, unit_config['ip'], int(unit_config.get('port') or 502), unit_id, addresses,
+            device_id=unit_config.get('device_id'),
+            interval=float(unit_config.get('interval', MODBUS_POLL_INTERVAL)),
+            timeout=float(unit_config.get('timeout', MODBUS_TIMEOUT)),
+            jitter=float(unit_config.get('jitter', MODBUS_JITTER)),
+            function=int(unit_config.get('function', MODBUS_FUNCTION)),
+            max_gap=int(unit_config.get('max_gap', MODBUS_MAX_GAP))))
+    if len({unit.name for unit in units}) != len(units):
+        raise ValueError("Modbus unit names must be unique")
+    return units
+
+
+class ModbusScheduler:
+    """Polls every ModbusUnit concurrently from one asyncio loop and passes samples to `on_sample`.
+
+    `on_sample` runs on the loop thread, so it must not block (ingest_live_data
+    only updates the live cache and queues the row for the batch writer).
+    set_units() replaces the unit list while running (config reload).
+    """
+
+    def __init__(self, on_sample, units):
+        self.on_sample = on_sample
+        self.units = list(units)
+        self._loop = None
+        self._stop = None
+        self._thread = None
+        self._tasks = {}  # unit name -> asyncio task, owned by the loop thread
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._loop = asyncio.new_event_loop()
+        self._stop = asyncio.Event()
+        self._thread = threading.Thread(target=self._loop.run_until_complete, args=(self._run(),),
+                                        name="ModbusSchedulerThread", daemon=True)
+        self._thread.start()
+        modbus_logger.info(f"🚀 Modbus scheduler started for {len(self.units)} unit(s): "
+                           + ", ".join(f"{unit.name} every {unit.interval}s" for unit in self.units))
+
+    def stop(self, timeout=5.0):
+        if not self._thread:
+            return
+        if self._thread.is_alive():
+            self._loop.call_soon_threadsafe(self._stop.set)
+            self._thread.join(timeout)
+        if not self._thread.is_alive():
+            self._loop.close()
+
+    def set_units(self, units):
+        """Poll `units` from now on. Units whose name and settings are unchanged keep running (and their stats)."""
+        current = {unit.name: unit for unit in self.units}
+        units = [current[unit.name] if unit.name in current and current[unit.name].settings() == unit.settings()
+                 else unit for unit in units]
+        self.units = units
+        if self._thread and self._thread.is_alive():
+            self._loop.call_soon_threadsafe(self._sync_tasks)
+        modbus_logger.info(f"🔄 Modbus units updated: {', '.join(unit.name for unit in units) or 'none'}.")
+
+    def _sync_tasks(self):
+        """Start/cancel unit tasks to match self.units. Runs on the loop thread."""
+        wanted = {unit.name: unit for unit in self.units}
+        for name, (unit, task) in list(self._tasks.items()):
+            if wanted.get(name) is not unit:
+                task.cancel()
+                del self._tasks[name]
+        for name, unit in wanted.items():
+            if name not in self._tasks:
+                self._tasks[name] = (unit, asyncio.create_task(self._poll_unit(unit), name=f"modbus:{name}"))
+
+    async def _run(self):
+        self._sync_tasks()
+        await self._stop.wait()
+        tasks = [task for _, task in self._tasks.values()]
+        self._tasks = {}
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _poll_unit(self, unit):
+        try:
+            await self._poll_forever(unit)
+        finally:
+            unit.client.close()
+
+    async def _poll_forever(self, unit):
+        loop = asyncio.get_running_loop()
+        # Random start phase so units with the same interval are spread over it
+        next_poll = loop.time() + random.uniform(0, unit.interval)
+        while True:
+            await asyncio.sleep(max(0.0, next_poll - loop.time()) + random.uniform(0, unit.jitter * unit.interval))
+            try:
+                sample = await unit.poll_once()
+                unit.polls += 1
+                if unit.last_error:
+                    modbus_logger.info(f"✅ Modbus unit {unit.name} reachable again.")
+                    unit.last_error = None
+                self.on_sample(sample)
+            except (OSError, ModbusError, asyncio.TimeoutError) as e:
+                unit.failures += 1
+                error = str(e) or type(e).__name__
+                if error != unit.last_error:
+                    modbus_logger.error(f"❌ Modbus poll of unit {unit.name} failed: {error}")
+                unit.last_error = error
+            except Exception as e:
+                unit.failures += 1
+                modbus_logger.error(f"❌ Unexpected error polling Modbus unit {unit.name}: {e}", exc_info=True)
+            # Fixed-rate schedule; slots that passed while this poll ran are missed deadlines, not a burst
+            next_poll += unit.interval
+            now = loop.time()
+            if next_poll < now:
+                missed = int((now - next_poll) // unit.interval) + 1
+                unit.missed_deadlines += missed
+                next_poll += missed * unit.interval
+
+    def stats(self):
+        return {'units': [unit.stats() for unit in self.units]}
@@ -0,0 +1,229 @@
+"""
+Packed storage format for sensor samples.
+
+With SENSOR_STORAGE_FORMAT=packed a sample is stored as one REAL[] column
+(`packed_values`) holding every register in REGISTER_CONFIG['by_address']
+order, instead of a JSONB document that repeats every register name per row.
+Missing values are NULL array elements.
+
+Each row carries `layout_version`, a stable hash of the register layout
+(names and column types in address order). Layouts are recorded in
+`<POSTGRES_TABLE>_layouts`, so rows written before a register_config.yaml
+change are decoded with the layout they were written with.
+
+encode_packed()/decode_packed() convert between a payload's 'data' dict and
+the array. Read paths call row_payload(), which returns raw_data for JSONB
+rows and a rebuilt {'timestamp', 'device_id', 'data'} payload for packed rows.
+The layout written is fixed for the life of the process; a hot reload of
+register_config.yaml that changes it takes effect on the next start.
+"""
+
+import os
+import json
+import math
+import time
+import zlib
+import logging
+
+from api.config_loader import REGISTER_CONFIG, CONFIG_REGISTRY
+from api.db_pool import POSTGRES_TABLE, get_connection, table_columns
+from api.register_columns import column_type, register_values, REGISTER_COLUMNS
+
+# 'jsonb' stores raw_data (default); 'packed' stores layout_version + packed_values
+SENSOR_STORAGE_FORMAT = os.getenv('SENSOR_STORAGE_FORMAT', 'jsonb').lower()
+
+LAYOUT_TABLE = f"{POSTGRES_TABLE}_layouts"
+# Columns and execute_values template of a packed insert (used by the batch writer)
+PACKED_INSERT_COLUMNS = ('timestamp', 'device_id', 'layout_version', 'packed_values')
+PACKED_INSERT_TEMPLATE = "(%s, %s, %s, %s::real[])"
+
+_PROBE_INTERVAL = 60.0  # seconds between schema/layout reloads while something is missing
+_FORCED_RELOAD_INTERVAL = 5.0  # minimum seconds between reloads triggered by an unknown layout version
+
+packed_logger = logging.getLogger("packed_storage")
+
+
+def build_layout(by_address):
+    """Return (names, types) of the registers in address order."""
+    registers = [by_address[address] for address in sorted(by_address)]
+    return tuple(reg['name'] for reg in registers), tuple(column_type(reg) for reg in registers)
+
+
+def layout_version(names, types):
+    """Stable 31-bit id of a layout, so writers need no DB round trip to tag rows."""
+    return zlib.crc32(json.dumps([names, types]).encode('utf-8')) & 0x7fffffff
+
+
+CURRENT_LAYOUT = build_layout(REGISTER_CONFIG['by_address'])
+CURRENT_LAYOUT_VERSION = layout_version(*CURRENT_LAYOUT)
+
+
+
+def _warn_on_layout_change(config):
+    if SENSOR_STORAGE_FORMAT == 'packed' and build_layout(config['by_address']) != CURRENT_LAYOUT:
+        packed_logger.warning("⚠️ register_config.yaml changed the packed register layout; "
+                              "new rows use it after the next restart.")
+
+
+CONFIG_REGISTRY.subscribe(_warn_on_layout_change)
+
+_layouts = {CURRENT_LAYOUT_VERSION: CURRENT_LAYOUT}  # version -> (names, types)
+_layouts_loaded_at = None
+_columns_ready = False
+_last_probe = None
+
+
+def ensure_packed_schema(cursor, table=POSTGRES_TABLE):
+    """Create the layout table, add the packed columns to `table` and record the current layout."""
+    global _columns_ready
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {LAYOUT_TABLE} (
+            version INTEGER PRIMARY KEY,
+            names TEXT[] NOT NULL,
+            types TEXT[] NOT NULL,
+            created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+    cursor.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = %s;
+    """, (table,))
+    existing = {row[0] for row in cursor.fetchall()}
+    if not existing:
+        raise LookupError(f"Table '{table}' does not exist")
+    if 'layout_version' not in existing:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS layout_version INTEGER;")
+    if 'packed_values' not in existing:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS packed_values REAL[];")
+    cursor.execute(f"""
+        INSERT INTO {LAYOUT_TABLE} (version, names, types) VALUES (%s, %s, %s)
+        ON CONFLICT (version) DO NOTHING;
+    """, (CURRENT_LAYOUT_VERSION, list(CURRENT_LAYOUT[0]), list(CURRENT_LAYOUT[1])))
+    _columns_ready = True
+
+
+def packed_columns_ready():
+    """True once the sensor table has the packed columns; checked against the DB at most every minute."""
+    global _columns_ready, _last_probe
+    if not _columns_ready and (_last_probe is None or time.monotonic() - _last_probe >= _PROBE_INTERVAL):
+        _last_probe = time.monotonic()
+        existing = table_columns()
+        _columns_ready = bool(existing) and 'packed_values' in existing
+    return _columns_ready
+
+
+def load_layouts(force=False):
+    """Return {version: (names, types)}, reloading from the layout table at most every minute."""
+    global _layouts, _layouts_loaded_at
+    age = None if _layouts_loaded_at is None else time.monotonic() - _layouts_loaded_at
+    if age is not None and age < (_FORCED_RELOAD_INTERVAL if force else _PROBE_INTERVAL):
+        return _layouts
+    if not packed_columns_ready():
+        return _layouts
+    _layouts_loaded_at = time.monotonic()
+    conn = get_connection()
+    if not conn:
+        return _layouts
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"SELECT version, names, types FROM {LAYOUT_TABLE};")
+            layouts = {version: (tuple(names), tuple(types)) for version, names, types in cursor.fetchall()}
+        layouts.setdefault(CURRENT_LAYOUT_VERSION, CURRENT_LAYOUT)
+        _layouts = layouts
+    except Exception as e:
+        conn.rollback()
+        packed_logger.warning(f"⚠️ Could not load packed layouts from {LAYOUT_TABLE}: {e}")
+    finally:
+        conn.close()
+    return _layouts
+
+
+def encode_packed(data, layout=None):
+    """Return (layout_version, values) for a payload's 'data' dict in the current layout (or `layout`, a
+    ((names, types), version) pair)."""
+    (names, _), version = layout or (CURRENT_LAYOUT, CURRENT_LAYOUT_VERSION)
+    if not isinstance(data, dict):
+        data = {}
+    values = []
+    for name in names:
+        value = data.get(name)
+        if isinstance(value, bool):
+            value = int(value)
+        if isinstance(value, str):
+            try:
+                value = float(value)
+            except ValueError:
+                value = None
+        values.append(float(value) if isinstance(value, (int, float)) and math.isfinite(value) else None)
+    return version, values
+
+
+def storage_layout():
+    """What a sensor row of this process looks like: (SENSOR_STORAGE_FORMAT, register columns, packed layout).
+
+    Fixed for the life of the process; api/decode_pool.py hands it to its worker processes so the rows they
+    build match this process's batch writer even after register_config.yaml changed.
+    """
+    return SENSOR_STORAGE_FORMAT, REGISTER_COLUMNS, (CURRENT_LAYOUT, CURRENT_LAYOUT_VERSION)
+
+
+def sensor_row(payload, layout=None):
+    """Batch writer row for a live payload ({'timestamp', 'device_id', 'data'}) in `layout` (default: this process's)."""
+    storage_format, columns, packed_layout = layout or storage_layout()
+    if storage_format == 'packed':
+        return (payload['timestamp'], payload['device_id']) + encode_packed(payload.get('data'), packed_layout)
+    # raw_data is stored as a JSON string
+    return (payload['timestamp'], payload['device_id'], json.dumps(payload)) + register_values(payload.get('data'), columns)
+
+
+def decode_packed(version, values):
+    """Return the {register: value} dict of a packed row, or None if its layout is unknown."""
+    layout = _layouts.get(version) or load_layouts(force=True).get(version)
+    if layout is None or values is None:
+        return None
+    data = {}
+    for name, sql_type, value in zip(layout[0], layout[1], values):
+        if value is None:
+            continue
+        data[name] = value if sql_type == 'REAL' else int(round(value))
+    return data
+
+
+def row_payload(row):
+    """Return the stored payload of a sensor row: raw_data as stored, or one rebuilt from packed_values."""
+    if row.get('raw_data'):
+        return row['raw_data']
+    if row.get('packed_values') is None:
+        return None
+    data = decode_packed(row.get('layout_version'), row['packed_values'])
+    if data is None:
+        return None
+    timestamp = row.get('timestamp') or row.get('db_timestamp')
+    return {
+        'timestamp': timestamp.isoformat() if timestamp else None,
+        'device_id': row.get('device_id') or row.get('db_device_id'),
+        'data': data,
+    }
+
+
+def packed_select_sql():
+    """Extra select-list columns read paths add so packed rows can be decoded ('' if not migrated)."""
+    return ", layout_version, packed_values" if packed_columns_ready() else ""
+
+
+def packed_projection_sql(name):
+    """SQL expression selecting register `name` from packed_values across known layouts, or None."""
+    if not packed_columns_ready():
+        return None
+    cases = []
+    for version, (names, types) in sorted(load_layouts().items()):
+        if name in names:
+            # Duplicate names decode to the last occurrence, so select that one here too
+            index = len(names) - names[::-1].index(name)
+            value = f"packed_values[{index}]"
+            if types[index - 1] != 'REAL':
+                value = f"round({value})::integer"  # Same as decode_packed: integer registers come back as ints
+            cases.append(f"WHEN {int(version)} THEN {value}")
+    if not cases:
+        return None
+    return f"CASE layout_version {' '.join(cases)} END"
@@ -0,0 +1,167 @@
+"""
+Daily range partitioning of the sensor table.
+
+create_sensor_table.py creates the table `PARTITION BY RANGE (timestamp)`
+with one child table per day (`<POSTGRES_TABLE>_pYYYYMMDD`, day boundaries in
+set_timezone) plus a DEFAULT partition for rows outside the prepared range.
+The maintenance job in app.py keeps PARTITION_PRECREATE_DAYS future days
+created, and retention drops (or detaches) whole days instead of deleting
+rows, so it costs no vacuum work. Rows that landed in DEFAULT (after downtime
+longer than the precreated range, or with a wrong clock) are moved into their
+day's partition when it is created.
+
+Time-range queries on `timestamp` get partition pruning for free.
+"""
+
+import os
+import re
+import logging
+from datetime import datetime, timedelta
+
+from api.db_pool import POSTGRES_TABLE, get_connection
+from api.timezone_config import set_timezone
+
+# Days of sensor data kept by the retention job
+DATA_RETENTION_DAYS = int(os.getenv('DATA_RETENTION_DAYS', '30'))
+# Number of future daily partitions kept ready ahead of the ingest path
+PARTITION_PRECREATE_DAYS = int(os.getenv('PARTITION_PRECREATE_DAYS', '7'))
+# 'drop' removes expired partitions, 'detach' keeps them as standalone tables for archiving
+PARTITION_RETENTION_MODE = os.getenv('PARTITION_RETENTION_MODE', 'drop').lower()
+
+DEFAULT_PARTITION = f"{POSTGRES_TABLE}_default"
+_PARTITION_RE = re.compile(rf"^{re.escape(POSTGRES_TABLE)}_p(\d{{8}})$")
+
+partition_logger = logging.getLogger("partitions")
+
+
+def day_start(value):
+    """Midnight (set_timezone) of the day containing `value`."""
+    local = value.astimezone(set_timezone)
+    return datetime(local.year, local.month, local.day, tzinfo=set_timezone)
+
+
+def partition_name(day):
+    return f"{POSTGRES_TABLE}_p{day:%Y%m%d}"
+
+
+def is_partitioned(cursor):
+    """True if POSTGRES_TABLE is a declaratively partitioned table."""
+    cursor.execute("""
+        SELECT EXISTS (
+            SELECT 1 FROM pg_partitioned_table pt
+            JOIN pg_class c ON c.oid = pt.partrelid
+            WHERE c.relname = %s AND c.relnamespace = 'public'::regnamespace
+        );
+    """, (POSTGRES_TABLE,))
+    return cursor.fetchone()[0]
+
+
+def list_partitions(cursor):
+    """Return {day: partition_name} for the daily partitions attached to POSTGRES_TABLE."""
+    cursor.execute("""
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = %s AND p.relnamespace = 'public'::regnamespace;
+    """, (POSTGRES_TABLE,))
+    partitions = {}
+    for (name,) in cursor.fetchall():
+        match = _PARTITION_RE.match(name)
+        if match:
+            day = datetime.strptime(match.group(1), '%Y%m%d').replace(tzinfo=set_timezone)
+            partitions[day] = name
+    return partitions
+
+
+def _default_has_rows(cursor, day):
+    """True if the DEFAULT partition exists and holds rows of `day`."""
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL;", (DEFAULT_PARTITION,))
+    if not cursor.fetchone()[0]:
+        return False
+    cursor.execute(f"""
+        SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE timestamp >= %s AND timestamp < %s);
+    """, (day, day + timedelta(days=1)))
+    return cursor.fetchone()[0]
+
+
+def _create_from_default(cursor, name, day):
+    """Create the partition of `day` and move that day's rows out of DEFAULT. Returns the rows moved.
+
+    PostgreSQL refuses to create a partition whose range DEFAULT already holds rows,
+    so DEFAULT is detached meanwhile; the caller commits all steps as one transaction.
+    """
+    end = day + timedelta(days=1)
+    cursor.execute(f"ALTER TABLE {POSTGRES_TABLE} DETACH PARTITION {DEFAULT_PARTITION};")
+    cursor.execute(f"CREATE TABLE {name} PARTITION OF {POSTGRES_TABLE} FOR VALUES FROM (%s) TO (%s);", (day, end))
+    cursor.execute(f"""
+        WITH moved AS (
+            DELETE FROM {DEFAULT_PARTITION} WHERE timestamp >= %s AND timestamp < %s RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved;
+    """, (day, end))
+    moved = cursor.rowcount
+    cursor.execute(f"ALTER TABLE {POSTGRES_TABLE} ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT;")
+    return moved
+
+
+def create_partitions(cursor, first_day, days):
+    """Create daily partitions for `days` days starting at `first_day`, plus the DEFAULT partition."""
+    existing = list_partitions(cursor)
+    created = []
+    first_day = day_start(first_day)
+    for offset in range(days):
+        # Step through calendar days; set_timezone has no DST so +1 day is always 24h
+        day = first_day + timedelta(days=offset)
+        if day in existing:
+            continue
+        name = partition_name(day)
+        if _default_has_rows(cursor, day):
+            moved = _create_from_default(cursor, name, day)
+            partition_logger.warning(f"⚠️ Moved {moved} rows of {day:%Y-%m-%d} from {DEFAULT_PARTITION} into {name}.")
+        else:
+            cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS {name} PARTITION OF {POSTGRES_TABLE}
+                FOR VALUES FROM (%s) TO (%s);
+            """, (day, day + timedelta(days=1)))
+        created.append(name)
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF {POSTGRES_TABLE} DEFAULT;")
+    return created
+
+
+def remove_expired_partitions(cursor, cutoff):
+    """Drop or detach daily partitions that end on or before `cutoff`. Returns the affected names."""
+    cutoff_day = day_start(cutoff)
+    removed = []
+    for day, name in sorted(list_partitions(cursor).items()):
+        if day + timedelta(days=1) > cutoff_day:
+            continue
+        if PARTITION_RETENTION_MODE == 'detach':
+            cursor.execute(f"ALTER TABLE {POSTGRES_TABLE} DETACH PARTITION {name};")
+        else:
+            cursor.execute(f"DROP TABLE IF EXISTS {name};")
+        removed.append(name)
+    return removed
+
+
+def maintain_partitions():
+    """Scheduler job: make sure today's and the next PARTITION_PRECREATE_DAYS partitions exist."""
+    conn = get_connection()
+    if not conn:
+        partition_logger.error("❌ Partition maintenance skipped: no PostgreSQL connection.")
+        return
+    try:
+        cursor = conn.cursor()
+        if not is_partitioned(cursor):
+            partition_logger.info(f"Table '{POSTGRES_TABLE}' is not partitioned; skipping partition maintenance.")
+        else:
+            # One transaction, so a move out of DEFAULT never leaves it detached
+            created = create_partitions(cursor, datetime.now(set_timezone), PARTITION_PRECREATE_DAYS + 1)
+            conn.commit()
+            if created:
+                partition_logger.info(f"✅ Created partitions: {', '.join(created)}")
+        cursor.close()
+    except Exception as e:
+        conn.rollback()
+        partition_logger.error(f"❌ Error during partition maintenance: {e}", exc_info=True)
+    finally:
+        conn.close()
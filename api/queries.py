@@ -0,0 +1,49 @@
+"""
+SQL helpers shared by the historical read paths (live_data and hist_data).
+"""
+
+from api.register_columns import REGISTER_COLUMN_BY_NAME, register_columns_ready
+from api.packed_storage import packed_projection_sql
+
+
+def parse_variables_param(value):
+    """Split a comma-separated `variables=` parameter into register names, keeping order and dropping duplicates."""
+    names = []
+    for name in (value or '').split(','):
+        name = name.strip()
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def register_projection(variables):
+    """Return (select_sql, params) extracting only `variables` from raw_data in SQL.
+
+    Each register becomes a column v0..vN (`raw_data->'data'->'<name>'`), so
+    PostgreSQL only detoasts and ships the requested fields. Register names are
+    passed as query parameters, never interpolated.
+
+    Configured registers are read from their typed column once the table has
+    them, and from packed_values for rows stored in the packed format; raw_data
+    is only consulted for rows that have neither.
+    """
+    typed_ready = register_columns_ready()
+    columns = []
+    for i, name in enumerate(variables):
+        sources = []
+        typed = REGISTER_COLUMN_BY_NAME.get(name) if typed_ready else None
+        if typed:
+            sources.append(f'to_jsonb("{typed[0]}")')
+        packed = packed_projection_sql(name)
+        if packed:
+            sources.append(f"to_jsonb({packed})")
+        if sources:
+            columns.append(f"COALESCE({', '.join(sources)}, raw_data->'data'->%s) AS v{i}")
+        else:
+            columns.append(f"raw_data->'data'->%s AS v{i}")
+    return ", ".join(columns), list(variables)
+
+
+def projected_values(row, variables):
+    """Map the v0..vN columns of a projected row back to register names."""
+    return {name: row[f"v{i}"] for i, name in enumerate(variables)}
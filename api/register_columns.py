@@ -0,0 +1,177 @@
+"""
+Typed per-register columns of the sensor table, generated from register_config.yaml.
+
+Every configured register gets one native column next to raw_data:
+  - dataType bool                  -> SMALLINT (0/1)
+  - int16/sint16 with scale 1      -> INTEGER
+  - anything else (scaled values)  -> REAL
+
+Column names are the register name lower-cased with non-alphanumerics
+replaced by '_' (e.g. 'Cluster-1 Condition' -> cluster_1_condition); the
+register address is appended when that would clash with another column.
+
+`ensure_register_columns()` is the migration: it adds the columns of newly
+configured registers with ALTER TABLE ... ADD COLUMN IF NOT EXISTS. The batch
+writer runs it before its first insert, and ingest fills the columns from
+the payload, so reads and aggregates can use native columns instead of JSONB.
+The column set is fixed for the life of the process: a hot reload of
+register_config.yaml that changes it only takes effect on the next start.
+"""
+
+import re
+import math
+import time
+import logging
+
+from api.config_loader import REGISTER_CONFIG, CONFIG_REGISTRY
+from api.db_pool import POSTGRES_TABLE, table_columns
+
+# Columns of the sensor table that registers must not shadow
+BASE_COLUMNS = ('id', 'timestamp', 'device_id', 'raw_data', 'created_at')
+# Columns of the insert performed by the batch writer, before the register columns
+BASE_INSERT_COLUMNS = ('timestamp', 'device_id', 'raw_data')
+
+_MAX_IDENTIFIER = 63  # PostgreSQL NAMEDATALEN - 1
+_PROBE_INTERVAL = 60.0  # seconds between schema checks while the columns are missing
+
+columns_logger = logging.getLogger("register_columns")
+
+
+def column_type(reg):
+    """SQL type of the typed column for one register definition."""
+    data_type = reg.get('dataType')
+    if data_type == 'bool':
+        return 'SMALLINT'
+    if data_type in ('int16', 'sint16', 'uint16') and reg.get('scale', 1) == 1:
+        return 'INTEGER'
+    return 'REAL'
+
+
+def _slug(name):
+    slug = re.sub(r'[^a-z0-9]+', '_', str(name).lower()).strip('_')
+    if not slug or slug[0].isdigit():
+        slug = f"r_{slug}"
+    return slug
+
+
+def build_register_columns(registers):
+    """Return [(register_name, column_name, sql_type)] in address order, one per register name."""
+    by_name = {}
+    for reg in sorted(registers, key=lambda r: r.get('address', 0)):
+        by_name[reg['name']] = reg  # Later duplicates win, like REGISTER_CONFIG['by_name']
+
+    used = set(BASE_COLUMNS)
+    columns = []
+    for name, reg in by_name.items():
+        column = _slug(name)[:_MAX_IDENTIFIER]
+        if column in used:
+            suffix = f"_{reg.get('address', len(columns))}"
+            column = column[:_MAX_IDENTIFIER - len(suffix)] + suffix
+        used.add(column)
+        columns.append((name, column, column_type(reg)))
+    return columns
+
+
+REGISTER_COLUMNS = build_register_columns(REGISTER_CONFIG['raw'])
+REGISTER_COLUMN_BY_NAME = {name: (column, sql_type) for name, column, sql_type in REGISTER_COLUMNS}
+# Full column list of a sensor row as produced by ingest (see register_values)
+SENSOR_INSERT_COLUMNS = BASE_INSERT_COLUMNS + tuple(f'"{column}"' for _, column, _ in REGISTER_COLUMNS)
+
+
+
+def _warn_on_column_change(config):
+    if build_register_columns(config['raw']) != REGISTER_COLUMNS:
+        columns_logger.warning("⚠️ register_config.yaml changed the register columns; "
+                               "they are migrated on the next restart (raw_data still stores every value).")
+
+
+CONFIG_REGISTRY.subscribe(_warn_on_column_change)
+
+# Set once the table is known to have every register column (reads only use them then)
+_columns_ready = False
+_last_probe = None
+
+
+def register_columns_ready():
+    """True once the sensor table has all register columns; checked against the DB at most every minute."""
+    global _columns_ready, _last_probe
+    if not _columns_ready and (_last_probe is None or time.monotonic() - _last_probe >= _PROBE_INTERVAL):
+        _last_probe = time.monotonic()
+        existing = table_columns()
+        _columns_ready = bool(existing) and all(column in existing for _, column, _ in REGISTER_COLUMNS)
+    return _columns_ready
+
+
+def register_columns_sql():
+    """Column definitions for CREATE TABLE."""
+    return ",\n".join(f'"{column}" {sql_type}' for _, column, sql_type in REGISTER_COLUMNS)
+
+
+def ensure_register_columns(cursor, table=POSTGRES_TABLE):
+    """Add missing register columns to `table`. Returns the names of the columns added."""
+    global _columns_ready
+    cursor.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = %s;
+    """, (table,))
+    existing = {row[0] for row in cursor.fetchall()}
+    if not existing:
+        raise LookupError(f"Table '{table}' does not exist")
+    added = []
+    for _, column, sql_type in REGISTER_COLUMNS:
+        if column not in existing:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS "{column}" {sql_type};')
+            added.append(column)
+    if added:
+        columns_logger.info(f"✅ Added register columns to {table}: {', '.join(added)}")
+    _columns_ready = True
+    return added
+
+
+def backfill_register_columns(cursor, columns, table=POSTGRES_TABLE):
+    """Fill `columns` of existing rows from raw_data. Returns the number of rows updated."""
+    assignments = []
+    conditions = []
+    params = []
+    for name, column, sql_type in REGISTER_COLUMNS:
+        if column not in columns:
+            continue
+        value = "raw_data->'data'->%s"
+        numeric = f"CASE jsonb_typeof({value}) WHEN 'number' THEN ({value} #>> '{{}}')::double precision " \
+                  f"WHEN 'boolean' THEN ({value})::text::boolean::int END"
+        if sql_type == 'REAL':
+            assignments.append(f'"{column}" = ({numeric})::real')
+        else:
+            assignments.append(f'"{column}" = round({numeric})::{sql_type.lower()}')
+        params.extend([name] * 3)
+        conditions.append(f'"{column}" IS NULL')
+    if not assignments:
+        return 0
+    cursor.execute(f"""
+        UPDATE {table} SET {', '.join(assignments)}
+        WHERE raw_data ? 'data' AND ({' OR '.join(conditions)});
+    """, params)
+    return cursor.rowcount
+
+
+def _coerce(value, sql_type):
+    if isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            return None
+    if not isinstance(value, (bool, int, float)) or not math.isfinite(value):
+        return None
+    if sql_type == 'REAL':
+        return float(value)
+    if sql_type == 'SMALLINT':
+        return 1 if value else 0
+    value = int(round(value))
+    return value if -2147483648 <= value <= 2147483647 else None
+
+
+def register_values(data, columns=None):
+    """Typed values for REGISTER_COLUMNS (or `columns`) from a payload's 'data' dict (None where missing)."""
+    if not isinstance(data, dict):
+        data = {}
+    return tuple(_coerce(data.get(name), sql_type) for name, _, sql_type in (columns or REGISTER_COLUMNS))
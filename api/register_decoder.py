@@ -0,0 +1,145 @@
+"""
+RegisterDecoder: converts stored register values into engineering units.
+
+Compiled from the register list of register_config.yaml. It lives in its own
+module so NumPy is only imported when the first decoder is built (on the
+first ?units=engineering request or config reload), not at startup;
+api/config_loader.py builds one per configuration version.
+"""
+
+import math
+import numpy as np
+
+
+class RegisterDecoder:
+    """Converts stored register values into engineering units, compiled once from the register list.
+
+    Per register (address order, one entry per name) it precomputes NumPy
+    arrays for the sign conversion (`dataType: sint16` words >= 0x8000 are
+    two's complement), booleans (`dataType: bool` -> 0/1), `scale` and an
+    optional `offset`. decode_block() converts a whole (rows x registers)
+    matrix in a few vectorized operations; decode_sample() and decode_rows()
+    wrap it for one payload and for a block of API rows. Registers shown as
+    `bitmask_display` can be expanded into their mapped bits.
+    """
+
+    def __init__(self, registers):
+        by_name = {}
+        for reg in sorted(registers, key=lambda r: r.get('address', 0)):
+            by_name[reg['name']] = reg  # Later duplicates win, like registers_by_name
+        self.names = tuple(by_name)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        regs = list(by_name.values())
+        self.signed = np.array([reg.get('dataType') == 'sint16' for reg in regs], dtype=bool)
+        self.boolean = np.array([reg.get('dataType') == 'bool' for reg in regs], dtype=bool)
+        self.scale = np.array([float(reg.get('scale', 1) or 1) for reg in regs], dtype=np.float64)
+        self.offset = np.array([float(reg.get('offset', 0) or 0) for reg in regs], dtype=np.float64)
+        # Dividing by 10 instead of multiplying by 0.1 returns 12.3 rather than 12.300000000000001
+        inverse = 1.0 / self.scale
+        divide = np.abs(inverse - np.round(inverse)) < 1e-9
+        self.divisor = np.where(divide, np.round(inverse), 1.0)
+        self.multiplier = np.where(divide, 1.0, self.scale)
+        self.bit_maps = {}  # name -> (bit positions array, labels)
+        for reg in regs:
+            ui = reg.get('ui', {})
+            if ui.get('component') == 'bitmask_display' and ui.get('bit_mapping'):
+                bits = sorted(int(bit) for bit in ui['bit_mapping'])
+                self.bit_maps[reg['name']] = (np.array(bits, dtype=np.int64),
+                                              [str(ui['bit_mapping'].get(str(bit), ui['bit_mapping'].get(bit))) for bit in bits])
+
+    def decode_block(self, raw, names=None):
+        """Convert a (rows x len(names)) array of stored values (NaN = missing) into engineering units."""
+        values = np.array(raw, dtype=np.float64, ndmin=2)  # Always a copy; converted in place below
+        idx = slice(None) if names is None else np.array([self.index[name] for name in names], dtype=np.int64)
+        signed, boolean = self.signed[idx], self.boolean[idx]
+        if signed.any():
+            wrap = values >= 0x8000
+            wrap &= signed  # Row vector broadcast over all samples
+            np.subtract(values, 0x10000, out=values, where=wrap)
+        if boolean.any():
+            block = values[:, boolean]
+            values[:, boolean] = np.where(np.isnan(block), np.nan, block != 0)
+        divisor, multiplier, offset = self.divisor[idx], self.multiplier[idx], self.offset[idx]
+        if (divisor != 1).any():
+            np.divide(values, divisor, out=values)
+        if (multiplier != 1).any():
+            np.multiply(values, multiplier, out=values)
+        if offset.any():
+            np.add(values, offset, out=values)
+        return values
+
+    def decode_sample(self, data, expand_bits=False):
+        """Return a copy of one payload's 'data' dict with configured registers in engineering units."""
+        if not isinstance(data, dict):
+            return data
+        names = [name for name in data if name in self.index and _is_number(data[name])]
+        result = dict(data)
+        if names:
+            decoded = self.decode_block([[float(data[name]) for name in names]], names)[0]
+            for name, value in zip(names, decoded.tolist()):
+                result[name] = _clean(value)
+                if expand_bits and name in self.bit_maps:
+                    result[f"{name}_bits"] = self.expand_bits(name, [data[name]])[0]
+        return result
+
+    def _changes_value(self, name):
+        i = self.index[name]
+        return bool(self.signed[i] or self.boolean[i] or self.scale[i] != 1 or self.offset[i] != 0)
+
+    def decode_rows(self, rows, expand_bits=False):
+        """Convert a block of flat API rows ({'timestamp', register: value}) in place, column by column."""
+        if not rows:
+            return rows
+        first = rows[0]
+        names = [name for name in self.names
+                 if (self._changes_value(name) or (expand_bits and name in self.bit_maps))
+                 and (name in first or any(name in row for row in rows))]
+        if not names:
+            return rows
+        matrix = np.empty((len(rows), len(names)), dtype=np.float64)
+        for j, name in enumerate(names):
+            column = [row.get(name) for row in rows]
+            try:
+                matrix[:, j] = np.array(column, dtype=np.float64)  # None -> NaN
+            except (TypeError, ValueError):
+                matrix[:, j] = [_number_or_nan(value) for value in column]
+        decoded = self.decode_block(matrix, names)
+        missing = np.isnan(decoded)
+        for j, name in enumerate(names):
+            if self._changes_value(name):
+                column = decoded[:, j]
+                integral = not missing[:, j].all() and bool(np.all(np.mod(column[~missing[:, j]], 1) == 0))
+                values = np.where(missing[:, j], 0, column).astype(np.int64).tolist() if integral else column.tolist()
+                for row, value, miss in zip(rows, values, missing[:, j].tolist()):
+                    if not miss:
+                        row[name] = value
+            if expand_bits and name in self.bit_maps:
+                for row, bits in zip(rows, self.expand_bits(name, matrix[:, j])):
+                    if bits is not None:
+                        row[f"{name}_bits"] = bits
+        return rows
+
+    def expand_bits(self, name, words):
+        """Return one {label: 0/1} dict per stored word of a bitmask register (None where missing)."""
+        positions, labels = self.bit_maps[name]
+        words = np.asarray(words, dtype=np.float64)
+        missing = np.isnan(words)
+        flags = (np.where(missing, 0, words).astype(np.int64)[:, None] >> positions) & 1
+        return [None if miss else dict(zip(labels, row)) for miss, row in zip(missing.tolist(), flags.tolist())]
+
+
+def _is_number(value):
+    return isinstance(value, (int, float))  # bool included
+
+
+def _number_or_nan(value):
+    if isinstance(value, (int, float)):
+        return float(value)
+    return math.nan
+
+
+def _clean(value):
+    """JSON-friendly scalar: NaN -> None, integral floats -> int."""
+    if math.isnan(value):
+        return None
+    return int(value) if value.is_integer() else value
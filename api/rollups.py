@@ -0,0 +1,294 @@
+"""
+Incremental time-bucket rollups (1m / 15m / 1h) of the sensor table.
+
+Each rollup table holds one row per (bucket, device_id, register) with
+min, max, sum, count, first and last value. refresh_rollups() runs from the
+scheduler in app.py and only recomputes buckets after the stored watermark:
+1m buckets are built from raw rows, 15m from 1m, 1h from 15m.
+
+Rows can arrive behind the watermark (spool replay, the broker's backlog after
+an outage, shared subscribers delivering out of order). Each refresh looks up
+the oldest sample among rows whose created_at is newer than the previous
+refresh and recomputes every level from that sample's bucket onwards.
+
+/api/historical-data reads the coarsest rollup whose bucket width still meets
+the requested resolution (range / max_points) and only reads raw rows for the
+tail after the rollup watermark.
+"""
+
+import os
+import logging
+from datetime import datetime, timedelta, timezone
+import psycopg2
+
+from api.db_pool import POSTGRES_TABLE, get_connection
+from api.packed_storage import LAYOUT_TABLE, packed_columns_ready
+
+# (name, bucket width in seconds), finest first; each level is built from the previous one
+ROLLUP_RESOLUTIONS = (('1m', 60), ('15m', 900), ('1h', 3600))
+# How often the scheduler refreshes the rollups (seconds)
+ROLLUP_INTERVAL_SECONDS = int(os.getenv('ROLLUP_INTERVAL_SECONDS', '60'))
+# Maximum time span recomputed per statement during a backfill
+ROLLUP_CHUNK = timedelta(hours=int(os.getenv('ROLLUP_CHUNK_HOURS', '6')))
+# Late rows are looked up from this long before the previous refresh, covering inserts still in flight then
+ROLLUP_LATE_MARGIN = timedelta(seconds=int(os.getenv('ROLLUP_LATE_MARGIN_SECONDS', '60')))
+# Pseudo resolution in the state table: created_at up to which late rows have been handled
+LATE_ROWS_STATE = 'late_rows'
+
+rollup_logger = logging.getLogger("rollups")
+
+
+def rollup_table(name):
+    return f"{POSTGRES_TABLE}_rollup_{name}"
+
+
+ROLLUP_STATE_TABLE = f"{POSTGRES_TABLE}_rollup_state"
+
+
+def ensure_rollup_tables(cursor):
+    """Create the rollup tables and the watermark table if they do not exist."""
+    for name, _ in ROLLUP_RESOLUTIONS:
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {rollup_table(name)} (
+                bucket TIMESTAMPTZ NOT NULL,
+                device_id VARCHAR(100) NOT NULL,
+                register TEXT NOT NULL,
+                min_value DOUBLE PRECISION,
+                max_value DOUBLE PRECISION,
+                sum_value DOUBLE PRECISION,
+                sample_count INTEGER NOT NULL,
+                first_value DOUBLE PRECISION,
+                last_value DOUBLE PRECISION,
+                PRIMARY KEY (bucket, device_id, register)
+            );
+        """)
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {ROLLUP_STATE_TABLE} (
+            resolution TEXT PRIMARY KEY,
+            watermark TIMESTAMPTZ NOT NULL
+        );
+    """)
+
+
+_UPSERT_SET = """
+    ON CONFLICT (bucket, device_id, register) DO UPDATE SET
+        min_value = EXCLUDED.min_value,
+        max_value = EXCLUDED.max_value,
+        sum_value = EXCLUDED.sum_value,
+        sample_count = EXCLUDED.sample_count,
+        first_value = EXCLUDED.first_value,
+        last_value = EXCLUDED.last_value
+"""
+
+
+def _raw_rollup_sql(dest, packed=False):
+    """Aggregate numeric registers of raw_data->'data' (and packed_values) into buckets of %(res)s seconds."""
+    # Packed rows carry no raw_data; their values are paired with the register names of their layout
+    packed_values = f"""
+            UNION ALL
+            SELECT p.key, p.num
+            FROM {LAYOUT_TABLE} l, unnest(l.names, s.packed_values) AS p(key, num)
+            WHERE l.version = s.layout_version AND p.num IS NOT NULL""" if packed else ""
+    return f"""
+        INSERT INTO {dest} (bucket, device_id, register, min_value, max_value, sum_value, sample_count, first_value, last_value)
+        SELECT to_timestamp(floor(extract(epoch FROM s.timestamp) / %(res)s) * %(res)s) AS bucket,
+               s.device_id,
+               kv.key,
+               min(kv.num), max(kv.num), sum(kv.num), count(*),
+               (array_agg(kv.num ORDER BY s.timestamp ASC))[1],
+               (array_agg(kv.num ORDER BY s.timestamp DESC))[1]
+        FROM {POSTGRES_TABLE} s
+        CROSS JOIN LATERAL (
+            SELECT key, (value #>> '{{}}')::double precision AS num
+            FROM jsonb_each(s.raw_data->'data')
+            WHERE jsonb_typeof(value) = 'number'{packed_values}
+        ) kv
+        WHERE s.timestamp >= %(start)s AND s.timestamp < %(end)s
+        GROUP BY 1, 2, 3
+        {_UPSERT_SET}
+    """
+
+
+def _merge_rollup_sql(dest, source):
+    """Merge finer rollup buckets from `source` into buckets of %(res)s seconds."""
+    return f"""
+        INSERT INTO {dest} (bucket, device_id, register, min_value, max_value, sum_value, sample_count, first_value, last_value)
+        SELECT to_timestamp(floor(extract(epoch FROM r.bucket) / %(res)s) * %(res)s) AS bucket,
+               r.device_id,
+               r.register,
+               min(r.min_value), max(r.max_value), sum(r.sum_value), sum(r.sample_count),
+               (array_agg(r.first_value ORDER BY r.bucket ASC))[1],
+               (array_agg(r.last_value ORDER BY r.bucket DESC))[1]
+        FROM {source} r
+        WHERE r.bucket >= %(start)s AND r.bucket < %(end)s
+        GROUP BY 1, 2, 3
+        {_UPSERT_SET}
+    """
+
+
+def _floor_time(value, seconds):
+    epoch = int(value.timestamp()) // seconds * seconds
+    return datetime.fromtimestamp(epoch, tz=timezone.utc)
+
+
+def _get_watermarks(cursor):
+    cursor.execute(f"SELECT resolution, watermark FROM {ROLLUP_STATE_TABLE}")
+    return dict(cursor.fetchall())
+
+
+def _set_watermark(cursor, name, value):
+    """Store the watermark of `name`; a recomputation behind it never moves it back."""
+    cursor.execute(f"""
+        INSERT INTO {ROLLUP_STATE_TABLE} (resolution, watermark) VALUES (%s, %s)
+        ON CONFLICT (resolution) DO UPDATE SET watermark = GREATEST({ROLLUP_STATE_TABLE}.watermark, EXCLUDED.watermark)
+    """, (name, value))
+
+
+def _late_rows_since(cursor, checked_until, watermark):
+    """Oldest sample time of rows stored since `checked_until` behind `watermark`, or None."""
+    cursor.execute(f"""
+        SELECT min(timestamp) FROM {POSTGRES_TABLE}
+        WHERE created_at >= %s AND timestamp < %s
+    """, (checked_until - ROLLUP_LATE_MARGIN, watermark))
+    return cursor.fetchone()[0]
+
+
+def _refresh_level(conn, cursor, name, seconds, source_name, source_watermark, watermark, late_since=None):
+    """Recompute complete buckets of one rollup level from its watermark (or `late_since`) up to what its source covers."""
+    dest = rollup_table(name)
+    end = _floor_time(source_watermark, seconds)
+    if watermark is not None:
+        # Recompute the last bucket again to absorb rows that arrived late
+        start = max(watermark - timedelta(seconds=seconds), datetime.fromtimestamp(0, tz=timezone.utc))
+        if late_since is not None:
+            start = min(start, _floor_time(late_since, seconds))
+    else:
+        if source_name is None:
+            cursor.execute(f"SELECT min(timestamp) FROM {POSTGRES_TABLE}")
+        else:
+            cursor.execute(f"SELECT min(bucket) FROM {rollup_table(source_name)}")
+        first = cursor.fetchone()[0]
+        if first is None:
+            return None
+        start = _floor_time(first, seconds)
+
+    sql = _raw_rollup_sql(dest, packed_columns_ready()) if source_name is None else _merge_rollup_sql(dest, rollup_table(source_name))
+    while start < end:
+        chunk_end = min(start + ROLLUP_CHUNK, end)
+        cursor.execute(sql, {'res': seconds, 'start': start, 'end': chunk_end})
+        _set_watermark(cursor, name, chunk_end)
+        conn.commit()
+        start = chunk_end
+        watermark = max(watermark, chunk_end) if watermark is not None else chunk_end
+    return watermark
+
+
+def refresh_rollups():
+    """Scheduler job: bring every rollup level up to date. Safe to run repeatedly."""
+    conn = get_connection()
+    if not conn:
+        rollup_logger.error("❌ Rollup refresh skipped: no PostgreSQL connection.")
+        return
+    cursor = None
+    try:
+        cursor = conn.cursor()
+        ensure_rollup_tables(cursor)
+        conn.commit()
+        watermarks = _get_watermarks(cursor)
+        cursor.execute("SELECT now()")
+        refresh_started = cursor.fetchone()[0]
+
+        # Rows stored since the last refresh with samples behind the finest watermark
+        late_since = None
+        finest = ROLLUP_RESOLUTIONS[0][0]
+        if finest in watermarks and LATE_ROWS_STATE in watermarks:
+            late_since = _late_rows_since(cursor, watermarks[LATE_ROWS_STATE], watermarks[finest])
+            if late_since is not None:
+                rollup_logger.info(f"🔄 Late rows since {late_since.isoformat()}; recomputing rollups from there.")
+
+        # Raw data is complete up to "now"; each coarser level is complete up to the finer level's watermark
+        source_name = None
+        source_watermark = datetime.now(timezone.utc)
+        for name, seconds in ROLLUP_RESOLUTIONS:
+            watermark = _refresh_level(conn, cursor, name, seconds, source_name, source_watermark, watermarks.get(name),
+                                       late_since)
+            if watermark is None:
+                break
+            rollup_logger.info(f"Rollup {name} up to date until {watermark.isoformat()}")
+            source_name, source_watermark = name, watermark
+        _set_watermark(cursor, LATE_ROWS_STATE, refresh_started)
+        conn.commit()
+    except psycopg2.Error as e:
+        conn.rollback()
+        rollup_logger.error(f"❌ PostgreSQL error while refreshing rollups: {e}")
+    except Exception as e:
+        conn.rollback()
+        rollup_logger.error(f"❌ Unexpected error while refreshing rollups: {e}", exc_info=True)
+    finally:
+        if cursor:
+            cursor.close()
+        conn.close()
+
+
+def choose_rollup(range_seconds, max_points):
+    """Return (name, seconds) of the coarsest rollup whose bucket fits range/max_points, or None."""
+    resolution = range_seconds / max_points
+    chosen = None
+    for name, seconds in ROLLUP_RESOLUTIONS:
+        if seconds <= resolution:
+            chosen = (name, seconds)
+    return chosen
+
+
+def read_rollup_rows(conn, name, start_time, end_time, device_id=None, variables=None, tz=timezone.utc):
+    """Read average values per bucket as historical.js rows.
+
+    Returns (rows, row_times, watermark), or None if the rollup is missing or
+    not built yet. Rows cover the buckets from the one containing start_time
+    up to the watermark; the caller reads raw rows for the rest of the range.
+    """
+    # The bucket holding start_time is read whole: raw rows only start at the
+    # watermark, so skipping it would leave a gap at the start of the chart
+    first_bucket = _floor_time(start_time, dict(ROLLUP_RESOLUTIONS)[name])
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SELECT watermark FROM {ROLLUP_STATE_TABLE} WHERE resolution = %s", (name,))
+        result = cursor.fetchone()
+        if not result or result[0] <= first_bucket:
+            return None
+        watermark = min(result[0], end_time)
+
+        where_conditions = ["bucket >= %s", "bucket < %s"]
+        params = [first_bucket, watermark]
+        if device_id:
+            where_conditions.append("device_id = %s")
+            params.append(device_id)
+        if variables:
+            where_conditions.append("register = ANY(%s)")
+            params.append(list(variables))
+        cursor.execute(f"""
+            SELECT bucket, register, sum(sum_value) / NULLIF(sum(sample_count), 0) AS avg_value
+            FROM {rollup_table(name)}
+            WHERE {' AND '.join(where_conditions)}
+            GROUP BY bucket, register
+            ORDER BY bucket ASC
+        """, params)
+
+        rows = []
+        row_times = []
+        current_bucket = None
+        for bucket, register, avg_value in cursor:
+            if bucket != current_bucket:
+                current_bucket = bucket
+                # The leading partial bucket is plotted at start_time to stay inside the range
+                point_time = max(bucket, start_time)
+                rows.append({'timestamp': point_time.astimezone(tz).isoformat()})
+                row_times.append(point_time.timestamp())
+            rows[-1][register] = avg_value
+        return rows, row_times, watermark
+    except psycopg2.Error as e:
+        conn.rollback()
+        rollup_logger.warning(f"⚠️ Rollup {name} unavailable, falling back to raw rows: {e}")
+        return None
+    finally:
+        cursor.close()
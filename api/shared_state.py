@@ -0,0 +1,149 @@
+"""
+Live state shared by the ingestion leader with the HTTP-only workers.
+
+Only the leader process (api/leader.py) receives samples, but every worker
+answers GET /api/live-data, the SSE stream and /api/ingestion-stats. The
+leader writes its latest-value cache and ingestion stats to
+SHARED_STATE_PATH (JSON, on tmpfs by default) at most every
+SHARED_STATE_INTERVAL seconds when the cache changed (stats alone are
+refreshed every SHARED_STATE_STATS_INTERVAL seconds). The file is replaced
+atomically. Followers poll its mtime at the same interval and restore
+changed entries into their own cache and SSE broker, so every worker serves
+the same live data, at most one interval behind the leader.
+"""
+
+import os
+import json
+import time
+import tempfile
+import threading
+import logging
+
+_DEFAULT_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+SHARED_STATE_PATH = os.getenv('SHARED_STATE_PATH', os.path.join(_DEFAULT_DIR, 'vflow_live_state.json'))
+SHARED_STATE_INTERVAL = float(os.getenv('SHARED_STATE_INTERVAL', '0.5'))  # seconds
+SHARED_STATE_STATS_INTERVAL = float(os.getenv('SHARED_STATE_STATS_INTERVAL', '5.0'))  # seconds
+
+shared_logger = logging.getLogger("shared_state")
+
+
+class SharedLiveState:
+    """Publishes (leader) or follows (HTTP-only worker) the live cache through a shared file."""
+
+    def __init__(self, cache, broker, path=SHARED_STATE_PATH, interval=SHARED_STATE_INTERVAL,
+                 stats_interval=SHARED_STATE_STATS_INTERVAL):
+        self.cache = cache
+        self.broker = broker
+        self.path = path
+        self.interval = interval
+        self.stats_interval = stats_interval
+        self.role = None  # 'publisher' or 'follower'
+        self.leader_stats = None  # Stats last published by the leader (followers)
+        self._stats = None
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._written_version = None
+        self._written_at = 0.0
+        self._file_signature = None
+        self._seen = {}  # device_id -> received_at_server of the entry already restored
+        self.writes = 0
+        self.reads = 0
+
+    def start_publisher(self, stats=None):
+        """Write the leader's cache (and `stats()`) from now on; replaces a running follower."""
+        self._start('publisher', stats)
+
+    def start_follower(self):
+        self._start('follower')
+
+    def _start(self, role, stats=None):
+        if self.role == role and self._thread and self._thread.is_alive():
+            return
+        self.stop()
+        self.role = role
+        self._stats = stats
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name=f"SharedState{role.title()}Thread", daemon=True)
+        self._thread.start()
+        shared_logger.info(f"Shared live state: {role} of {self.path} (every {self.interval}s).")
+
+    def stop(self, timeout=5.0):
+        self._stop_event.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        step = self.publish_once if self.role == 'publisher' else self.follow_once
+        while True:
+            try:
+                step()
+            except Exception as e:
+                shared_logger.error(f"❌ Shared live state {self.role} error: {e}", exc_info=True)
+            if self._stop_event.wait(self.interval):
+                return
+
+    def publish_once(self, force=False):
+        """Write the state file if the cache changed (or the stats are due). Returns True if written."""
+        version, latest_device, entries = self.cache.snapshot()
+        now = time.monotonic()
+        if not force and version == self._written_version and now - self._written_at < self.stats_interval:
+            return False
+        state = {
+            'pid': os.getpid(),
+            'written_at': time.time(),
+            'latest_device': latest_device,
+            'entries': [{'entry': entry, 'age_seconds': age} for entry, age in entries.values()],
+            'stats': self._stats() if self._stats else None,
+        }
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, default=str)
+        os.replace(tmp_path, self.path)
+        self._written_version = version
+        self._written_at = now
+        self.writes += 1
+        return True
+
+    def follow_once(self):
+        """Restore entries changed since the last read into the local cache and SSE broker. Returns their count."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return 0
+        signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)  # os.replace gives every write a new inode
+        if signature == self._file_signature:
+            return 0
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            shared_logger.warning(f"⚠️ Could not read shared live state {self.path}: {e}")
+            return 0
+        self._file_signature = signature
+        self.reads += 1
+        self.leader_stats = state.get('stats')
+        delay = max(0.0, time.time() - state.get('written_at', time.time()))
+        latest_device = state.get('latest_device')
+        # The leader's most recent device is restored last, so it stays the default device here too
+        items = sorted(state.get('entries', []), key=lambda item: item['entry'].get('device_id') == latest_device)
+        restored = 0
+        for item in items:
+            entry = item['entry']
+            device_id = entry.get('device_id', 'unknown_device')
+            if self._seen.get(device_id) == entry.get('received_at_server'):
+                continue
+            self._seen[device_id] = entry.get('received_at_server')
+            self.cache.restore(entry, item.get('age_seconds', 0.0) + delay)
+            self.broker.publish(entry)
+            restored += 1
+        return restored
+
+    def stats(self):
+        return {
+            'role': self.role,
+            'path': self.path,
+            'interval': self.interval,
+            'writes': self.writes,
+            'reads': self.reads,
+        }
@@ -0,0 +1,418 @@
+"""
+Durable on-disk spool for sensor rows that could not be written to PostgreSQL.
+
+The batch writer appends a batch here instead of dropping it when PostgreSQL
+is unreachable, and keeps appending while a backlog exists so rows reach the
+table in arrival order. A replayer thread bulk-loads the spool once the
+database is healthy again.
+
+Layout: spool-<seq>.log segments, rotated at SPOOL_SEGMENT_BYTES, in this
+process's slot of SPOOL_DIR. Every WSGI worker process builds its own writer
+(POSTed samples are stored by the worker that receives them), so each one
+claims a slot with an flock on SPOOL_DIR/slot-<n>.lock: slot 0 is SPOOL_DIR
+itself, slot n is SPOOL_DIR/worker-<n>. Segment numbers, backlog and replay
+are per slot, so no process replays or deletes a segment another one is
+still writing. The kernel drops the lock when a process dies, and the next
+process to start takes over the free slot and replays what it left.
+Each segment starts with a header line naming the insert columns, followed by
+one line per row: "<crc32 hex> <json row>". A torn or corrupt line (e.g. after
+a power cut) ends the segment. Appends are fsynced at most every
+SPOOL_FSYNC_INTERVAL seconds; replay progress is checkpointed in
+<segment>.offset so a restart does not re-insert committed batches (and the
+ON CONFLICT DO NOTHING insert skips rows that are already stored).
+When the spool exceeds SPOOL_MAX_BYTES the oldest segments are discarded.
+Rows PostgreSQL rejects during replay are isolated by retrying their batch
+row by row; only those rows are set aside in a uniquely named
+<segment>.<time ns>.failed file (same format as a segment).
+"""
+
+import os
+import json
+import time
+import zlib
+import threading
+import logging
+
+import psycopg2
+import psycopg2.extras
+
+from api.leader import FileLeaderLock
+
+# Set SPOOL_ENABLED=false to drop rows (old behaviour) instead of spooling them while PostgreSQL is down
+SPOOL_ENABLED = os.getenv('SPOOL_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+SPOOL_DIR = os.getenv('SPOOL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'spool'))
+SPOOL_SEGMENT_BYTES = int(os.getenv('SPOOL_SEGMENT_BYTES', str(8 * 1024 * 1024)))
+SPOOL_MAX_BYTES = int(os.getenv('SPOOL_MAX_BYTES', str(512 * 1024 * 1024)))
+SPOOL_FSYNC_INTERVAL = float(os.getenv('SPOOL_FSYNC_INTERVAL', '1.0'))  # seconds
+SPOOL_REPLAY_INTERVAL = float(os.getenv('SPOOL_REPLAY_INTERVAL', '5.0'))  # seconds between replay attempts
+SPOOL_REPLAY_BATCH = int(os.getenv('SPOOL_REPLAY_BATCH', '1000'))  # rows per replay INSERT
+
+spool_logger = logging.getLogger("spool")
+
+
+def _segment_seq(filename):
+    return int(filename[len('spool-'):-len('.log')])
+
+
+def insert_row_by_row(cursor, sql, template, rows):
+    """Insert `rows` one at a time in the current transaction, each under a savepoint.
+
+    Returns (rows inserted, [(row, error)] for the rows PostgreSQL rejected). Connection errors are raised.
+    """
+    inserted, rejected = 0, []
+    for row in rows:
+        cursor.execute("SAVEPOINT insert_row")
+        try:
+            psycopg2.extras.execute_values(cursor, sql, [row], template=template)
+            inserted += cursor.rowcount
+            cursor.execute("RELEASE SAVEPOINT insert_row")
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            raise
+        except psycopg2.Error as e:
+            cursor.execute("ROLLBACK TO SAVEPOINT insert_row")
+            rejected.append((row, e))
+    return inserted, rejected
+
+
+def claim_spool_slot(base=SPOOL_DIR):
+    """(slot, directory, lock) of the first slot of `base` that no other live process holds."""
+    os.makedirs(base, exist_ok=True)
+    slot = 0
+    while True:
+        lock = FileLeaderLock(os.path.join(base, f"slot-{slot}.lock"))
+        if lock.try_acquire():
+            return slot, (base if slot == 0 else os.path.join(base, f"worker-{slot}")), lock
+        slot += 1
+
+
+class Spool:
+    """Append-only segmented row log with batched fsync and size cap.
+
+    Without `directory` the spool claims a free slot of `base` (see claim_spool_slot) and holds it until close().
+    """
+
+    def __init__(self, directory=None, segment_bytes=SPOOL_SEGMENT_BYTES, max_bytes=SPOOL_MAX_BYTES,
+                 fsync_interval=SPOOL_FSYNC_INTERVAL, base=SPOOL_DIR):
+        self.slot, self._slot_lock = None, None
+        if directory is None:
+            self.slot, directory, self._slot_lock = claim_spool_slot(base)
+        self.directory = os.path.abspath(directory)
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync_interval = fsync_interval
+        self._lock = threading.RLock()
+        self._active = None  # (seq, file, columns)
+        self._last_fsync = time.monotonic()
+        self._dirty = False
+        self._segments = {}  # seq -> {'bytes': int, 'rows': int}
+        self.spooled_rows = 0
+        self.replayed_rows = 0
+        self.dropped_rows = 0
+        self.quarantined_rows = 0
+        self.fsyncs = 0
+        os.makedirs(self.directory, exist_ok=True)
+        for filename in os.listdir(self.directory):
+            if filename.startswith('spool-') and filename.endswith('.log'):
+                path = self._path(_segment_seq(filename))
+                self._segments[_segment_seq(filename)] = {
+                    'bytes': os.path.getsize(path),
+                    'rows': max(0, self._count_lines(path) - 1),
+                }
+        if self._segments:
+            spool_logger.warning(f"⚠️ Found {self.backlog_rows()} spooled rows in {len(self._segments)} segment(s) at {self.directory}.")
+
+    def _path(self, seq):
+        return os.path.join(self.directory, f"spool-{seq:012d}.log")
+
+    @staticmethod
+    def _count_lines(path):
+        with open(path, 'rb') as f:
+            return sum(1 for _ in f)
+
+    def has_backlog(self):
+        with self._lock:
+            return bool(self._segments)
+
+    def backlog_rows(self):
+        with self._lock:
+            return sum(seg['rows'] for seg in self._segments.values())
+
+    def append(self, rows, columns):
+        """Append rows (tuples matching `columns`) durably enough to survive a DB outage."""
+        if not rows:
+            return
+        with self._lock:
+            active = self._active
+            if active is None or active[2] != tuple(columns) or self._segments[active[0]]['bytes'] >= self.segment_bytes:
+                self._open_segment(columns)
+            seq, f, _ = self._active
+            data = ''.join(self._encode(row) for row in rows).encode('utf-8')
+            f.write(data)
+            self._segments[seq]['bytes'] += len(data)
+            self._segments[seq]['rows'] += len(rows)
+            self.spooled_rows += len(rows)
+            self._dirty = True
+            if time.monotonic() - self._last_fsync >= self.fsync_interval:
+                self.sync()
+            self._enforce_cap()
+
+    @staticmethod
+    def _encode(row):
+        payload = json.dumps(list(row), default=str)
+        return f"{zlib.crc32(payload.encode('utf-8')):08x} {payload}\n"
+
+    def _open_segment(self, columns):
+        self._close_active()
+        seq = max(self._segments, default=0) + 1
+        f = open(self._path(seq), 'ab')
+        header = (json.dumps({'columns': list(columns)}) + '\n').encode('utf-8')
+        f.write(header)
+        self._segments[seq] = {'bytes': len(header), 'rows': 0}
+        self._active = (seq, f, tuple(columns))
+
+    def _close_active(self):
+        if self._active:
+            self.sync()
+            self._active[1].close()
+            self._active = None
+
+    def sync(self):
+        """Flush and fsync the active segment if it has unsynced appends."""
+        with self._lock:
+            if self._active and self._dirty:
+                f = self._active[1]
+                f.flush()
+                os.fsync(f.fileno())
+                self.fsyncs += 1
+                self._dirty = False
+            self._last_fsync = time.monotonic()
+
+    def _enforce_cap(self):
+        while sum(seg['bytes'] for seg in self._segments.values()) > self.max_bytes and len(self._segments) > 1:
+            seq = min(self._segments)
+            if self._active and self._active[0] == seq:
+                break
+            dropped = self._segments[seq]['rows']
+            self._remove_segment(seq)
+            self.dropped_rows += dropped
+            spool_logger.error(f"❌ Spool over {self.max_bytes} bytes; discarded oldest segment with {dropped} rows.")
+
+    def _remove_segment(self, seq):
+        self._segments.pop(seq, None)
+        for path in (self._path(seq), self._path(seq) + '.offset'):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        """Close the active segment and give up the slot; the rows stay for the next process in it."""
+        with self._lock:
+            self._close_active()
+            if self._slot_lock is not None:
+                self._slot_lock.release()
+                self._slot_lock = None
+
+    def seal(self):
+        """Close the active segment so every segment can be replayed. Returns the sequence numbers in order."""
+        with self._lock:
+            self._close_active()
+            return sorted(self._segments)
+
+    def read_segment(self, seq):
+        """Yield (columns, offset_after_row, row) for the rows of a sealed segment past its checkpoint."""
+        path = self._path(seq)
+        try:
+            with open(path + '.offset', 'r') as f:
+                start = int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            start = 0
+        with open(path, 'rb') as f:
+            header = f.readline()
+            try:
+                columns = tuple(json.loads(header)['columns'])
+            except (ValueError, KeyError):
+                spool_logger.error(f"❌ Spool segment {path} has no valid header; skipping it.")
+                return
+            if start > f.tell():
+                f.seek(start)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # Torn final write
+                crc, _, payload = line.rstrip(b'\n').partition(b' ')
+                try:
+                    if int(crc, 16) != zlib.crc32(payload):
+                        raise ValueError("checksum mismatch")
+                    row = json.loads(payload)
+                except ValueError as e:
+                    spool_logger.error(f"❌ Corrupt record in spool segment {path} ({e}); ignoring the rest of the segment.")
+                    break
+                yield columns, f.tell(), tuple(row)
+
+    def checkpoint(self, seq, offset, rows, replayed=None):
+        """Record that rows up to `offset` of segment `seq` are committed (`replayed` of the `rows` inserted)."""
+        path = self._path(seq) + '.offset'
+        with open(path + '.tmp', 'w') as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+        with self._lock:
+            if seq in self._segments:
+                self._segments[seq]['rows'] = max(0, self._segments[seq]['rows'] - rows)
+            self.replayed_rows += rows if replayed is None else replayed
+
+    def quarantine(self, seq, columns, rows):
+        """Write rows PostgreSQL rejected to a new .failed file beside segment `seq`. Returns its path."""
+        # Segment numbers restart at 1 once the spool is empty, so the name also carries the time
+        path = f"{self._path(seq)}.{time.time_ns()}.failed"
+        with open(path, 'wb') as f:
+            f.write((json.dumps({'columns': list(columns)}) + '\n').encode('utf-8'))
+            f.write(''.join(self._encode(row) for row in rows).encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+        with self._lock:
+            self.quarantined_rows += len(rows)
+        return path
+
+    def finish_segment(self, seq):
+        """Remove a fully replayed segment."""
+        with self._lock:
+            if not (self._active and self._active[0] == seq):
+                self._remove_segment(seq)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'directory': self.directory,
+                'slot': self.slot,
+                'backlog_rows': sum(seg['rows'] for seg in self._segments.values()),
+                'backlog_bytes': sum(seg['bytes'] for seg in self._segments.values()),
+                'backlog_segments': len(self._segments),
+                'max_bytes': self.max_bytes,
+                'spooled_rows': self.spooled_rows,
+                'replayed_rows': self.replayed_rows,
+                'dropped_rows': self.dropped_rows,
+                'quarantined_rows': self.quarantined_rows,
+                'fsyncs': self.fsyncs,
+            }
+
+
+class SpoolReplayer:
+    """Background thread that bulk-loads spooled rows into `table` in order once PostgreSQL is reachable."""
+
+    def __init__(self, spool, connection_factory, table, interval=SPOOL_REPLAY_INTERVAL, batch_size=SPOOL_REPLAY_BATCH,
+                 template_for=None, prepare=None):
+        self.spool = spool
+        self.connection_factory = connection_factory
+        self.table = table
+        self.interval = interval
+        self.batch_size = max(1, batch_size)
+        self.template_for = template_for or (lambda columns: None)
+        self.prepare = prepare  # prepare(conn, cursor), e.g. the writer's schema migration
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_error = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="SpoolReplayerThread", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self.spool.sync()
+
+    def _run(self):
+        last_attempt = 0.0
+        # Wake up often enough to honour the fsync interval for appends that arrive in a quiet period
+        while not self._stop.wait(min(self.interval, self.spool.fsync_interval)):
+            self.spool.sync()
+            if self.spool.has_backlog() and time.monotonic() - last_attempt >= self.interval:
+                last_attempt = time.monotonic()
+                self.replay()
+
+    def replay(self):
+        """Replay every sealed segment in order. Returns True when the spool is empty."""
+        for seq in self.spool.seal():
+            if self._stop.is_set() or not self._replay_segment(seq):
+                return False
+            self.spool.finish_segment(seq)
+        # Appends that raced with the replay started a new segment; the next round picks them up
+        return not self.spool.has_backlog()
+
+    def _replay_segment(self, seq):
+        conn = self.connection_factory()
+        if not conn:
+            return False
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            if self.prepare:
+                self.prepare(conn, cursor)
+            batch, columns, offset = [], None, 0
+            for row_columns, row_offset, row in self.spool.read_segment(seq):
+                if batch and row_columns != columns:
+                    self._insert(conn, cursor, seq, columns, batch, offset)
+                    batch = []
+                columns, offset = row_columns, row_offset
+                batch.append(row)
+                if len(batch) >= self.batch_size:
+                    self._insert(conn, cursor, seq, columns, batch, offset)
+                    batch = []
+            if batch:
+                self._insert(conn, cursor, seq, columns, batch, offset)
+            self.last_error = None
+            return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            conn.rollback()
+            self.last_error = str(e)
+            spool_logger.warning(f"⚠️ Spool replay paused, PostgreSQL unavailable: {e}")
+            return False
+        except psycopg2.Error as e:
+            # Not caused by a row (those are set aside in _insert), e.g. the schema hook failed: retry later
+            conn.rollback()
+            self.last_error = str(e)
+            spool_logger.error(f"❌ Spool replay paused by a PostgreSQL error: {e}")
+            return False
+        except Exception as e:
+            conn.rollback()
+            self.last_error = str(e)
+            spool_logger.error(f"❌ Unexpected error during spool replay: {e}", exc_info=True)
+            return False
+        finally:
+            if cursor:
+                cursor.close()
+            conn.close()
+
+    def _insert(self, conn, cursor, seq, columns, batch, offset):
+        sql = f"INSERT INTO {self.table} ({', '.join(columns)}) VALUES %s ON CONFLICT DO NOTHING"
+        template = self.template_for(columns)
+        rejected = []
+        try:
+            psycopg2.extras.execute_values(cursor, sql, batch, template=template, page_size=len(batch))
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            raise
+        except psycopg2.Error as e:
+            # One bad row fails the whole statement; find it instead of holding up (or losing) the others
+            conn.rollback()
+            spool_logger.warning(f"⚠️ Spooled batch rejected by PostgreSQL ({e}); retrying it row by row.")
+            _, failures = insert_row_by_row(cursor, sql, template, batch)
+            for _, error in failures:
+                spool_logger.error(f"❌ Spooled row rejected by PostgreSQL: {error}")
+            rejected = [row for row, _ in failures]
+        conn.commit()
+        if rejected:
+            path = self.spool.quarantine(seq, columns, rejected)
+            spool_logger.error(f"❌ {len(rejected)} spooled rows rejected by PostgreSQL, set aside in {path}.")
+        self.spool.checkpoint(seq, offset, len(batch), replayed=len(batch) - len(rejected))
+        spool_logger.info(f"✅ Replayed {len(batch) - len(rejected)} spooled rows into {self.table}.")
+
+    def stats(self):
+        stats = self.spool.stats()
+        stats['last_error'] = self.last_error
+        return stats
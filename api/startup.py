@@ -0,0 +1,58 @@
+"""
+Boot helpers: one-time .env loading and startup timing.
+
+app.py, api/live_data.py and api/hist_data.py each call load_env() so they
+also work when imported on their own; only the first call reads .env.
+
+mark(stage) records how long each boot stage took since the previous mark
+(the first mark counts from the import of this module, which app.py does
+first). `python app.py --profile-startup` prints startup_report() once the
+app is ready to serve.
+"""
+
+import os
+import time
+
+ENV_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '.env'))
+
+_started = time.perf_counter()
+_last = _started
+_marks = []  # (stage, seconds spent in the stage)
+_env_loaded = False
+
+
+def load_env(caller):
+    """Load .env (overriding the environment) unless it was already loaded in this process."""
+    global _env_loaded
+    if _env_loaded:
+        return
+    _env_loaded = True
+    try:
+        from dotenv import load_dotenv
+    except ImportError:
+        print(f"⚠️ {caller}: python-dotenv not available, using system environment variables only")
+        return
+    if os.path.exists(ENV_PATH):
+        load_dotenv(dotenv_path=ENV_PATH, override=True)
+        print(f"✅ {caller}: Environment variables loaded from {ENV_PATH}")
+    else:
+        print(f"⚠️ {caller}: .env file not found at {ENV_PATH}. Using system environment variables only.")
+
+
+def mark(stage):
+    """Record the time spent since the previous mark as `stage`."""
+    global _last
+    now = time.perf_counter()
+    _marks.append((stage, now - _last))
+    _last = now
+
+
+def startup_report():
+    """Table of the recorded boot stages, slowest first."""
+    total = _last - _started
+    lines = [f"⏱️  Startup profile: {total * 1000:.0f} ms until ready"]
+    for stage, seconds in sorted(_marks, key=lambda m: m[1], reverse=True):
+        share = seconds / total * 100 if total else 0.0
+        lines.append(f"   {seconds * 1000:8.1f} ms  {share:5.1f}%  {stage}")
+    lines.append("   Per-module import times: python -X importtime app.py --profile-startup")
+    return "\n".join(lines)
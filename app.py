@@ -1,48 +1,55 @@
 import os
 import sys
 import threading
+from api.startup import load_env, mark, startup_report # First, so the startup profile covers every import below
 # import subprocess # No longer used
-from flask import Flask, render_template, redirect, url_for, send_from_directory, request, jsonify, flash
+from flask import Flask, render_template, redirect, url_for, send_from_directory, request, jsonify, flash, Response
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.executors.pool import ThreadPoolExecutor # , ProcessPoolExecutor # ProcessPoolExecutor not used
+# APScheduler and paho-mqtt are imported where they are first used (start_scheduler, run_minimal_mqtt_thread)
+mark("import Flask")
 
 # --- Additional imports for minimal MQTT client ---
-import paho.mqtt.client as mqtt
-import json
 import time # For unique client_id and potentially other timing
-import requests
+import random # Jitter for MQTT reconnect backoff
 # logging, os, datetime, timezone should already be available or imported
 # Ensure timezone is available if datetime.now(timezone.utc) is used.
 from datetime import timezone
 # --- End additional imports ---
 
 # --- Environment Variable Loading ---
-project_root = os.path.abspath(os.path.dirname(__file__))
-dotenv_path = os.path.join(project_root, '.env')
-try:
-    from dotenv import load_dotenv
-    if os.path.exists(dotenv_path):
-        load_dotenv(dotenv_path=dotenv_path, override=True)
-        print(f"✅ app.py: Environment variables loaded from {dotenv_path}")
-    else:
-        print(f"⚠️ app.py: .env file not found at {dotenv_path}. Using system environment variables only.")
-except ImportError:
-    print("⚠️ app.py: python-dotenv not available, using system environment variables only")
+# Loaded once per process; api/live_data.py and api/hist_data.py reuse it
+load_env("app.py")
+mark("load .env")
 # --- End Environment Variable Loading ---
 
 sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
-from api.config_loader import REGISTER_CONFIG # Import the loaded config
+from api.config_loader import REGISTER_CONFIG, CONFIG_REGISTRY # Import the loaded config (hot-reloaded by CONFIG_REGISTRY)
+mark(f"load register_config.yaml (from {CONFIG_REGISTRY.source})")
+from api.extensions import db
+mark("import Flask-SQLAlchemy")
 # from api.live_data import store_data_to_db, add_dynamic_columns # No longer needed here
-from api.live_data import live_data_api # Only live_data_api is needed for blueprint registration
+from api.live_data import live_data_api, ingest_live_data, batch_writer, ingest_spool, latest_cache, live_stream
+from api.batch_writer import MQTT_MAX_INFLIGHT
+from api.ingestion import IngestionQueue, TopicRouter
+from api.coalescer import SampleCoalescer
+from api.device_state import device_state_writer
+from api.binary_payload import decode_mqtt_payload
+from api.decode_pool import DecodePool, build_live_payload, DECODE_WORKERS
+from api.modbus_poller import ModbusScheduler, build_units, MODBUS_ENABLED
+from api.leader import IngestionLeader
+from api.shared_state import SharedLiveState
 from api.hist_data import historical_data_api
-from api.extensions import db
+from api.db_pool import POSTGRES_TABLE, get_connection
+from api.rollups import refresh_rollups, rollup_table, ROLLUP_INTERVAL_SECONDS
+from api.partitions import (maintain_partitions, is_partitioned, remove_expired_partitions, DEFAULT_PARTITION,
+                            DATA_RETENTION_DAYS, PARTITION_RETENTION_MODE)
 from datetime import datetime, timedelta # UTC removed, set_timezone will be used
 from api.timezone_config import set_timezone # ADDED: Import set_timezone
 import logging # Add logging import
 import yaml # Add this import
-import psycopg2 # Added for psycopg2 usage
+import json
+mark("import api modules")
 
 # Import the MQTT Subscriber class
 # from api.mqtt_subscriber import VFlowMQTTSubscriber # REMOVE THIS LINE
@@ -72,18 +79,33 @@ app.register_blueprint(live_data_api, url_prefix='/api')
 app.register_blueprint(historical_data_api, url_prefix='/api')
 
 # --- Add API endpoint for register definitions ---
-@app.route('/api/registers/definitions')
-@login_required # Or remove if definitions should be public
-def get_register_definitions():
+def build_register_definitions(config):
+    """(JSON body, ETag) of the definitions endpoint, rebuilt when register_config.yaml is reloaded."""
     # Return the processed configuration relevant for the frontend
     # Filter or structure as needed, here returning groups and raw list
     definitions = {
-        "registers": REGISTER_CONFIG.get("raw", []),
-        "groups": REGISTER_CONFIG.get("by_group", {}),
-        "views": REGISTER_CONFIG.get("by_view", {})
+        "registers": config.get("raw", []),
+        "groups": config.get("by_group", {}),
+        "views": config.get("by_view", {})
         # Add other processed parts of the config if needed by frontend
     }
-    return jsonify(definitions)
+    return json.dumps(definitions), f"registers-v{CONFIG_REGISTRY.version}"
+
+_register_definitions = build_register_definitions(CONFIG_REGISTRY.config)
+
+def _rebuild_register_definitions(config):
+    global _register_definitions
+    _register_definitions = build_register_definitions(config)
+
+CONFIG_REGISTRY.subscribe(_rebuild_register_definitions)
+
+@app.route('/api/registers/definitions')
+@login_required # Or remove if definitions should be public
+def get_register_definitions():
+    body, etag = _register_definitions
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    return response.make_conditional(request)
 # --- Endpoint added ---
 
 
@@ -95,6 +117,8 @@ class User (UserMixin, db.Model): # User model remains for authentication
 
 @login_manager.user_loader
 def load_user (user_id):
+    # Runs for @login_required views with a session; public routes never touch the User table
+    _ensure_database()
     return db.session.get(User, int(user_id)) # Keep for user authentication
 
 
@@ -104,46 +128,45 @@ def load_user (user_id):
 # --- Modify collect_sensor_data ---
 # The collect_sensor_data function is removed. Data collection is handled by mqtt_subscriber.py
 
-# ... (Scheduler setup remains the same)
-executors = {
-    'default': ThreadPoolExecutor(1) # Only allow 1 thread at a time
-}
-
 def delete_old_data():
-    """Deletes sensor data older than 30 days from the database."""
+    """Deletes sensor data older than DATA_RETENTION_DAYS from the database."""
     # This function now needs to use raw SQL or a different mechanism if SensorData model is removed,
     # or it should be part of the mqtt_subscriber service if that's more appropriate.
     # For now, let's assume direct psycopg2 usage for this task if it must remain in app.py
     try:
-        cutoff_date = datetime.now(set_timezone) - timedelta(days=30)
+        cutoff_date = datetime.now(set_timezone) - timedelta(days=DATA_RETENTION_DAYS)
         
-        # Use psycopg2 to connect and delete old data from the 'sensor_data' table
+        # Use a pooled psycopg2 connection to delete old data from the sensor table
         # This avoids reliance on a Flask-SQLAlchemy model for this table
-        pg_config = {
-            'host': os.getenv('POSTGRES_HOST', 'localhost'),
-            'port': int(os.getenv('POSTGRES_PORT', '5432')),
-            'database': os.getenv('POSTGRES_DATABASE', 'sensor_data'), # Default to sensor_data
-            'user': os.getenv('POSTGRES_USER', 'sensor_user'),         # Default to sensor_user
-            'password': os.getenv('POSTGRES_PASSWORD', 'Master123')   # Default to Master123
-        }
         conn = None
         deleted_count = 0
+        removed_partitions = []
         try:
-            conn = psycopg2.connect(**pg_config)
-            conn.autocommit = True # Use autocommit for delete operations
-            cur = conn.cursor()
-            cur.execute(f"DELETE FROM {os.getenv('POSTGRES_TABLE', 'sensor_data')} WHERE timestamp < %s", (cutoff_date,))
-            deleted_count = cur.rowcount
-            cur.close()
+            conn = get_connection()
+            if conn:
+                conn.autocommit = True # Use autocommit for delete operations (reset when returned to the pool)
+                cur = conn.cursor()
+                if is_partitioned(cur):
+                    # Whole days go away with DROP/DETACH PARTITION; only stray rows in the default partition are deleted
+                    removed_partitions = remove_expired_partitions(cur, cutoff_date)
+                    cur.execute(f"DELETE FROM {DEFAULT_PARTITION} WHERE timestamp < %s", (cutoff_date,))
+                else:
+                    cur.execute(f"DELETE FROM {POSTGRES_TABLE} WHERE timestamp < %s", (cutoff_date,))
+                deleted_count = cur.rowcount
+                # Fine-grained rollups follow the raw retention; 15m/1h rollups are kept
+                cur.execute(f"DELETE FROM {rollup_table('1m')} WHERE bucket < %s", (cutoff_date,))
+                cur.close()
         except Exception as e:
             logging.error(f"Error during raw SQL delete_old_data: {e}", exc_info=True)
         finally:
             if conn:
                 conn.close()
 
+        if removed_partitions:
+            logging.info(f"Removed partitions older than {cutoff_date} ({PARTITION_RETENTION_MODE}): {', '.join(removed_partitions)}")
         if deleted_count > 0:
             logging.info(f"Deleted {deleted_count} records older than {cutoff_date} using direct SQL.")
-        else:
+        elif not removed_partitions:
             logging.info("No old records found to delete using direct SQL.")
             
     except Exception as e:
@@ -151,17 +174,60 @@ def delete_old_data():
 
 
 def start_scheduler():
+    from apscheduler.schedulers.background import BackgroundScheduler
+    from apscheduler.executors.pool import ThreadPoolExecutor # , ProcessPoolExecutor # ProcessPoolExecutor not used
+    executors = {
+        'default': ThreadPoolExecutor(1) # Only allow 1 thread at a time
+    }
     scheduler = BackgroundScheduler(executors=executors)
     # Schedule data collection (e.g., every 5 seconds) - REMOVED
     # scheduler.add_job(collect_sensor_data, 'interval', seconds=5, id='collect_data_job', replace_existing=True)
     # Schedule old data deletion (e.g., daily at 3 AM)
     scheduler.add_job(delete_old_data, 'cron', hour=3, id='delete_old_data_job', replace_existing=True)
+    # Keep future daily partitions created ahead of ingestion (also once at startup)
+    scheduler.add_job(maintain_partitions, 'cron', hour=2, id='maintain_partitions_job', replace_existing=True,
+                      next_run_time=datetime.now(set_timezone))
+    # Keep the 1m/15m/1h rollup tables up to date incrementally
+    scheduler.add_job(refresh_rollups, 'interval', seconds=ROLLUP_INTERVAL_SECONDS, id='refresh_rollups_job',
+                      replace_existing=True, max_instances=1, coalesce=True, next_run_time=datetime.now(set_timezone))
     scheduler.start()
-    logging.info("Background scheduler started (delete_old_data job only).")
-
+    logging.info("Background scheduler started (delete_old_data, maintain_partitions and refresh_rollups jobs).")
+
+
+# --- Create database tables (off the import path) ---
+# Run by start_worker() once ingestion is up, else by the first login or authenticated request
+# Backoff (seconds) between bootstrap attempts while the database is unreachable
+USER_DB_RETRY_MIN_DELAY = float(os.getenv('USER_DB_RETRY_MIN_DELAY', '1'))
+USER_DB_RETRY_MAX_DELAY = float(os.getenv('USER_DB_RETRY_MAX_DELAY', '60'))
+_database_ready = False
+_database_lock = threading.Lock()
+_database_retry_at = 0.0  # time.monotonic() before which a failed bootstrap is not retried
+_database_retry_delay = USER_DB_RETRY_MIN_DELAY
+
+def bootstrap_database():
+    """Create the User table and the default users if missing. Runs once per process."""
+    global _database_ready
+    with _database_lock:
+        if _database_ready:
+            return
+        with app.app_context():
+            _create_default_users()
+        _database_ready = True
+
+def _ensure_database():
+    """bootstrap_database() for the views that use the User table. Failures are logged and retried with backoff."""
+    global _database_retry_at, _database_retry_delay
+    if _database_ready or time.monotonic() < _database_retry_at:
+        return
+    try:
+        bootstrap_database()
+    except Exception as e:
+        delay = _database_retry_delay
+        _database_retry_at = time.monotonic() + delay
+        _database_retry_delay = min(USER_DB_RETRY_MAX_DELAY, delay * 2)
+        logging.error(f"❌ User database bootstrap failed (next attempt in {delay:.0f}s): {e}")
 
-# --- Create database tables AFTER dynamic columns are added ---
-with app.app_context():
+def _create_default_users():
     logging.info("Initializing database for User model...")
     # add_dynamic_columns() # Removed - SensorData model and its columns are managed by mqtt_subscriber
     db.create_all() # Creates tables for models defined in Flask-SQLAlchemy (i.e., User model)
@@ -170,7 +236,6 @@ with app.app_context():
     # Create default admin user if not exists
     if not User.query.filter_by(username='admin').first():
         # Default password is 'admin', ensure this is changed in production
-        hashed_password = generate_password_hash('admin', method='pbkdf2:sha256')
         # Create a non-admin user 'vflow' with password 'password'
         # To create an admin: User(username='admin', password=generate_password_hash('admin_password'), is_admin=True)
         # For consistency with login error logs, let's use 'vflow' as the default non-admin
@@ -198,89 +263,161 @@ with app.app_context():
         elif admin_username != default_user_username :
              logging.info(f"Admin user '{admin_username}' already exists or is same as default user.")
 
+mark("create app, models and routes")
 
 # --- Definitions for Minimal MQTT Client (adapted from mqtt_minimal.py) ---
 
 # Setup a logger for the minimal MQTT client part, consistent with app.py's logging
 mqtt_minimal_logger = logging.getLogger("mqtt_minimal_client")
 
-class MinimalFlaskAPIClient: # Renamed to avoid potential future class name collisions
-    def __init__(self):
-        # Use FLASK_RUN_PORT for consistency if the API is running on a configurable port
-        flask_port = os.getenv('FLASK_RUN_PORT', 5001)
-        self.endpoint = f"http://localhost:{flask_port}/api/live-data"
-        self.timeout = 5.0
-        self.success_count = 0
-        self.fail_count = 0
-    
-    def send_data(self, data):
-        try:
-            payload = {
-                'timestamp': data.get('timestamp', datetime.now(timezone.utc).isoformat()),
-                'device_id': data.get('device_id', 'unknown_device'),
-                'data': data # This is the original data from MQTT
-            }
-            # Use the specific logger
-            mqtt_minimal_logger.info(f"Attempting to send to Flask API. Endpoint: {self.endpoint}, Payload: {json.dumps(payload)}")
-
-            response = requests.post(
-                self.endpoint,
-                json=payload,
-                timeout=self.timeout,
-                headers={'Content-Type': 'application/json'}
-            )
-            
-            if response.status_code == 200:
-                self.success_count += 1
-                mqtt_minimal_logger.info(f"✅ Flask API success #{self.success_count}")
-                return True
-            else:
-                self.fail_count += 1
-                mqtt_minimal_logger.error(f"❌ Flask API failed #{self.fail_count} to {self.endpoint}: {response.status_code} - {response.text}")
-                return False
-                
-        except requests.exceptions.ConnectionError as e:
-            self.fail_count += 1
-            mqtt_minimal_logger.error(f"❌ Flask API connection error #{self.fail_count} for {self.endpoint}: {e}")
-            return False
-        except Exception as e:
-            self.fail_count += 1
-            mqtt_minimal_logger.error(f"❌ Flask API generic error #{self.fail_count} for {self.endpoint}: {e}")
-            return False
+# QoS 1 with a persistent session: the broker queues messages while we are offline and
+# redelivers anything we have not acknowledged. A stable client id is what identifies the session.
+MQTT_CLIENT_ID = os.getenv('MQTT_CLIENT_ID', 'vflow_flask_app')
+MQTT_BASE_TOPIC = os.getenv('MQTT_BASE_TOPIC', 'vflow')
+MQTT_QOS_LEVEL = int(os.getenv('MQTT_QOS_LEVEL', '1'))
+MQTT_CLEAN_SESSION = os.getenv('MQTT_CLEAN_SESSION', 'false').lower() == 'true'
+# Reconnect backoff: doubles from MIN to MAX seconds, with full jitter, and never gives up
+MQTT_RECONNECT_MIN_DELAY = float(os.getenv('MQTT_RECONNECT_MIN_DELAY', '1'))
+MQTT_RECONNECT_MAX_DELAY = float(os.getenv('MQTT_RECONNECT_MAX_DELAY', '60'))
+# Scale-out: MQTT_SUBSCRIBER_WORKERS clients join the shared subscription $share/<MQTT_SHARED_GROUP>/<base>/data/bulk
+# and the broker load-balances bulk messages across them (and across other hosts in the same group)
+MQTT_SUBSCRIBER_WORKERS = max(1, int(os.getenv('MQTT_SUBSCRIBER_WORKERS', '1')))
+MQTT_DEFAULT_SHARED_GROUP = 'vflow_ingest'
+MQTT_SHARED_GROUP = os.getenv('MQTT_SHARED_GROUP') or (MQTT_DEFAULT_SHARED_GROUP if MQTT_SUBSCRIBER_WORKERS > 1 else '')
+
+def handle_bulk_message(payload, params, ack):
+    """<base>/data/bulk: one message (JSON or binary frame) carries every register of a sample."""
+    if decode_pool:
+        # Decoded in worker processes; ingest_decoded_message receives the results in order
+        decode_pool.submit(payload, ack)
+        return
+    ingest_live_data(build_live_payload(decode_mqtt_payload(payload)), ack=ack)
+
+def ingest_decoded_message(payload, row, ack):
+    ingest_live_data(payload, ack=ack, row=row)
+
+def handle_sensor_message(payload, params, ack):
+    """<base>/sensors/<register>: a bare value, or {"value", "device_id", "timestamp"}."""
+    message = decode_mqtt_payload(payload)
+    if isinstance(message, dict):
+        sensor_coalescer.add(message.get('device_id', 'unknown_device'), params[0], message.get('value'),
+                             message.get('timestamp'), ack)
+    else:
+        sensor_coalescer.add('unknown_device', params[0], message, None, ack)
+
+def handle_status_message(payload, params, ack):
+    """<base>/status: updates the device state table, no sensor row is written."""
+    status = decode_mqtt_payload(payload)
+    if not isinstance(status, dict):
+        status = {'status': status}
+    # Upserted on the device state writer's thread; acknowledged once stored
+    device_state_writer.add(status, ack)
+
+def _last_known_data(device_id):
+    """Register values of the device's latest cached sample (without the bulk message's own metadata)."""
+    cached = latest_cache.get(device_id, max_age=float('inf'))
+    data = cached.get('data') if cached else None
+    if not isinstance(data, dict):
+        return None
+    return {key: value for key, value in data.items() if key not in ('timestamp', 'device_id')}
 
 # Global variables for the minimal MQTT client context
-minimal_flask_client = MinimalFlaskAPIClient()
+# Per-sensor updates are merged into full, time-aligned rows before they reach the batch writer
+sensor_coalescer = SampleCoalescer(lambda payload, ack: ingest_live_data(payload, ack=ack), seed=_last_known_data)
+topic_router = TopicRouter({
+    f"{MQTT_BASE_TOPIC}/data/bulk": handle_bulk_message,
+    f"{MQTT_BASE_TOPIC}/sensors/+": handle_sensor_message,
+    f"{MQTT_BASE_TOPIC}/status": handle_status_message,
+})
+# MQTT messages are handed straight to the in-process ingestion worker instead of being POSTed back to our own API
+# (one worker per subscriber, so each connection's messages are processed in delivery order)
+ingestion_queue = IngestionQueue(topic_router.dispatch, partitions=MQTT_SUBSCRIBER_WORKERS)
+# Optional process pool for decoding bulk messages and building their rows off the GIL (DECODE_WORKERS)
+decode_pool = None
+if DECODE_WORKERS > 0:
+    decode_pool = DecodePool(ingest_decoded_message)
+    CONFIG_REGISTRY.subscribe(decode_pool.restart)
 minimal_message_count = 0
+mqtt_worker_message_counts = [0] * MQTT_SUBSCRIBER_WORKERS
+
+# Optional built-in Modbus TCP polling of the units in register_config.yaml (modbus: section);
+# samples take the same ingest path. Units and block plans follow config reloads.
+modbus_scheduler = None
+if MODBUS_ENABLED:
+    modbus_scheduler = ModbusScheduler(ingest_live_data, build_units())
+    CONFIG_REGISTRY.subscribe(lambda config: modbus_scheduler.set_units(build_units(config)), validate=build_units)
+# Latest values and stats go from the ingestion leader to the HTTP-only workers (api/shared_state.py)
+shared_state = SharedLiveState(latest_cache, live_stream)
+mark("build ingestion pipeline")
+
+def mqtt_subscriptions(worker):
+    """Topic filters of subscriber `worker`: the shared bulk topic on every worker, the other topics on worker 0."""
+    bulk_topic = f"{MQTT_BASE_TOPIC}/data/bulk"
+    topics = []
+    for topic in topic_router.topics:
+        if topic == bulk_topic and MQTT_SHARED_GROUP:
+            topics.append(f"$share/{MQTT_SHARED_GROUP}/{topic}")
+        elif worker == 0:
+            # Per-sensor values of a device are merged by one coalescer, so they are not load-balanced
+            topics.append(topic)
+    return topics
+
+def mqtt_stale_subscriptions(worker):
+    """Bulk filter of the other subscription mode, which a persistent session may still hold from an earlier run.
+
+    Left subscribed, worker 0 would get every bulk message through its old plain
+    subscription on top of its share of the group (or the other way round).
+    """
+    bulk_topic = f"{MQTT_BASE_TOPIC}/data/bulk"
+    if bulk_topic not in topic_router.topics:
+        return []
+    if MQTT_SHARED_GROUP:
+        return [bulk_topic]
+    return [f"$share/{MQTT_DEFAULT_SHARED_GROUP}/{bulk_topic}"]
+
+def mqtt_client_id(worker):
+    # Worker 0 keeps MQTT_CLIENT_ID, so an existing persistent session is resumed
+    return MQTT_CLIENT_ID if worker == 0 else f"{MQTT_CLIENT_ID}_{worker}"
 
 def on_connect_minimal(client, userdata, flags, rc):
-    mqtt_minimal_logger.info(f"Minimal MQTT client connected to broker (code: {rc})")
+    # userdata is the subscriber worker index
+    mqtt_minimal_logger.info(f"Minimal MQTT client {userdata} connected to broker (code: {rc})")
     if rc == 0:
-        client.subscribe("vflow/data/bulk", qos=0) # Using QoS 0 as in mqtt_minimal.py
-        mqtt_minimal_logger.info("Minimal MQTT client subscribed to vflow/data/bulk")
+        session_present = flags.get('session present') if isinstance(flags, dict) else None
+        topics = mqtt_subscriptions(userdata)
+        stale = mqtt_stale_subscriptions(userdata)
+        if stale and session_present != 0:  # A new session holds no subscriptions from earlier runs
+            client.unsubscribe(stale)
+        client.subscribe([(topic, MQTT_QOS_LEVEL) for topic in topics])
+        mqtt_minimal_logger.info(f"Minimal MQTT client {userdata} subscribed to {', '.join(topics)} (QoS {MQTT_QOS_LEVEL}, session present: {session_present})")
     else:
         mqtt_minimal_logger.error(f"Minimal MQTT client failed to connect, return code {rc}\\n")
 
+def make_mqtt_ack(client, msg):
+    """Callback that sends the PUBACK for `msg`; None for QoS 0 messages, which need no ack."""
+    if msg.qos == 0:
+        return None
+    return lambda: client.ack(msg.mid, msg.qos)
+
 def on_message_minimal(client, userdata, msg):
-    global minimal_message_count, minimal_flask_client
+    global minimal_message_count
     minimal_message_count += 1
+    mqtt_worker_message_counts[userdata] += 1
     
-    mqtt_minimal_logger.info(f"📨 Minimal MQTT: Message #{minimal_message_count} received from {msg.topic}")
+    mqtt_minimal_logger.debug(f"📨 Minimal MQTT: Message #{minimal_message_count} received from {msg.topic}")
     
+    # Manual acks: the message is acknowledged only once the batch writer has committed
+    # (or spooled) its row, so a crash before that makes the broker redeliver it.
+    ack = make_mqtt_ack(client, msg)
     try:
-        payload_str = msg.payload.decode('utf-8')
-        data = json.loads(payload_str)
-        
-        success = minimal_flask_client.send_data(data)
+        # Non-blocking handoff; decoding, topic dispatch and storage happen on the ingestion worker thread
+        if not ingestion_queue.submit((msg.topic, msg.payload), ack=ack, key=userdata):
+            mqtt_minimal_logger.warning(f"⚠️ Minimal MQTT: Message #{minimal_message_count} dropped, ingestion queue is full.")
         
-        if success:
-            mqtt_minimal_logger.info(f"✅ Minimal MQTT: Message #{minimal_message_count} processed successfully by API")
-        else:
-            mqtt_minimal_logger.warning(f"⚠️ Minimal MQTT: Message #{minimal_message_count} API send failed, but received from broker.")
-        
-    except json.JSONDecodeError as e:
-        mqtt_minimal_logger.error(f"❌ Minimal MQTT: Error decoding JSON for message #{minimal_message_count}: {e}. Payload: {msg.payload.decode('utf-8', errors='ignore')}")
     except Exception as e:
         mqtt_minimal_logger.error(f"❌ Minimal MQTT: Error processing message #{minimal_message_count}: {e}")
+        if ack:
+            ack()
 
 def on_disconnect_minimal(client, userdata, rc):
     if rc != 0:
@@ -288,14 +425,23 @@ def on_disconnect_minimal(client, userdata, rc):
     else:
         mqtt_minimal_logger.info("Minimal MQTT client disconnected gracefully.")
 
-def run_minimal_mqtt_thread():
-    """Runs the minimal MQTT subscriber logic in a thread."""
-    global minimal_flask_client, minimal_message_count # Ensure globals are accessible
-    minimal_message_count = 0 # Reset count on start
-    minimal_flask_client = MinimalFlaskAPIClient() # Re-initialize client for fresh counts
-
-    client_id = f"vflow_minimal_flask_app_{int(time.time() * 1000)}"
-    client = mqtt.Client(client_id=client_id)
+def mqtt_reconnect_delay(attempt):
+    """Exponential backoff with full jitter for reconnect attempt number `attempt` (1-based)."""
+    cap = min(MQTT_RECONNECT_MAX_DELAY, MQTT_RECONNECT_MIN_DELAY * (2 ** min(attempt - 1, 16)))
+    return random.uniform(MQTT_RECONNECT_MIN_DELAY, max(cap, MQTT_RECONNECT_MIN_DELAY))
+
+def run_minimal_mqtt_thread(worker=0):
+    """Runs the minimal MQTT subscriber logic of subscriber `worker` in a thread."""
+    import paho.mqtt.client as mqtt
+    client_id = mqtt_client_id(worker)
+
+    # reconnect_on_failure=False: loop_forever() returns on disconnect and the loop below
+    # reconnects with jittered backoff (paho's own reconnect backoff has no jitter)
+    client = mqtt.Client(client_id=client_id, clean_session=MQTT_CLEAN_SESSION, userdata=worker,
+                         reconnect_on_failure=False, manual_ack=True)
+    # Same window the batch writer flushes at (MQTT 3.1.1 cannot announce a receive window; the broker's
+    # max_inflight_messages caps what it sends us and should match MQTT_MAX_INFLIGHT)
+    client.max_inflight_messages_set(MQTT_MAX_INFLIGHT)
     client.on_connect = on_connect_minimal
     client.on_message = on_message_minimal
     client.on_disconnect = on_disconnect_minimal
@@ -305,22 +451,19 @@ def run_minimal_mqtt_thread():
 
     mqtt_minimal_logger.info(f"🚀 Starting Minimal MQTT Subscriber Thread for Flask App")
     mqtt_minimal_logger.info(f"MQTT Broker: {broker_host}:{broker_port}")
-    mqtt_minimal_logger.info(f"Target Flask API: {minimal_flask_client.endpoint}")
+    mqtt_minimal_logger.info(f"Client ID: {client_id} (QoS {MQTT_QOS_LEVEL}, clean session: {MQTT_CLEAN_SESSION})")
+    mqtt_minimal_logger.info("Target: in-process ingestion queue")
     mqtt_minimal_logger.info("="*60)
     
-    retry_delay = 5 # seconds
-    max_retries = 5 # None for infinite
-    retries = 0
+    attempt = 0
 
-    while True: # Outer loop for reconnections
+    while True: # Outer loop for reconnections; never gives up
+        connected_at = None
         try:
-            client.connect(broker_host, broker_port, 60)
             mqtt_minimal_logger.info("Minimal MQTT client attempting to connect...")
-            client.loop_forever() # This is blocking until disconnect
-            # If loop_forever() exits cleanly (e.g. client.disconnect() called elsewhere), break outer loop.
-            # However, on_disconnect will be called for unexpected disconnects, loop_forever might raise exception.
-            mqtt_minimal_logger.info("Minimal MQTT client loop_forever exited.")
-            break # Exit while true if loop_forever finishes without error.
+            client.connect(broker_host, broker_port, 60)
+            connected_at = time.monotonic()
+            client.loop_forever() # Blocks until the connection is lost
         except ConnectionRefusedError:
             mqtt_minimal_logger.error(f"Minimal MQTT: Connection refused by broker {broker_host}:{broker_port}.")
         except TimeoutError:
@@ -330,26 +473,45 @@ def run_minimal_mqtt_thread():
         except Exception as e:
             mqtt_minimal_logger.error(f"Minimal MQTT: Unexpected error in connection/loop: {e}", exc_info=True)
         
-        # If loop_forever was interrupted by an error or disconnect, on_disconnect handles logging.
-        # We are now outside loop_forever, so we need to attempt to reconnect.
-        
-        if max_retries is not None and retries >= max_retries:
-            mqtt_minimal_logger.error(f"Minimal MQTT: Max retries ({max_retries}) reached. Stopping attempts.")
-            break
+        # A connection that stayed up for a while resets the backoff
+        if connected_at is not None and time.monotonic() - connected_at > MQTT_RECONNECT_MAX_DELAY:
+            attempt = 0
+        attempt += 1
+        delay = mqtt_reconnect_delay(attempt)
+        mqtt_minimal_logger.info(f"Minimal MQTT: Disconnected. Retrying connection in {delay:.1f}s (attempt {attempt})...")
+        time.sleep(delay)
 
-        retries += 1
-        mqtt_minimal_logger.info(f"Minimal MQTT: Disconnected. Retrying connection in {retry_delay}s (attempt {retries})...")
-        time.sleep(retry_delay)
-        # Increase delay for next retry? (Exponential backoff could be added here)
-        # retry_delay = min(retry_delay * 2, 60) # Example exponential backoff up to 60s
 
-    mqtt_minimal_logger.info("Minimal MQTT subscriber thread finished.")
-    # Final stats can be logged here if desired, similar to standalone mqtt_minimal.py
-    mqtt_minimal_logger.info(f"📊 Minimal MQTT Final Stats: Messages: {minimal_message_count}, Flask API: {minimal_flask_client.success_count}✅/{minimal_flask_client.fail_count}❌")
+# --- End Definitions for Minimal MQTT Client ---
 
 
-# --- End Definitions for Minimal MQTT Client ---
+def ingestion_stats_snapshot():
+    return {
+        'queue': ingestion_queue.stats(),
+        'mqtt': {
+            'shared_group': MQTT_SHARED_GROUP or None,
+            'subscriptions': {mqtt_client_id(worker): mqtt_subscriptions(worker) for worker in range(MQTT_SUBSCRIBER_WORKERS)},
+            'messages_per_worker': list(mqtt_worker_message_counts),
+        },
+        'decode': decode_pool.stats() if decode_pool else None,
+        'router': topic_router.stats(),
+        'coalescer': sensor_coalescer.stats(),
+        'device_state': device_state_writer.stats(),
+        'modbus': modbus_scheduler.stats() if modbus_scheduler else None,
+    }
 
+@app.route('/api/ingestion-stats')
+def ingestion_stats():
+    """Ingestion queue depth, per-topic dispatch counts and per-sensor coalescing"""
+    if ingestion_leader.is_leader:
+        stats = ingestion_stats_snapshot()
+    else:
+        # Ingestion runs in the leader process: report the stats it last published
+        stats = dict(shared_state.leader_stats or {})
+    stats['register_config'] = CONFIG_REGISTRY.stats()
+    stats['leader'] = ingestion_leader.stats()
+    stats['shared_state'] = shared_state.stats()
+    return jsonify(stats)
 
 @app.route('/favicon.ico')
 def favicon():
@@ -393,9 +555,17 @@ def set_modbus_config():
     data = request.json
     ip = data.get('ip')
     port = data.get('port')
+    units = data.get('units')  # Optional list of polled units, see api/modbus_poller.py
 
-    if not ip or not port:
+    if units is None and (not ip or not port):
         return jsonify({"error": "Missing IP or Port"}), 400
+    if units is not None:
+        try:
+            if not isinstance(units, list):
+                raise ValueError("'units' must be a list")
+            build_units(dict(REGISTER_CONFIG, modbus_units=units))  # Validate before writing the file
+        except (ValueError, TypeError) as e:
+            return jsonify({"error": f"Invalid Modbus units: {e}"}), 400
 
     config_path = os.path.join(app.root_path, 'register_config.yaml')
 
@@ -406,16 +576,26 @@ def set_modbus_config():
         if 'modbus' not in config_data or not isinstance(config_data['modbus'], dict):
             config_data['modbus'] = {} # Ensure modbus section exists
 
-        config_data['modbus']['ip'] = ip
-        config_data['modbus']['port'] = int(port) # Ensure port is an integer
+        if ip and port:
+            config_data['modbus']['ip'] = ip
+            config_data['modbus']['port'] = int(port) # Ensure port is an integer
+        if units is not None:
+            if units:
+                config_data['modbus']['units'] = units
+            else:
+                config_data['modbus'].pop('units', None)
 
-        with open(config_path, 'w') as f:
+        # Write a temporary file and rename it, so the config watcher never reads a half-written file
+        with open(f"{config_path}.tmp", 'w') as f:
             yaml.dump(config_data, f, sort_keys=False)
-
-        logging.info(f"Admin updated Modbus config in register_config.yaml: IP={ip}, Port={port}")
-        # Flash message might not be visible if this is an API call typically handled by JS
-        # flash("Modbus configuration updated in register_config.yaml. Please restart the application for changes to take full effect.", "success")
-        return jsonify({"message": "Modbus configuration updated in register_config.yaml. A restart of the MQTT subscriber and potentially the Flask app (if it caches this config) may be required."})
+        os.replace(f"{config_path}.tmp", config_path)
+
+        logging.info(f"Admin updated Modbus config in register_config.yaml: IP={ip}, Port={port}, Units={len(units) if units is not None else 'unchanged'}")
+        # Apply it right away instead of waiting for the watcher
+        if not CONFIG_REGISTRY.reload():
+            return jsonify({"error": f"register_config.yaml was written but not applied: {CONFIG_REGISTRY.last_error}"}), 500
+        return jsonify({"message": "Modbus configuration updated in register_config.yaml and applied.",
+                        "config_version": CONFIG_REGISTRY.version})
     except Exception as e:
         logging.error(f"Error updating Modbus config in {config_path}: {e}", exc_info=True)
         # flash(f"Error updating Modbus configuration file: {e}", "error")
@@ -424,6 +604,7 @@ def set_modbus_config():
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
+    _ensure_database()
     if current_user.is_authenticated:
         return redirect(url_for('index'))
     if request.method == 'POST':
@@ -452,27 +633,87 @@ def logout():
     return redirect(url_for('index'))
 
 
-if __name__ == '__main__':
-    # Load .env variables if not already loaded (e.g., by a run script)
-    from dotenv import load_dotenv # Keep this for direct app.py execution
-    load_dotenv() # Ensure .env is loaded before any os.getenv calls
-    
-    # Import threading here if not already globally imported by other means
-    import threading
+def start_ingestion_services():
+    """Start everything that receives and stores samples. Runs only in the elected ingestion leader."""
+    # Followers stop mirroring the leader's live cache; this process now fills it
+    shared_state.stop()
+
+    # Ingestion comes up first: nothing that follows is needed to receive and store samples
+    # Start the ingestion worker before the MQTT client so no message is queued without a consumer
+    if decode_pool:
+        decode_pool.start()
+    ingestion_queue.start()
+    # Start the writer now so rows spooled during an earlier outage are replayed right away
+    batch_writer.start()
+
+    # Start the MQTT subscriber(s) in background threads
+    logging.info(f"Creating {MQTT_SUBSCRIBER_WORKERS} Minimal MQTT subscriber thread(s)...")
+    for worker in range(MQTT_SUBSCRIBER_WORKERS):
+        mqtt_thread = threading.Thread(target=run_minimal_mqtt_thread, args=(worker,),
+                                       name=f"MinimalMQTTSubscriberThread-{worker}")
+        mqtt_thread.daemon = True  # Allow main program to exit even if this thread is still running
+        mqtt_thread.start()
+    logging.info("Minimal MQTT subscriber thread(s) started.")
+
+    if modbus_scheduler:
+        modbus_scheduler.start()
+    mark("start ingestion (queue, writer, MQTT, Modbus)")
 
     start_scheduler() # Starts the 'delete_old_data' job
+    mark("start background scheduler")
 
-    # Start the MQTT subscriber in a background thread
-    logging.info("Creating Minimal MQTT subscriber thread...")
-    # Ensure the target function is the new one
-    mqtt_thread = threading.Thread(target=run_minimal_mqtt_thread, name="MinimalMQTTSubscriberThread")
-    mqtt_thread.daemon = True  # Allow main program to exit even if this thread is still running
-    mqtt_thread.start()
-    logging.info("Minimal MQTT subscriber thread started.")
+    # HTTP-only workers serve live data and stats from this process's snapshot
+    shared_state.start_publisher(ingestion_stats_snapshot)
+
+
+def _ingestion_leadership_lost():
+    # The MQTT client, writer and scheduler cannot be handed over from inside this process:
+    # exit so the process manager restarts it and a healthy worker takes over ingestion.
+    # Exit code 1: gunicorn treats 3 (WORKER_BOOT_ERROR) as fatal and would stop every worker.
+    logging.critical("❌ Ingestion leader lock lost; exiting so another worker takes over ingestion.")
+    os._exit(1)
+
+
+ingestion_leader = IngestionLeader(start_ingestion_services, on_lost=_ingestion_leadership_lost)
+_worker_started = False
+_worker_lock = threading.Lock()
+
+def start_worker():
+    """Start this serving process: ingestion if it wins the leader election, mirroring of the leader otherwise.
+
+    Called once per process, by __main__ and by wsgi.py in every WSGI worker.
+    """
+    global _worker_started
+    with _worker_lock:
+        if _worker_started:
+            return
+        _worker_started = True
+
+    if not ingestion_leader.start():
+        shared_state.start_follower()
+        if ingest_spool is not None and ingest_spool.has_backlog():
+            # This process's spool slot holds rows of a process that died: replay them now, not at the first POST
+            batch_writer.start()
+    mark("elect ingestion leader")
+
+    # Apply edits of register_config.yaml without a restart
+    CONFIG_REGISTRY.start_watching()
+
+    # Ingestion does not need it; on failure the next login or authenticated request retries
+    _ensure_database()
+    mark("bootstrap user database")
+
+
+if __name__ == '__main__':
+    # .env was loaded once at import (load_env above)
+    # Single process: it becomes the ingestion leader unless WSGI workers (wsgi.py) already run one
+    start_worker()
+
+    if '--profile-startup' in sys.argv:
+        print(startup_report())
 
     # Use host='0.0.0.0' to make it accessible on the network
     # Use a different port if 5000 is used by something else (like the MQTT subscriber)
+    # For several worker processes use gunicorn (gunicorn.conf.py) instead of the development server
     app_port = int(os.getenv('FLASK_RUN_PORT', 5001))
     app.run(debug=True, host=os.getenv('FLASK_RUN_HOST', '0.0.0.0'), port=app_port, use_reloader=False)
-
-
@@ -2,9 +2,18 @@
 """
 Script to create the sensor_data_rpi table if it doesn't exist.
 This resolves the database issue where the application can't find the table.
+
+The table is range-partitioned by day on `timestamp` (see api/partitions.py).
+Run with --partition to convert an existing unpartitioned table.
+
+Besides raw_data, every register in register_config.yaml gets a typed column
+(see api/register_columns.py). Running the script again after adding registers
+adds their columns and fills them from raw_data; --backfill refills all of them.
 """
 
 import os
+import sys
+from datetime import datetime
 import psycopg2
 import psycopg2.extras
 from dotenv import load_dotenv
@@ -12,6 +21,13 @@ from dotenv import load_dotenv
 # Load environment variables
 load_dotenv()
 
+from api.rollups import ensure_rollup_tables
+from api.register_columns import register_columns_sql, ensure_register_columns, backfill_register_columns, REGISTER_COLUMNS
+from api.packed_storage import ensure_packed_schema, SENSOR_STORAGE_FORMAT
+from api.device_state import ensure_device_state_table, DEVICE_STATE_TABLE
+from api.partitions import is_partitioned, create_partitions, day_start, PARTITION_PRECREATE_DAYS
+from api.timezone_config import set_timezone
+
 # PostgreSQL configuration
 POSTGRES_CONFIG = {
     'host': os.getenv('POSTGRES_HOST', 'localhost'),
@@ -23,7 +39,92 @@ POSTGRES_CONFIG = {
 
 POSTGRES_TABLE = os.getenv('POSTGRES_TABLE', 'sensor_data_rpi')
 
-def create_table():
+
+def sensor_table_sql(table_name):
+    """CREATE statement for the day-partitioned sensor table.
+
+    The primary key of a partitioned table has to include the partition key,
+    so it is (id, timestamp) instead of id alone.
+    """
+    register_columns = ",\n".join(f"                {line}" for line in register_columns_sql().split(",\n")) + "," if REGISTER_COLUMNS else ""
+    return f"""
+            CREATE TABLE IF NOT EXISTS {table_name} (
+                id SERIAL,
+                timestamp TIMESTAMPTZ NOT NULL,
+                device_id VARCHAR(100) NOT NULL,
+                raw_data JSONB,
+                -- One typed column per register in register_config.yaml
+{register_columns}
+                -- Index for performance
+                created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (id, timestamp)
+            ) PARTITION BY RANGE (timestamp);
+            
+            -- Create indexes for better query performance (created on every partition)
+            CREATE INDEX IF NOT EXISTS idx_{table_name}_timestamp ON {table_name}(timestamp);
+            CREATE INDEX IF NOT EXISTS idx_{table_name}_device_id ON {table_name}(device_id);
+            CREATE INDEX IF NOT EXISTS idx_{table_name}_created_at ON {table_name}(created_at);
+            -- One row per device and sample time; the writer inserts with ON CONFLICT DO NOTHING
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_{table_name}_device_timestamp ON {table_name}(device_id, timestamp);
+            """
+
+
+def migrate_to_partitioned(conn, cursor):
+    """Copy an existing unpartitioned table into a new day-partitioned one.
+
+    The old table is kept as <table>_unpartitioned; drop it once the data is verified.
+    """
+    old_table = f"{POSTGRES_TABLE}_unpartitioned"
+    print(f"🔄 Converting '{POSTGRES_TABLE}' to a day-partitioned table...")
+    cursor.execute(f"ALTER TABLE {POSTGRES_TABLE} RENAME TO {old_table};")
+    # Index names are schema-wide, so move the old ones out of the way of the new table's
+    cursor.execute(f"ALTER INDEX IF EXISTS {POSTGRES_TABLE}_pkey RENAME TO {old_table}_pkey;")
+    for index in ('timestamp', 'device_id', 'created_at', 'device_timestamp'):
+        cursor.execute(f"ALTER INDEX IF EXISTS idx_{POSTGRES_TABLE}_{index} RENAME TO idx_{old_table}_{index};")
+    cursor.execute(sensor_table_sql(POSTGRES_TABLE))
+
+    cursor.execute(f"SELECT min(timestamp), max(timestamp) FROM {old_table};")
+    first, last = cursor.fetchone()
+    now = datetime.now(set_timezone)
+    first = day_start(first or now)
+    days = (day_start(max(last or now, now)) - first).days + 1 + PARTITION_PRECREATE_DAYS
+    create_partitions(cursor, first, days)
+
+    cursor.execute(f"""
+        SELECT string_agg(quote_ident(column_name), ', ' ORDER BY ordinal_position)
+        FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = %s
+          AND column_name IN (SELECT column_name FROM information_schema.columns
+                              WHERE table_schema = 'public' AND table_name = %s);
+    """, (old_table, POSTGRES_TABLE))
+    columns = cursor.fetchone()[0]
+    cursor.execute(f"INSERT INTO {POSTGRES_TABLE} ({columns}) SELECT {columns} FROM {old_table} ON CONFLICT DO NOTHING;")
+    copied = cursor.rowcount
+    cursor.execute(f"""
+        SELECT setval(pg_get_serial_sequence(%s, 'id'), COALESCE((SELECT max(id) FROM {POSTGRES_TABLE}), 0) + 1, false);
+    """, (POSTGRES_TABLE,))
+    conn.commit()
+    print(f"✅ Copied {copied} records. The old table is kept as '{old_table}'.")
+
+
+def ensure_unique_key(conn, cursor):
+    """Add the (device_id, timestamp) unique index, deleting duplicate rows (keeping the first) beforehand."""
+    index_name = f"idx_{POSTGRES_TABLE}_device_timestamp"
+    cursor.execute("SELECT 1 FROM pg_indexes WHERE schemaname = 'public' AND indexname = %s;", (index_name,))
+    if cursor.fetchone():
+        return
+    print(f"🔄 Adding unique key (device_id, timestamp) to '{POSTGRES_TABLE}'...")
+    cursor.execute(f"""
+        DELETE FROM {POSTGRES_TABLE} a USING {POSTGRES_TABLE} b
+        WHERE a.device_id = b.device_id AND a.timestamp = b.timestamp AND a.id > b.id;
+    """)
+    removed = cursor.rowcount
+    cursor.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {index_name} ON {POSTGRES_TABLE}(device_id, timestamp);")
+    conn.commit()
+    print(f"✅ Unique key added ({removed} duplicate records removed).")
+
+
+def create_table(migrate=False, backfill=False):
     """Create the sensor_data_rpi table if it doesn't exist"""
     try:
         # Connect to PostgreSQL
@@ -56,40 +157,56 @@ def create_table():
             print(f"Current table structure:")
             for col_name, data_type, nullable in columns:
                 print(f"  - {col_name}: {data_type} (nullable: {nullable})")
+
+            if is_partitioned(cursor):
+                create_partitions(cursor, datetime.now(set_timezone), PARTITION_PRECREATE_DAYS + 1)
+                conn.commit()
+                print(f"✅ Table '{POSTGRES_TABLE}' is partitioned by day.")
+            elif migrate:
+                migrate_to_partitioned(conn, cursor)
+            else:
+                print(f"⚠️ Table '{POSTGRES_TABLE}' is not partitioned; retention falls back to row deletes.")
+                print("   Run this script with --partition to convert it.")
         else:
             print(f"⚠️ Table '{POSTGRES_TABLE}' does not exist. Creating it now...")
             
-            # Create the table with appropriate schema
-            create_table_sql = f"""
-            CREATE TABLE IF NOT EXISTS {POSTGRES_TABLE} (
-                id SERIAL PRIMARY KEY,
-                timestamp TIMESTAMPTZ NOT NULL,
-                device_id VARCHAR(100) NOT NULL,
-                raw_data JSONB,
-                -- Additional columns for common sensor data
-                cl1_soc REAL,
-                cl2_soc REAL,
-                cl1_voltage REAL,
-                cl2_voltage REAL,
-                cl1_current REAL,
-                cl2_current REAL,
-                cl1_temperature REAL,
-                cl2_temperature REAL,
-                system_power REAL,
-                system_status INTEGER,
-                -- Index for performance
-                created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
-            );
-            
-            -- Create indexes for better query performance
-            CREATE INDEX IF NOT EXISTS idx_{POSTGRES_TABLE}_timestamp ON {POSTGRES_TABLE}(timestamp);
-            CREATE INDEX IF NOT EXISTS idx_{POSTGRES_TABLE}_device_id ON {POSTGRES_TABLE}(device_id);
-            CREATE INDEX IF NOT EXISTS idx_{POSTGRES_TABLE}_created_at ON {POSTGRES_TABLE}(created_at);
-            """
+            # Create the day-partitioned table and the first partitions
+            create_table_sql = sensor_table_sql(POSTGRES_TABLE)
             
             cursor.execute(create_table_sql)
+            create_partitions(cursor, datetime.now(set_timezone), PARTITION_PRECREATE_DAYS + 1)
             conn.commit()
             print(f"✅ Table '{POSTGRES_TABLE}' created successfully!")
+
+        # Existing tables get the (device_id, timestamp) unique key used by ON CONFLICT
+        if table_exists:
+            ensure_unique_key(conn, cursor)
+
+        # Typed register columns: add columns for new registers and fill them from raw_data
+        added = ensure_register_columns(cursor)
+        conn.commit()
+        if added:
+            print(f"✅ Added register columns: {', '.join(added)}")
+        refill = [column for _, column, _ in REGISTER_COLUMNS] if backfill else added
+        if table_exists and refill:
+            updated = backfill_register_columns(cursor, refill)
+            conn.commit()
+            print(f"✅ Filled register columns of {updated} existing records from raw_data.")
+
+        # Packed storage columns and layout table (used when SENSOR_STORAGE_FORMAT=packed)
+        ensure_packed_schema(cursor)
+        conn.commit()
+        print(f"✅ Packed storage columns in place (storage format: {SENSOR_STORAGE_FORMAT}).")
+
+        # Rollup tables used by /api/historical-data (filled by the app's scheduler)
+        ensure_rollup_tables(cursor)
+        conn.commit()
+        print(f"✅ Rollup tables for '{POSTGRES_TABLE}' are in place.")
+
+        # Latest status per device (filled from the MQTT status topic)
+        ensure_device_state_table(cursor)
+        conn.commit()
+        print(f"✅ Device state table '{DEVICE_STATE_TABLE}' is in place.")
             
         # Get row count
         cursor.execute(f"SELECT COUNT(*) FROM {POSTGRES_TABLE};")
@@ -136,7 +253,7 @@ if __name__ == "__main__":
     # Test connection first
     if test_connection():
         # Create table if needed
-        if create_table():
+        if create_table(migrate='--partition' in sys.argv[1:], backfill='--backfill' in sys.argv[1:]):
             print("\n✅ Database setup completed successfully!")
         else:
             print("\n❌ Database setup failed!")
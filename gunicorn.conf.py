@@ -0,0 +1,21 @@
+"""
+gunicorn settings for wsgi.py: `gunicorn -c gunicorn.conf.py wsgi:app`
+
+Every value can be overridden with the usual GUNICORN_CMD_ARGS or on the
+command line. The app is not preloaded so each worker starts its own threads
+after the fork; only the elected ingestion leader starts MQTT and Modbus.
+"""
+
+import os
+import multiprocessing
+
+bind = f"{os.getenv('FLASK_RUN_HOST', '0.0.0.0')}:{os.getenv('FLASK_RUN_PORT', '5001')}"
+workers = int(os.getenv('WEB_WORKERS', multiprocessing.cpu_count()))
+# Threads per worker: SSE clients (/api/live-data/stream) hold a thread each while connected
+worker_class = 'gthread'
+threads = int(os.getenv('WEB_THREADS', '8'))
+timeout = 60
+graceful_timeout = 30
+preload_app = False
+accesslog = None
+errorlog = '-'
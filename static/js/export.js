@@ -35,7 +35,7 @@ document.addEventListener("DOMContentLoaded", function () {
         // Add the /api prefix to make it consistent with your other endpoints
         let url = `/api/historical-data/export?range=${range}`;
         if (range === "custom" && start && end) url += `&start=${encodeURIComponent(start)}&end=${encodeURIComponent(end)}`;
-        if (selectedVars.length > 0) url += `&variables=${selectedVars.join(",")}`;
+        if (selectedVars.length > 0) url += `&variables=${encodeURIComponent(selectedVars.join(","))}`;
 
         console.log(`📥 Fetching data: ${url}`);
 
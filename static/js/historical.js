@@ -120,15 +120,19 @@ function displayHistoricalError(error) {
     }
 }
 
-// Downsample data (remains the same)
-function downsampleData(data, maxPoints = 500) { // Increased maxPoints for historical
-    if (!Array.isArray(data) || data.length <= maxPoints) {
-        return data;
-    }
-    const step = Math.ceil(data.length / maxPoints);
-    const downsampled = data.filter((_, index) => index % step === 0);
-    console.log(`📊 Downsampling complete. Original: ${data.length}, Reduced: ${downsampled.length}`);
-    return downsampled;
+// Points per register requested from the server (LTTB downsampling happens in /api/historical-data)
+const HISTORICAL_MAX_POINTS = 500;
+
+// Registers shown on the historical line charts (ui.view includes 'historical' and component is line_chart)
+function getHistoricalChartRegisters() {
+    return registerDefinitions?.registers?.filter(reg => {
+        const ui = reg.ui;
+        const view = ui?.view;
+        const component = ui?.component;
+        const isHistoricalView = (view === 'historical' || (Array.isArray(view) && view.includes('historical')));
+        const isLineChart = (component === 'line_chart' || (Array.isArray(component) && component.includes('line_chart')));
+        return isHistoricalView && isLineChart;
+    }) || [];
 }
 
 // --- Fetch Historical Data ---
@@ -137,7 +141,12 @@ function fetchHistoricalData(range, start = null, end = null) {
     customStartDate = start instanceof Date ? start : null; // Ensure Date object or null
     customEndDate = end instanceof Date ? end : null;     // Ensure Date object or null
 
-    let url = `/api/historical-data?range=${range}`;
+    let url = `/api/historical-data?range=${range}&max_points=${HISTORICAL_MAX_POINTS}`;
+    // Only ask for the registers the charts plot; the server extracts them in SQL
+    const chartRegisterNames = getHistoricalChartRegisters().map(reg => reg.name);
+    if (chartRegisterNames.length > 0) {
+        url += `&variables=${encodeURIComponent(chartRegisterNames.join(','))}`;
+    }
     if (range === "custom" && customStartDate && customEndDate) {
         // Format dates as YYYY-MM-DDTHH:MM for the API
         // The backend will interpret these as GMT+8
@@ -167,8 +176,7 @@ function fetchHistoricalData(range, start = null, end = null) {
             console.log(`✅ Received ${data.length} historical records.`);
             // Timestamps from backend are now ISO8601 with GMT+8 offset (e.g., ...+08:00)
             // new Date() will parse these correctly into local time for display.
-            const downsampled = downsampleData(data);
-            updateCharts(downsampled); // Update charts with downsampled data
+            updateCharts(data); // Data is already downsampled per register by the server
             showLoadingIndicator(false); // Hide spinner
         })
         .catch(error => {
@@ -200,15 +208,7 @@ function updateCharts(data) {
     timeLabels = data.map(entry => new Date(entry.timestamp));
 
     // Filter registerDefinitions.registers
-    const historicalViewRegisters = registerDefinitions.registers?.filter((reg, index) => {
-        const ui = reg.ui;
-        const view = ui?.view;
-        const component = ui?.component;
-        const isHistoricalView = (view === 'historical' || (Array.isArray(view) && view.includes('historical')));
-        const isLineChart = (component === 'line_chart' || (Array.isArray(component) && component.includes('line_chart')));
-        const shouldInclude = isHistoricalView && isLineChart;
-        return shouldInclude;
-    }) || [];
+    const historicalViewRegisters = getHistoricalChartRegisters();
 
     // How many registers were filtered?
     console.log(`updateCharts: Found ${historicalViewRegisters.length} registers for historical line charts.`);
@@ -235,6 +235,7 @@ function updateCharts(data) {
             backgroundColor: (reg.ui?.color || getRandomColor()).replace('1)', '0.2)'),
             borderWidth: 1.5,
             tension: 0.1,
+            spanGaps: true, // Downsampled rows only carry the registers selected at that timestamp
             pointRadius: data.length < 100 ? 2 : 0,
             pointHoverRadius: 5
         }));
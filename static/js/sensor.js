@@ -267,8 +267,6 @@ function fetchAllLiveDataAndUpdateDisplays() {
         return;
     }
 
-    const chartsNeedingUpdate = new Set(); // Collect unique chart instances to update once
-
     fetch('/api/live-data')
         .then(response => {
             if (!response.ok) {
@@ -281,132 +279,183 @@ function fetchAllLiveDataAndUpdateDisplays() {
                 console.error('Error from live-data API:', data.error);
                 return;
             }
+            updateDisplaysWithLiveData(data);
+        })
+        .catch(error => {
+            console.error('❌ Error fetching or processing live data:', error);
+        });
+}
 
-            // Robust handling for the common timestamp of the data packet
-            let commonTimestampForPacket;
-            if (data.timestamp) {
-                const parsedServerTime = new Date(data.timestamp);
-                if (!isNaN(parsedServerTime.getTime())) {
-                    commonTimestampForPacket = parsedServerTime;
-                } else {
-                    console.warn(`Invalid server timestamp in data packet: '${data.timestamp}'. Using client time as fallback.`);
-                    commonTimestampForPacket = new Date(); // Fallback to client's current time
-                }
-            } else {
-                // console.log("Server timestamp not provided in data packet. Using client time as fallback.");
-                commonTimestampForPacket = new Date(); // Fallback if server timestamp is null/undefined/empty
-            }
+// Returns true if a register is configured for the live view (ui.view as string or array)
+function isLiveViewRegister(reg) {
+    if (!reg.ui || !reg.ui.view) return false;
+    if (Array.isArray(reg.ui.view)) return reg.ui.view.includes('live');
+    return typeof reg.ui.view === 'string' && reg.ui.view === 'live';
+}
 
-            allRegisterConfigs.forEach(reg => {
-                // MODIFIED: Robust check for 'live' view (string or array)
-                if (!reg.ui || !reg.ui.view) return; // Skip if no ui or view defined
+// Live updates are pushed over Server-Sent Events; polling is only a fallback while the stream is down
+let liveEventSource = null;
+let livePollTimer = null;
 
-                let shouldProcessForLiveView = false;
-                if (Array.isArray(reg.ui.view)) {
-                    shouldProcessForLiveView = reg.ui.view.includes('live');
-                } else if (typeof reg.ui.view === 'string') {
-                    shouldProcessForLiveView = reg.ui.view === 'live';
-                }
+function startLiveDataPolling() {
+    if (livePollTimer === null) {
+        livePollTimer = setInterval(fetchAllLiveDataAndUpdateDisplays, 1000);
+    }
+}
 
-                if (!shouldProcessForLiveView) return; // Skip if not for live view
+function stopLiveDataPolling() {
+    if (livePollTimer !== null) {
+        clearInterval(livePollTimer);
+        livePollTimer = null;
+    }
+}
 
-                // Access sensor values from the nested data.data object
-                const value = data.data ? data.data[reg.name] : undefined;
-                const unit = reg.unit || '';
-                // Set scale to 1 for all registers as API provides pre-scaled data.
-                let scale = 1;
+function startLiveDataStream() {
+    if (typeof EventSource === 'undefined') {
+        console.warn("EventSource not supported by this browser. Falling back to 1s polling.");
+        fetchAllLiveDataAndUpdateDisplays();
+        startLiveDataPolling();
+        return;
+    }
+    // Only ask the server for the registers this view actually displays
+    const liveRegisterNames = allRegisterConfigs.filter(isLiveViewRegister).map(reg => reg.name);
+    const params = new URLSearchParams();
+    if (liveRegisterNames.length > 0) {
+        params.set('registers', liveRegisterNames.join(','));
+    }
+    liveEventSource = new EventSource(`/api/live-data/stream?${params.toString()}`);
+    liveEventSource.onopen = () => {
+        stopLiveDataPolling();
+    };
+    liveEventSource.onmessage = event => {
+        if (window.isPaused) return;
+        try {
+            updateDisplaysWithLiveData(JSON.parse(event.data));
+        } catch (error) {
+            console.error('❌ Error processing live data event:', error);
+        }
+    };
+    liveEventSource.onerror = () => {
+        // EventSource reconnects on its own; poll in the meantime so the dashboard keeps updating
+        console.warn("Live data stream interrupted. Polling until it reconnects.");
+        startLiveDataPolling();
+    };
+}
 
-                const decimals = reg.ui.decimals !== undefined ? reg.ui.decimals : ((reg.scale && reg.scale.toString().includes('.')) ? reg.scale.toString().split('.')[1].length : 2); // Use reg.scale for decimals calculation if needed, but not for scaling value
+// Function to update all live displays from one data packet ({timestamp, device_id, data})
+function updateDisplaysWithLiveData(data) {
+    const chartsNeedingUpdate = new Set(); // Collect unique chart instances to update once
 
-                if (value === undefined) {
-                    // Enhanced logging for missing data keys
-                    if (data.data) {
-                        console.warn(`[Live Data] No data received for register: '${reg.name}'. Available keys in API's 'data' object: [${Object.keys(data.data).join(', ')}]`);
-                    } else {
-                        console.warn(`[Live Data] No data received for register: '${reg.name}'. The API response did not contain a 'data' object or it was undefined.`);
-                    }
-                }
+    // Robust handling for the common timestamp of the data packet
+    let commonTimestampForPacket;
+    if (data.timestamp) {
+        const parsedServerTime = new Date(data.timestamp);
+        if (!isNaN(parsedServerTime.getTime())) {
+            commonTimestampForPacket = parsedServerTime;
+        } else {
+            console.warn(`Invalid server timestamp in data packet: '${data.timestamp}'. Using client time as fallback.`);
+            commonTimestampForPacket = new Date(); // Fallback to client's current time
+        }
+    } else {
+        // console.log("Server timestamp not provided in data packet. Using client time as fallback.");
+        commonTimestampForPacket = new Date(); // Fallback if server timestamp is null/undefined/empty
+    }
 
-                const components = Array.isArray(reg.ui.component) ? reg.ui.component : [reg.ui.component];
-
-                components.forEach(componentType => {
-                    if (componentType === 'soc_meter') {
-                        updateSocMeterDisplay(reg.name, value, unit);
-                    } else if (componentType === 'line_chart') {
-                        const mapping = window.registerDatasetMapping[reg.name];
-                        if (!mapping) {
-                            console.warn(`[Live Data] No dataset mapping found for line chart register: '${reg.name}'. Ensure it was configured for live view and UI created.`);
-                        } else if (!mapping.chart) {
-                            console.warn(`[Live Data] Chart instance is missing in dataset mapping for line chart register: '${reg.name}'.`);
-                        } else if (!mapping.chart.data.datasets[mapping.datasetIndex]) {
-                            console.warn(`[Live Data] Target dataset (index: ${mapping.datasetIndex}) not found in chart for line chart register: '${reg.name}'. Chart has ${mapping.chart.data.datasets.length} datasets.`);
-                        } else {
-                            const chartToUpdate = mapping.chart;
-                            const datasetToUpdateIndex = mapping.datasetIndex;
-                            const targetDataset = chartToUpdate.data.datasets[datasetToUpdateIndex];
-
-                            // This check is technically redundant if the above checks pass, but good for explicitness.
-                            // if (targetDataset) { // Already covered by checks above
-                                const numericValue = parseFloat(value);
-                                if (!isNaN(numericValue)) {
-                                    const scaledValue = numericValue * scale;
-                                    const newPointTimestamp = commonTimestampForPacket;
-
-                                    targetDataset.data.push({ x: newPointTimestamp, y: scaledValue });
-
-                                    const fifteenMinutesInMillis = INITIAL_HISTORY_MINUTES * 60 * 1000;
-                                    const windowStartTimeLimit = newPointTimestamp.getTime() - fifteenMinutesInMillis;
-
-                                    while (
-                                        targetDataset.data.length > 0 &&
-                                        targetDataset.data[0].x &&
-                                        typeof targetDataset.data[0].x.getTime === 'function' &&
-                                        !isNaN(targetDataset.data[0].x.getTime()) &&
-                                        targetDataset.data[0].x.getTime() < windowStartTimeLimit
-                                    ) {
-                                        targetDataset.data.shift();
-                                    }
+    allRegisterConfigs.forEach(reg => {
+        if (!isLiveViewRegister(reg)) return; // Skip if not for live view
 
-                                    while (targetDataset.data.length > MAX_DATA_POINTS) {
-                                        targetDataset.data.shift();
-                                    }
+        // Access sensor values from the nested data.data object
+        const value = data.data ? data.data[reg.name] : undefined;
+        const unit = reg.unit || '';
+        // Set scale to 1 for all registers as API provides pre-scaled data.
+        let scale = 1;
 
-                                    chartsNeedingUpdate.add(chartToUpdate);
-                                } else {
-                                    // console.warn(`Invalid data for line chart dataset ${reg.name}: ${value}`);
-                                }
-                            // } else { // Should not be reached if above checks are in place
-                            //     console.error(`Dataset not found for ${reg.name} at index ${datasetToUpdateIndex} in chart for group ${reg.group}`);
-                            // }
-                        }
-                    } else if (componentType === 'display_value') {
-                        const elementId = `${reg.name}_DisplayValue`;
-                        updateDisplayValue(elementId, value, unit, scale, decimals);
-                    } else if (componentType === 'status_display') {
-                        updateStatusDisplayCard(reg.name, value, reg.ui.status_mapping, reg.ui.label || reg.name);
-                    } else if (componentType === 'bitmask_display') {
-                        updateBitmaskDisplayCard(reg.name, value, reg.ui.bit_mapping, reg.ui.label || reg.name);
-                    } else if (componentType === 'status_indicator') {
-                        // Basic update for status_indicator: just show the raw value for now.
-                        // More advanced logic (e.g., changing color/icon based on value) can be added here.
-                        const elementId = `${reg.name}_StatusIndicator_Value`;
-                        const displayElement = document.getElementById(elementId);
-                        if (displayElement) {
-                            displayElement.textContent = value !== undefined && value !== null ? `${value} ${unit}` : `N/A ${unit}`;
-                        }
-                    }
-                });
-            });
+        const decimals = reg.ui.decimals !== undefined ? reg.ui.decimals : ((reg.scale && reg.scale.toString().includes('.')) ? reg.scale.toString().split('.')[1].length : 2); // Use reg.scale for decimals calculation if needed, but not for scaling value
 
-            // Update all modified charts once after all data processing for this interval is complete
-            chartsNeedingUpdate.forEach(chart => {
-                chart.update('none');
-            });
+        if (value === undefined) {
+            // Enhanced logging for missing data keys
+            if (data.data) {
+                console.warn(`[Live Data] No data received for register: '${reg.name}'. Available keys in API's 'data' object: [${Object.keys(data.data).join(', ')}]`);
+            } else {
+                console.warn(`[Live Data] No data received for register: '${reg.name}'. The API response did not contain a 'data' object or it was undefined.`);
+            }
+        }
 
-        })
-        .catch(error => {
-            console.error('❌ Error fetching or processing live data:', error);
+        const components = Array.isArray(reg.ui.component) ? reg.ui.component : [reg.ui.component];
+
+        components.forEach(componentType => {
+            if (componentType === 'soc_meter') {
+                updateSocMeterDisplay(reg.name, value, unit);
+            } else if (componentType === 'line_chart') {
+                const mapping = window.registerDatasetMapping[reg.name];
+                if (!mapping) {
+                    console.warn(`[Live Data] No dataset mapping found for line chart register: '${reg.name}'. Ensure it was configured for live view and UI created.`);
+                } else if (!mapping.chart) {
+                    console.warn(`[Live Data] Chart instance is missing in dataset mapping for line chart register: '${reg.name}'.`);
+                } else if (!mapping.chart.data.datasets[mapping.datasetIndex]) {
+                    console.warn(`[Live Data] Target dataset (index: ${mapping.datasetIndex}) not found in chart for line chart register: '${reg.name}'. Chart has ${mapping.chart.data.datasets.length} datasets.`);
+                } else {
+                    const chartToUpdate = mapping.chart;
+                    const datasetToUpdateIndex = mapping.datasetIndex;
+                    const targetDataset = chartToUpdate.data.datasets[datasetToUpdateIndex];
+
+                    // This check is technically redundant if the above checks pass, but good for explicitness.
+                    // if (targetDataset) { // Already covered by checks above
+                        const numericValue = parseFloat(value);
+                        if (!isNaN(numericValue)) {
+                            const scaledValue = numericValue * scale;
+                            const newPointTimestamp = commonTimestampForPacket;
+
+                            targetDataset.data.push({ x: newPointTimestamp, y: scaledValue });
+
+                            const fifteenMinutesInMillis = INITIAL_HISTORY_MINUTES * 60 * 1000;
+                            const windowStartTimeLimit = newPointTimestamp.getTime() - fifteenMinutesInMillis;
+
+                            while (
+                                targetDataset.data.length > 0 &&
+                                targetDataset.data[0].x &&
+                                typeof targetDataset.data[0].x.getTime === 'function' &&
+                                !isNaN(targetDataset.data[0].x.getTime()) &&
+                                targetDataset.data[0].x.getTime() < windowStartTimeLimit
+                            ) {
+                                targetDataset.data.shift();
+                            }
+
+                            while (targetDataset.data.length > MAX_DATA_POINTS) {
+                                targetDataset.data.shift();
+                            }
+
+                            chartsNeedingUpdate.add(chartToUpdate);
+                        } else {
+                            // console.warn(`Invalid data for line chart dataset ${reg.name}: ${value}`);
+                        }
+                    // } else { // Should not be reached if above checks are in place
+                    //     console.error(`Dataset not found for ${reg.name} at index ${datasetToUpdateIndex} in chart for group ${reg.group}`);
+                    // }
+                }
+            } else if (componentType === 'display_value') {
+                const elementId = `${reg.name}_DisplayValue`;
+                updateDisplayValue(elementId, value, unit, scale, decimals);
+            } else if (componentType === 'status_display') {
+                updateStatusDisplayCard(reg.name, value, reg.ui.status_mapping, reg.ui.label || reg.name);
+            } else if (componentType === 'bitmask_display') {
+                updateBitmaskDisplayCard(reg.name, value, reg.ui.bit_mapping, reg.ui.label || reg.name);
+            } else if (componentType === 'status_indicator') {
+                // Basic update for status_indicator: just show the raw value for now.
+                // More advanced logic (e.g., changing color/icon based on value) can be added here.
+                const elementId = `${reg.name}_StatusIndicator_Value`;
+                const displayElement = document.getElementById(elementId);
+                if (displayElement) {
+                    displayElement.textContent = value !== undefined && value !== null ? `${value} ${unit}` : `N/A ${unit}`;
+                }
+            }
         });
+    });
+
+    // Update all modified charts once after all data processing for this interval is complete
+    chartsNeedingUpdate.forEach(chart => {
+        chart.update('none');
+    });
 }
 
 // Function to reset zoom on all line charts
@@ -1115,7 +1164,7 @@ document.addEventListener('DOMContentLoaded', async function() {
                 }
             });
         });
-        setInterval(fetchAllLiveDataAndUpdateDisplays, 1000); // Regular updates
+        startLiveDataStream(); // Push updates over SSE (falls back to polling if the stream drops)
     } else {
         console.log("User not authenticated. Live updates will not start.");
         if (typeof showLoginModal === 'function') {
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Test script for the per-sensor sample coalescer (api/coalescer.py)
+
+Merges single-register updates into rows and checks that a row carries the
+timestamp of its slot's newest value and every merged ack. Then writes a bulk
+sample on a whole second and the coalesced row of the same slot through the
+batch writer, and checks that both are stored instead of the coalesced row
+being dropped as a (device_id, timestamp) duplicate. The database part runs
+against the PostgreSQL database in .env when it is reachable.
+
+Usage:
+    python test_coalescer.py
+"""
+
+import os
+import sys
+import json
+from datetime import datetime, timezone
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from api.batch_writer import BatchWriter
+from api.coalescer import SampleCoalescer
+from api.db_pool import get_connection
+
+SLOT = datetime(2025, 1, 1, 12, 0, 0, tzinfo=timezone.utc)
+
+
+def at(seconds):
+    return datetime.fromtimestamp(SLOT.timestamp() + seconds, timezone.utc).isoformat()
+
+
+def test_row_timestamp():
+    """One row per slot, stamped with the newest value in it, even when a late value arrives last."""
+    print("\n🧪 Testing coalesced row timestamps...")
+    emitted = []
+    acks = []
+    coalescer = SampleCoalescer(lambda payload, ack: emitted.append((payload, ack)),
+                                seed=lambda device_id: {'flow': 1.0}, interval=1.0, grace=60.0)
+    coalescer.add('unit_1', 'pressure', 2.0, at(0.25), lambda: acks.append('pressure'))
+    coalescer.add('unit_1', 'level', 3.0, at(0.75), lambda: acks.append('level'))
+    coalescer.add('unit_1', 'temperature', 4.0, at(-0.5), lambda: acks.append('temperature'))
+    coalescer.add('unit_1', 'pressure', 5.0, at(1.5), lambda: acks.append('next'))
+    coalescer.stop()
+    for _, ack in emitted:
+        ack()
+    first, second = emitted[0][0], emitted[1][0]
+    print(f"   rows at {[payload['timestamp'] for payload, _ in emitted]}, first row {first['data']}, acked {acks}")
+    return (len(emitted) == 2 and first['timestamp'] == at(0.75) and second['timestamp'] == at(1.5)
+            and first['data'] == {'flow': 1.0, 'pressure': 2.0, 'level': 3.0, 'temperature': 4.0}
+            and sorted(acks) == ['level', 'next', 'pressure', 'temperature'])
+
+
+def test_bulk_collision():
+    """A coalesced row in the slot of a whole-second bulk sample is stored next to it, not dropped."""
+    print("\n🗄️  Testing a coalesced row in a bulk sample's slot...")
+    conn = get_connection()
+    if not conn:
+        print("   ⏭️  PostgreSQL not reachable, skipped")
+        return True
+    table = f"test_coalescer_{os.getpid()}"
+    with conn.cursor() as cursor:
+        cursor.execute(f"CREATE TABLE {table} (timestamp TIMESTAMPTZ, device_id TEXT, raw_data JSONB, "
+                       f"UNIQUE (device_id, timestamp));")
+    conn.commit()
+    writer = BatchWriter(get_connection, table, batch_size=100, flush_interval=0.1)
+    try:
+        bulk = {'flow': 1.0, 'pressure': 2.0}
+        writer.add((SLOT.isoformat(), 'unit_1', json.dumps(bulk)))
+        coalescer = SampleCoalescer(
+            lambda payload, ack: writer.add((payload['timestamp'], payload['device_id'], json.dumps(payload['data'])), ack),
+            seed=lambda device_id: bulk, interval=1.0, grace=60.0)
+        coalescer.add('unit_1', 'pressure', 3.0, at(0.4))
+        coalescer.stop()
+        writer.stop()
+        stats = writer.stats()
+        with conn.cursor() as cursor:
+            cursor.execute(f"SELECT timestamp, raw_data FROM {table} ORDER BY timestamp;")
+            stored = cursor.fetchall()
+        print(f"   stored {[(ts.isoformat(), data) for ts, data in stored]}, duplicates {stats['rows_duplicate']}")
+        return (len(stored) == 2 and stats['rows_duplicate'] == 0
+                and stored[1][1] == {'flow': 1.0, 'pressure': 3.0})
+    finally:
+        writer.stop()
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {table};")
+        conn.commit()
+        conn.close()
+
+
+def main():
+    tests = [
+        ("Row Timestamp", test_row_timestamp),
+        ("Bulk Collision", test_bulk_collision),
+    ]
+    results = []
+    for test_name, test_func in tests:
+        print(f"\n{'='*20} {test_name} {'='*20}")
+        results.append((test_name, test_func()))
+
+    print("\n" + "="*60)
+    print("📊 Test Results Summary")
+    print("="*60)
+    for test_name, result in results:
+        print(f"{test_name:<25} {'✅ PASS' if result else '❌ FAIL'}")
+    print("="*60)
+    sys.exit(0 if all(result for _, result in results) else 1)
+
+
+if __name__ == "__main__":
+    main()
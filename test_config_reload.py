@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Test script for the hot reload of register_config.yaml (api/config_loader.py ConfigRegistry)
+
+Works on a temporary copy of register_config.yaml: edits it, and checks that
+the indexes, the decoder, the binary decode plans and the Modbus units follow
+the edit without a restart, that invalid edits are rejected while the old
+configuration stays active, and that readers never see a half-applied reload.
+No database or broker is needed.
+
+Usage:
+    python test_config_reload.py
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+
+import yaml
+
+from api.config_loader import (ConfigRegistry, CONFIG_REGISTRY, CONFIG_PATH, REGISTER_CONFIG, REGISTER_DECODER)
+from api.binary_payload import decode_register_words
+from api.modbus_poller import ModbusScheduler, build_units
+from test_modbus_poller import start_stand_in
+
+
+def read_yaml(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return yaml.safe_load(f)
+
+
+def write_yaml(path, data):
+    with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+        yaml.dump(data, f, sort_keys=False)
+    os.replace(f"{path}.tmp", path)
+
+
+def temp_config():
+    path = os.path.join(tempfile.mkdtemp(), 'register_config.yaml')
+    shutil.copy(CONFIG_PATH, path)
+    return path
+
+
+def test_reload_rebuilds_indexes():
+    """An edited file is swapped in with new indexes and decoder, and subscribers are notified."""
+    print("\n🔄 Testing reload of an edited file...")
+    path = temp_config()
+    registry = ConfigRegistry(path)
+    notified = []
+    registry.subscribe(notified.append)
+    data = read_yaml(path)
+    target = next(reg for reg in data['registers'] if reg.get('dataType') != 'bool')
+    target['scale'] = 0.1
+    data['registers'].append({'address': 900, 'name': 'Hot Reload Reg', 'scale': 0.5, 'group': 'Hot Group',
+                              'ui': {'view': ['live']}})
+    write_yaml(path, data)
+    changed = registry.check()
+    config = registry.config
+    print(f"   version {registry.version}, {len(config['raw'])} registers, notified {len(notified)}x")
+    first = target['name']
+    ok = changed and registry.version == 2 and notified == [config]
+    ok &= config['by_address'][900]['name'] == 'Hot Reload Reg' and 'Hot Group' in config['by_group']
+    ok &= config['by_view']['live'][-1]['name'] == 'Hot Reload Reg'
+    ok &= registry.decoder.decode_sample({first: 25, 'Hot Reload Reg': 4}) == {first: 2.5, 'Hot Reload Reg': 2}
+    ok &= registry.check() is False  # Unchanged file: nothing to do
+    return ok
+
+
+def test_invalid_edit_rejected():
+    """Broken YAML, duplicate addresses and subscriber validators keep the previous configuration."""
+    print("\n🚫 Testing rejected edits...")
+    path = temp_config()
+    registry = ConfigRegistry(path)
+    registry.subscribe(lambda config: None, validate=build_units)
+    before = registry.config
+    data = read_yaml(path)
+    ok = True
+
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write("registers: [unclosed\n")
+    duplicate = dict(data, registers=data['registers'] + [dict(data['registers'][0], name='Copy')])
+    bad_unit = dict(data, modbus={'units': [{'ip': '10.0.0.1', 'registers': ['No Such Register']}]})
+    for label, edit in (("broken YAML", None), ("duplicate address", duplicate), ("unknown unit register", bad_unit)):
+        if edit is not None:
+            write_yaml(path, edit)
+        applied = registry.check()
+        print(f"   {label}: applied={applied}, error: {registry.last_error}")
+        ok &= not applied and registry.config is before and registry.version == 1
+    ok &= registry.rejected == 3
+
+    write_yaml(path, data)
+    ok &= registry.check() and registry.version == 2
+    return ok
+
+
+def test_watcher_thread():
+    """The watcher picks up an edit on its own."""
+    print("\n👀 Testing file watcher...")
+    path = temp_config()
+    registry = ConfigRegistry(path)
+    registry.start_watching(interval=0.1)
+    try:
+        data = read_yaml(path)
+        data['registers'] = data['registers'][:5]
+        write_yaml(path, data)
+        deadline = time.monotonic() + 3
+        while registry.version == 1 and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        registry.stop_watching()
+    print(f"   stats: {registry.stats()}")
+    return registry.version == 2 and len(registry.config['by_name']) == 5
+
+
+def test_atomic_swap():
+    """Readers see the config and decoder of one version together, even while reloads run."""
+    print("\n⚛️  Testing atomic swap under concurrent reads...")
+    path = temp_config()
+    registry = ConfigRegistry(path)
+    data = read_yaml(path)
+    small = dict(data, registers=data['registers'][:3])
+    errors = []
+    reads = [0]
+    stop = threading.Event()
+
+    def reader():
+        while not stop.is_set():
+            config, decoder = registry._current
+            if decoder is None:  # Not compiled yet (lazy until the first reload or use)
+                continue
+            if set(config['by_name']) != set(decoder.names) or len(config['by_address']) != len(config['raw']):
+                errors.append(registry.version)
+            reads[0] += 1
+
+    thread = threading.Thread(target=reader)
+    thread.start()
+    try:
+        for i in range(20):
+            write_yaml(path, small if i % 2 == 0 else data)
+            registry.reload()
+    finally:
+        stop.set()
+        thread.join()
+    print(f"   {registry.version - 1} reloads, {reads[0]} reads, {len(errors)} inconsistent")
+    return not errors and registry.version == 21
+
+
+def test_module_consumers():
+    """REGISTER_CONFIG, REGISTER_DECODER, binary decode plans and Modbus units follow CONFIG_REGISTRY."""
+    print("\n🔌 Testing module-level consumers...")
+    path = temp_config()
+    original_path = CONFIG_REGISTRY.path
+    server = start_stand_in({a: 7 for a in range(0, 1000)})
+    data = read_yaml(path)
+    data['modbus'] = {'units': [{'name': 'hot', 'ip': '127.0.0.1', 'port': server.server_address[1],
+                                 'interval': 0.1, 'registers': [0]}]}
+    write_yaml(path, data)
+    samples = []
+    CONFIG_REGISTRY.path = path
+    try:
+        CONFIG_REGISTRY.reload()
+        scheduler = ModbusScheduler(samples.append, build_units())
+        CONFIG_REGISTRY.subscribe(lambda config: scheduler.set_units(build_units(config)))
+        scheduler.start()
+        time.sleep(0.4)
+        first_unit = scheduler.units[0]
+
+        data['registers'].append({'address': 950, 'name': 'Plan Reg', 'dataType': 'sint16', 'scale': 0.1})
+        data['modbus']['units'][0]['registers'] = [0, 'Plan Reg']
+        data['modbus']['units'].append({'name': 'hot_2', 'ip': '127.0.0.1', 'port': server.server_address[1],
+                                        'interval': 0.1, 'registers': ['Plan Reg']})
+        write_yaml(path, data)
+        CONFIG_REGISTRY.reload()
+        time.sleep(0.5)
+        scheduler.stop()
+
+        words = decode_register_words(950, [0xFFF6])
+        stats = {unit['name']: unit for unit in scheduler.stats()['units']}
+        print(f"   REGISTER_CONFIG has Plan Reg: {'Plan Reg' in REGISTER_CONFIG['by_name']}, binary decode: {words}, "
+              f"decoded: {REGISTER_DECODER.decode_sample(words)}")
+        print(f"   units: {[(name, unit['blocks'], unit['polls']) for name, unit in stats.items()]}")
+        ok = REGISTER_CONFIG['by_address'][950]['name'] == 'Plan Reg' and words == {'Plan Reg': -10}
+        ok &= REGISTER_DECODER.decode_sample(words) == {'Plan Reg': -1}
+        ok &= scheduler.units[0] is not first_unit and stats['hot']['blocks'] == [[0, 1], [950, 1]]
+        ok &= stats['hot_2']['polls'] >= 1 and any('Plan Reg' in sample['data'] for sample in samples)
+        return ok
+    finally:
+        CONFIG_REGISTRY._subscribers.pop()
+        CONFIG_REGISTRY.path = original_path
+        CONFIG_REGISTRY.reload()
+        server.shutdown()
+
+
+def main():
+    tests = [
+        ("Reload Rebuilds Indexes", test_reload_rebuilds_indexes),
+        ("Invalid Edit Rejected", test_invalid_edit_rejected),
+        ("File Watcher", test_watcher_thread),
+        ("Atomic Swap", test_atomic_swap),
+        ("Module Consumers", test_module_consumers),
+    ]
+    results = []
+    for test_name, test_func in tests:
+        print(f"\n{'='*20} {test_name} {'='*20}")
+        results.append((test_name, test_func()))
+
+    print("\n" + "="*60)
+    print("📊 Test Results Summary")
+    print("="*60)
+    for test_name, result in results:
+        print(f"{test_name:<25} {'✅ PASS' if result else '❌ FAIL'}")
+    print("="*60)
+    sys.exit(0 if all(result for _, result in results) else 1)
+
+
+if __name__ == "__main__":
+    main()
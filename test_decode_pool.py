@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Test script for the process-pool decode stage (api/decode_pool.py)
+
+Decodes JSON and binary bulk messages in worker processes and checks that
+the results match in-process decoding and arrive in submission (and so
+per-device) order, that invalid messages and a batch that cannot be
+delivered are acknowledged without stopping the pool, that the workers
+follow a register_config.yaml reload, and that a crashed worker falls back
+to in-process decoding without losing or reordering messages. Also prints
+the throughput of the pool against in-process decoding. No database or
+broker is needed.
+
+Usage:
+    python test_decode_pool.py
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+
+import yaml
+
+from api.config_loader import CONFIG_REGISTRY, CONFIG_PATH, REGISTER_CONFIG
+from api.binary_payload import encode_binary_payload
+from api.decode_pool import DecodePool, transform_bulk
+
+
+def make_messages(count, devices=10):
+    """Bulk messages of `devices` devices, JSON and binary frames mixed, with a per-device sequence number."""
+    names = [reg['name'] for reg in REGISTER_CONFIG['raw'] if reg.get('dataType') != 'bool'][:40]
+    addresses = sorted(REGISTER_CONFIG['by_address'])[:20]
+    messages = []
+    for seq in range(count):
+        device = f"unit_{seq % devices}"
+        if seq % 3 == 0:
+            words = [random.randrange(0, 65536) for _ in addresses]
+            messages.append(encode_binary_payload(device, words, start_address=addresses[0],
+                                                  timestamp=1_700_000_000 + seq))
+        else:
+            data = {name: random.randrange(0, 1000) for name in names}
+            data.update(device_id=device, timestamp=f"2025-01-01T00:00:{seq % 60:02d}.{seq:06d}Z", seq=seq)
+            messages.append(json.dumps(data).encode('utf-8'))
+    return messages
+
+
+def run_pool(messages, **options):
+    """Submit `messages` (acks record their index); return (results, acks, pool stats)."""
+    results, acks = [], []
+    pool = DecodePool(lambda payload, row, ack: (results.append((payload, row)), ack()), **options)
+    pool.start()
+    try:
+        for i, message in enumerate(messages):
+            pool.submit(message, lambda i=i: acks.append(i))
+    finally:
+        pool.stop()
+    return results, acks, pool.stats()
+
+
+def test_order_and_results():
+    """Pool results equal in-process decoding and keep submission order."""
+    print("\n📦 Testing decode results and ordering...")
+    messages = make_messages(2000)
+    results, acks, stats = run_pool(messages, workers=3, batch_size=16)
+    expected = [transform_bulk(message) for message in messages]
+    by_device = {}
+    for payload, _ in results:
+        by_device.setdefault(payload['device_id'], []).append(payload['timestamp'])
+    in_order = all(stamps == [p['timestamp'] for p, _ in expected if p['device_id'] == device]
+                   for device, stamps in by_device.items())
+    print(f"   {len(results)} results in {stats['batches']} batches, per-device order kept: {in_order}")
+    print(f"   latency: {stats['latency']}")
+    ok = [(p['device_id'], p['timestamp'], row) for p, row in results] == \
+         [(p['device_id'], p['timestamp'], row) for p, row in expected]
+    ok &= in_order and acks == list(range(len(messages))) and stats['fallback_batches'] == 0
+    ok &= stats['decoded'] == len(messages) and stats['queue_depth'] == 0
+    return ok
+
+
+def test_invalid_messages():
+    """Undecodable messages are acknowledged and counted, in the workers and in-process; the others still arrive."""
+    print("\n🚫 Testing invalid messages...")
+    messages = make_messages(20)
+    messages[5] = b'{not json'
+    messages[12] = b'[1, 2, 3]'
+    messages[13] = b'\xb1\x00'  # Truncated binary frame
+    messages[17] = b'[' * 100000 + b']' * 100000  # Raises RecursionError, not ValueError
+    ok = True
+    for fallback in (False, True):
+        results, acks = [], []
+        pool = DecodePool(lambda payload, row, ack: (results.append(payload), ack()), workers=2, batch_size=4)
+        pool.start()
+        if fallback:
+            pool._executor.shutdown()  # Every batch is then decoded by the collector thread
+        try:
+            for i, message in enumerate(messages):
+                pool.submit(message, lambda i=i: acks.append(i))
+        finally:
+            pool.stop()
+        stats = pool.stats()
+        print(f"   {'in-process' if fallback else 'workers'}: decoded {stats['decoded']}, invalid {stats['invalid']}, "
+              f"acked {len(acks)}")
+        ok &= stats['invalid'] == 4 and len(results) == 16 and sorted(acks) == list(range(20))
+    return ok
+
+
+def test_delivery_failure():
+    """A batch that cannot be delivered is acknowledged and skipped; the collector goes on with the next ones."""
+    print("\n🧯 Testing a failing batch...")
+    messages = make_messages(40)
+    results, acks = [], []
+    pool = DecodePool(lambda payload, row, ack: (results.append(payload), ack()), workers=2, batch_size=8)
+    collect = pool._results
+    failed = []
+
+    def fail_first_batch(batch):
+        if not failed:
+            failed.append(batch)
+            raise OverflowError("simulated delivery failure")
+        return collect(batch)
+
+    pool._results = fail_first_batch
+    pool.start()
+    try:
+        for i, message in enumerate(messages):
+            pool.submit(message, lambda i=i: acks.append(i))
+    finally:
+        pool.stop()
+    stats = pool.stats()
+    print(f"   delivered {len(results)}, failed {stats['failed']}, acked {len(acks)}")
+    return len(results) == 32 and stats['failed'] == 8 and sorted(acks) == list(range(40)) and stats['queue_depth'] == 0
+
+
+def test_config_reload():
+    """After a reload the restarted workers decode binary frames with the new register map."""
+    print("\n🔄 Testing worker restart on config reload...")
+    path = os.path.join(tempfile.mkdtemp(), 'register_config.yaml')
+    shutil.copy(CONFIG_PATH, path)
+    with open(path, 'r', encoding='utf-8') as f:
+        data = yaml.safe_load(f)
+    data['registers'].append({'address': 960, 'name': 'Pool Reg', 'dataType': 'sint16'})
+    original_path = CONFIG_REGISTRY.path
+    results = []
+    pool = DecodePool(lambda payload, row, ack: results.append(payload), workers=2, batch_size=1)
+    CONFIG_REGISTRY.subscribe(pool.restart)
+    pool.start()
+    try:
+        frame = encode_binary_payload('unit_x', [0xFFFF], start_address=960, timestamp=1_700_000_000)
+        pool.submit(frame)
+        with open(path, 'w', encoding='utf-8') as f:
+            yaml.dump(data, f, sort_keys=False)
+        CONFIG_REGISTRY.path = path
+        CONFIG_REGISTRY.reload()
+        pool.submit(frame)
+    finally:
+        pool.stop()
+        CONFIG_REGISTRY._subscribers.pop()
+        CONFIG_REGISTRY.path = original_path
+        CONFIG_REGISTRY.reload()
+    print(f"   before reload: {results[0]['data']}, after: {results[1]['data']}, restarts: {pool.restarts}")
+    return 'Pool Reg' not in results[0]['data'] and results[1]['data'].get('Pool Reg') == -1 and pool.restarts == 1
+
+
+def test_worker_crash():
+    """A killed worker process breaks the pool; batches are decoded in-process, in order, and the pool restarts."""
+    print("\n💥 Testing worker crash fallback...")
+    messages = make_messages(400)
+    results = []
+    pool = DecodePool(lambda payload, row, ack: results.append(payload['timestamp']), workers=2, batch_size=8)
+    pool.start()
+    try:
+        for i, message in enumerate(messages):
+            pool.submit(message)
+            if i == 100:
+                time.sleep(0.5)  # Let the processes start, then kill one mid-stream
+                os.kill(next(iter(pool._executor._processes)), 9)
+    finally:
+        pool.stop()
+    stats = pool.stats()
+    expected = [transform_bulk(message)[0]['timestamp'] for message in messages]
+    print(f"   {len(results)} delivered, fallback batches {stats['fallback_batches']}, restarts {stats['restarts']}")
+    return results == expected and stats['fallback_batches'] >= 1 and stats['restarts'] >= 1
+
+
+def test_throughput():
+    """Messages per second in-process and through the pool (informational)."""
+    print("\n🏎️  Testing throughput...")
+    messages = make_messages(20000)
+    started = time.perf_counter()
+    for message in messages:
+        transform_bulk(message)
+    inline_rate = len(messages) / (time.perf_counter() - started)
+    workers = max(1, (os.cpu_count() or 2) - 1)
+    started = time.perf_counter()
+    results, _, stats = run_pool(messages, workers=workers)
+    pool_rate = len(messages) / (time.perf_counter() - started)
+    print(f"   in-process: {inline_rate:,.0f} msg/s; pool of {workers}: {pool_rate:,.0f} msg/s "
+          f"(including process start-up)")
+    return len(results) == len(messages)
+
+
+def main():
+    tests = [
+        ("Results And Ordering", test_order_and_results),
+        ("Invalid Messages", test_invalid_messages),
+        ("Failing Batch", test_delivery_failure),
+        ("Config Reload", test_config_reload),
+        ("Worker Crash", test_worker_crash),
+        ("Throughput", test_throughput),
+    ]
+    results = []
+    for test_name, test_func in tests:
+        print(f"\n{'='*20} {test_name} {'='*20}")
+        results.append((test_name, test_func()))
+
+    print("\n" + "="*60)
+    print("📊 Test Results Summary")
+    print("="*60)
+    for test_name, result in results:
+        print(f"{test_name:<25} {'✅ PASS' if result else '❌ FAIL'}")
+    print("="*60)
+    sys.exit(0 if all(result for _, result in results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Test script for the ingestion leader election (api/leader.py) and the live
+state shared with the other workers (api/shared_state.py)
+
+Runs worker stand-ins as subprocesses competing for a temporary lock file,
+checks that exactly one is elected and that another takes over when it
+exits, then checks that a follower's live cache and SSE broker mirror the
+leader's and that every process spools into its own slot. The PostgreSQL
+advisory lock is checked when the database in .env is reachable. No broker
+is needed.
+
+Usage:
+    python test_leader.py
+"""
+
+import os
+import sys
+import time
+import tempfile
+import subprocess
+
+from api.leader import IngestionLeader, FileLeaderLock, PostgresLeaderLock
+from api.live_cache import LatestValueCache
+from api.live_stream import LiveStreamBroker
+from api.shared_state import SharedLiveState
+from api.spool import Spool
+
+# A worker stand-in: prints 'elected' once it leads, then runs until killed
+WORKER = """
+import sys, time
+from api.leader import IngestionLeader, FileLeaderLock
+leader = IngestionLeader(lambda: print('elected', flush=True), lock=FileLeaderLock(sys.argv[1]), retry_interval=0.1)
+leader.start()
+while True:
+    time.sleep(1)
+"""
+
+
+def start_workers(lock_path, count):
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    return [subprocess.Popen([sys.executable, '-c', WORKER, lock_path], stdout=subprocess.PIPE, text=True, env=env)
+            for _ in range(count)]
+
+
+def wait_elected(workers, timeout=10.0):
+    """Index of the first worker that prints 'elected' within `timeout`, else None."""
+    for worker in workers:
+        os.set_blocking(worker.stdout.fileno(), False)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        for i, worker in enumerate(workers):
+            line = worker.stdout.readline()
+            if line.strip() == 'elected':
+                return i
+        time.sleep(0.05)
+    return None
+
+
+def test_single_leader():
+    """Of several worker processes exactly one is elected; another takes over when it exits."""
+    print("\n👑 Testing election across worker processes...")
+    lock_path = os.path.join(tempfile.mkdtemp(), 'leader.lock')
+    workers = start_workers(lock_path, 4)
+    try:
+        first = wait_elected(workers)
+        time.sleep(0.5)  # Several retry intervals: nobody else may be elected meanwhile
+        others = wait_elected([w for i, w in enumerate(workers) if i != first], timeout=0.1)
+        print(f"   first leader: worker {first} (pid {workers[first].pid}), second leader meanwhile: {others}")
+        workers[first].kill()
+        workers[first].wait()
+        remaining = [w for i, w in enumerate(workers) if i != first]
+        started = time.monotonic()
+        second = wait_elected(remaining)
+        print(f"   after killing it: worker pid {remaining[second].pid if second is not None else None} "
+              f"took over in {time.monotonic() - started:.2f} s")
+        return first is not None and others is None and second is not None
+    finally:
+        for worker in workers:
+            worker.kill()
+            worker.wait()
+
+
+def test_in_process_takeover():
+    """IngestionLeader retries in the background and calls on_elected once the lock is free."""
+    print("\n🔁 Testing background retry...")
+    lock_path = os.path.join(tempfile.mkdtemp(), 'leader.lock')
+    holder = FileLeaderLock(lock_path)
+    holder.try_acquire()
+    elected = []
+    leader = IngestionLeader(lambda: elected.append(time.monotonic()), lock=FileLeaderLock(lock_path),
+                             retry_interval=0.1)
+    try:
+        won_at_start = leader.start()
+        time.sleep(0.3)
+        before_release = list(elected)
+        holder.release()
+        time.sleep(0.5)
+        print(f"   elected at start: {won_at_start}, before release: {len(before_release)}, after: {len(elected)}, "
+              f"stats: {leader.stats()}")
+        return not won_at_start and not before_release and len(elected) == 1 and leader.is_leader
+    finally:
+        leader.stop()
+
+
+def test_postgres_lock():
+    """Only one session holds the advisory lock; it is free again once that session ends."""
+    print("\n🐘 Testing PostgreSQL advisory lock...")
+    first, second = PostgresLeaderLock(key=7321999), PostgresLeaderLock(key=7321999)
+    try:
+        if not first.try_acquire():
+            print("   ⏭️  PostgreSQL not reachable, skipped")
+            return True
+        taken = second.try_acquire()
+        held = first.is_held()
+        first.release()
+        after_release = second.try_acquire()
+        print(f"   second while held: {taken}, first still held: {held}, second after release: {after_release}")
+        return not taken and held and after_release
+    finally:
+        first.release()
+        second.release()
+
+
+def test_shared_state():
+    """A follower's cache and SSE broker mirror the leader's; the leader's latest device stays the default."""
+    print("\n🪞 Testing shared live state...")
+    path = os.path.join(tempfile.mkdtemp(), 'live_state.json')
+    leader_cache, follower_cache = LatestValueCache(), LatestValueCache()
+    broker = LiveStreamBroker()
+    client = broker.subscribe()
+    publisher = SharedLiveState(leader_cache, LiveStreamBroker(), path=path, stats_interval=60)
+    publisher._stats = lambda: {'queue': {'depth': 3}}
+    follower = SharedLiveState(follower_cache, broker, path=path)
+
+    leader_cache.update({'device_id': 'unit_1', 'timestamp': '2025-01-01T00:00:00Z', 'Voltage': 10})
+    leader_cache.update({'device_id': 'unit_2', 'timestamp': '2025-01-01T00:00:00Z', 'Voltage': 20})
+    wrote = publisher.publish_once()
+    unchanged = publisher.publish_once()  # Nothing new: no write
+    restored = follower.follow_once()
+    again = follower.follow_once()  # File unchanged: nothing restored
+    time.sleep(0.01)
+    leader_cache.update({'device_id': 'unit_1', 'timestamp': '2025-01-01T00:00:01Z', 'Voltage': 11})
+    publisher.publish_once()
+    restored_update = follower.follow_once()
+
+    events = []
+    while not client.empty():
+        events.append(client.get_nowait())
+    print(f"   wrote: {wrote}/{unchanged}, restored: {restored}, {again}, {restored_update}, "
+          f"SSE events: {len(events)}, leader stats: {follower.leader_stats}")
+    ok = wrote and not unchanged and restored == 2 and again == 0 and restored_update == 1
+    ok &= follower_cache.get('unit_1') == leader_cache.get('unit_1')
+    ok &= follower_cache.get()['device_id'] == 'unit_1' and follower_cache.get('unit_2')['Voltage'] == 20
+    ok &= len(events) == 3 and follower.leader_stats == {'queue': {'depth': 3}}
+    return ok
+
+
+def test_spool_slots():
+    """Each spool claims its own slot of SPOOL_DIR; a freed slot is taken over together with its backlog."""
+    print("\n🗃️  Testing per-process spool slots...")
+    base = tempfile.mkdtemp()
+    columns = ('timestamp', 'device_id', 'raw_data')
+    # flock locks of separate opens conflict within one process too, so these behave like three workers
+    spools = [Spool(base=base) for _ in range(3)]
+    successor = None
+    try:
+        for i, spool in enumerate(spools):
+            spool.append([(f"2025-01-01T00:00:0{i}Z", f"unit_{i}", '{}')], columns)
+        spools[1].close()  # Its process exits with one row spooled
+        successor = Spool(base=base)
+        print(f"   slots {[spool.slot for spool in spools]} in {[os.path.relpath(spool.directory, base) for spool in spools]}, "
+              f"successor slot {successor.slot} with {successor.backlog_rows()} row(s)")
+        ok = [spool.slot for spool in spools] == [0, 1, 2] and len({spool.directory for spool in spools}) == 3
+        ok &= successor.slot == 1 and successor.directory == spools[1].directory and successor.backlog_rows() == 1
+        ok &= spools[0].seal() == [1] and spools[2].seal() == [1] and spools[0].backlog_rows() == 1
+        return ok
+    finally:
+        for spool in spools + [successor]:
+            if spool is not None:
+                spool.close()
+
+
+def main():
+    tests = [
+        ("Single Leader", test_single_leader),
+        ("Background Retry", test_in_process_takeover),
+        ("PostgreSQL Lock", test_postgres_lock),
+        ("Shared Live State", test_shared_state),
+        ("Spool Slots", test_spool_slots),
+    ]
+    results = []
+    for test_name, test_func in tests:
+        print(f"\n{'='*20} {test_name} {'='*20}")
+        results.append((test_name, test_func()))
+
+    print("\n" + "="*60)
+    print("📊 Test Results Summary")
+    print("="*60)
+    for test_name, result in results:
+        print(f"{test_name:<25} {'✅ PASS' if result else '❌ FAIL'}")
+    print("="*60)
+    sys.exit(0 if all(result for _, result in results) else 1)
+
+
+if __name__ == "__main__":
+    main()
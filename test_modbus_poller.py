@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Test script for the built-in Modbus TCP poller (api/modbus_poller.py)
+
+Starts local Modbus TCP server stand-ins that serve the registers of
+register_config.yaml, then checks the block-read plan, one poll, exception
+responses, a single scheduled unit and the multi-unit asyncio scheduler
+against them. No PLC or database is needed.
+
+Usage:
+    python test_modbus_poller.py
+    python test_modbus_poller.py --device 192.168.0.194 [port]   # also poll a real device once
+"""
+
+import sys
+import time
+import asyncio
+import struct
+import socketserver
+import threading
+
+from api.config_loader import REGISTER_CONFIG
+from api.modbus_poller import (ModbusUnit, ModbusScheduler, build_units, plan_block_reads, ModbusError,
+                               MAX_REGISTERS_PER_READ)
+
+
+class ModbusStandInServer(socketserver.ThreadingTCPServer):
+    """Serves function codes 3/4 from a {address: word} dict; other addresses return exception 2."""
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, registers, delay=0.0):
+        self.registers = registers
+        self.delay = delay  # Seconds before each reply, to simulate a slow device
+        self.requests = 0
+        super().__init__(('127.0.0.1', 0), _StandInHandler)
+
+
+class _StandInHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        while True:
+            header = self._recv(7)
+            if not header:
+                return
+            tid, protocol, length, unit = struct.unpack('>HHHB', header)
+            pdu = self._recv(length - 1)
+            function, start, count = struct.unpack('>BHH', pdu)
+            self.server.requests += 1
+            if self.server.delay:
+                time.sleep(self.server.delay)
+            addresses = range(start, start + count)
+            if function not in (3, 4) or count > 125 or any(a not in self.server.registers for a in addresses):
+                reply = struct.pack('>BB', function | 0x80, 2)
+            else:
+                words = [self.server.registers[a] for a in addresses]
+                reply = struct.pack(f'>BB{count}H', function, 2 * count, *words)
+            self.request.sendall(struct.pack('>HHHB', tid, protocol, len(reply) + 1, unit) + reply)
+
+    def _recv(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+
+def start_stand_in(registers, delay=0.0):
+    server = ModbusStandInServer(registers, delay)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def poll_unit_once(unit):
+    """Run one poll of `unit` on a fresh event loop, closing its connection on that loop."""
+    async def poll():
+        try:
+            return await unit.poll_once()
+        finally:
+            unit.client.close()
+    return asyncio.run(poll())
+
+
+def test_block_plan():
+    """The plan covers every configured address within the Modbus request limit."""
+    print("\n🧮 Testing block read plan...")
+    addresses = list(REGISTER_CONFIG['by_address'])
+    blocks = plan_block_reads(addresses)
+    covered = {a for start, count in blocks for a in range(start, start + count)}
+    print(f"   {len(addresses)} registers -> {len(blocks)} reads: {blocks}")
+    ok = set(addresses) <= covered and all(count <= MAX_REGISTERS_PER_READ for _, count in blocks)
+    ok &= plan_block_reads([0, 1, 2, 10, 200], max_gap=8) == [(0, 11), (200, 1)]
+    ok &= plan_block_reads(range(300), max_gap=0) == [(0, 125), (125, 125), (250, 50)]
+    return ok
+
+
+def test_single_poll():
+    """One poll against the stand-in returns every configured register, sign-converted."""
+    print("\n📡 Testing one poll against the Modbus stand-in...")
+    registers = {a: (a * 3) & 0xFFFF for a in range(0, max(REGISTER_CONFIG['by_address']) + 200)}
+    signed = [a for a, reg in REGISTER_CONFIG['by_address'].items() if reg.get('dataType') == 'sint16']
+    if signed:
+        registers[signed[0]] = 0xFFFE  # -2
+    server = start_stand_in(registers)
+    try:
+        unit = ModbusUnit('stand_in', '127.0.0.1', server.server_address[1])
+        sample = poll_unit_once(unit)
+        names = {reg['name'] for reg in REGISTER_CONFIG['by_address'].values()}
+        print(f"   {len(sample['data'])} registers in {server.requests} requests, {unit.last_latency_ms:.1f} ms")
+        ok = set(sample['data']) == names and server.requests == len(unit.blocks)
+        ok &= sample['device_id'] == 'stand_in'
+        if signed:
+            ok &= sample['data'][REGISTER_CONFIG['by_address'][signed[0]]['name']] == -2
+        return ok
+    finally:
+        server.shutdown()
+
+
+def test_exception_response():
+    """A Modbus exception response raises ModbusError."""
+    print("\n⚠️  Testing exception responses...")
+    server = start_stand_in({})
+    try:
+        unit = ModbusUnit('stand_in', '127.0.0.1', server.server_address[1], addresses=[0])
+        try:
+            poll_unit_once(unit)
+        except ModbusError as e:
+            print(f"   Raised as expected: {e}")
+            return True
+        return False
+    finally:
+        server.shutdown()
+
+
+def test_unit_interval():
+    """A scheduled unit delivers samples at its configured interval."""
+    print("\n⏱️  Testing one scheduled unit...")
+    server = start_stand_in({a: 1 for a in range(0, max(REGISTER_CONFIG['by_address']) + 200)})
+    samples = []
+    unit = ModbusUnit('stand_in', '127.0.0.1', server.server_address[1], interval=0.2)
+    scheduler = ModbusScheduler(samples.append, [unit])
+    try:
+        scheduler.start()
+        time.sleep(1.1)
+    finally:
+        scheduler.stop()
+        server.shutdown()
+    print(f"   {len(samples)} samples in 1.1 s, stats: {unit.stats()}")
+    return 4 <= len(samples) <= 7 and unit.failures == 0 and unit.missed_deadlines == 0
+
+
+def test_build_units():
+    """Units come from modbus.units, with register subsets; invalid entries raise ValueError."""
+    print("\n🗂️  Testing unit configuration...")
+    first_group = next(iter(REGISTER_CONFIG['by_group']))
+    config = dict(REGISTER_CONFIG, modbus_units=[
+        {'name': 'battery_1', 'ip': '10.0.0.1', 'interval': 0.5, 'registers': [0, REGISTER_CONFIG['raw'][-1]['name']]},
+        {'name': 'battery_2', 'ip': '10.0.0.2', 'unit_id': 2, 'groups': [first_group]},
+        {'ip': '10.0.0.3'},
+    ])
+    units = build_units(config)
+    for unit in units:
+        print(f"   {unit.name}: {unit.blocks} every {unit.interval}s")
+    ok = [unit.name for unit in units] == ['battery_1', 'battery_2', '10.0.0.3/1']
+    ok &= len(units[0].blocks) == 2 and units[0].interval == 0.5
+    ok &= units[1].client.unit_id == 2 and units[2].blocks == plan_block_reads(REGISTER_CONFIG['by_address'])
+    for bad in ([{'name': 'x'}], [{'ip': '10.0.0.1', 'registers': ['No Such Register']}],
+                [{'name': 'a', 'ip': '10.0.0.1'}, {'name': 'a', 'ip': '10.0.0.2'}]):
+        try:
+            build_units(dict(REGISTER_CONFIG, modbus_units=bad))
+            ok = False
+        except ValueError as e:
+            print(f"   Rejected as expected: {e}")
+    return ok
+
+
+def test_scheduler():
+    """Many units poll concurrently from one thread; per-unit failures and missed deadlines are counted."""
+    print("\n🗓️  Testing multi-unit asyncio scheduler...")
+    registers = {a: 1 for a in range(0, max(REGISTER_CONFIG['by_address']) + 200)}
+    fast = start_stand_in(registers)
+    slow = start_stand_in(registers, delay=0.15)  # 3 reads per poll -> ~0.45 s, longer than its 0.2 s interval
+    units = [{'name': f'unit_{i}', 'ip': '127.0.0.1', 'port': fast.server_address[1], 'interval': 0.2, 'registers': [0, 1]}
+             for i in range(30)]
+    units.append({'name': 'slow', 'ip': '127.0.0.1', 'port': slow.server_address[1], 'interval': 0.2, 'timeout': 1.0})
+    units.append({'name': 'down', 'ip': '127.0.0.1', 'port': 1, 'interval': 0.2, 'timeout': 0.1})
+    samples = []
+
+    def client_threads():  # Threads outside the stand-in servers
+        return sum(1 for t in threading.enumerate() if 'process_request' not in t.name)
+
+    threads_before = client_threads()
+    scheduler = ModbusScheduler(samples.append, build_units(dict(REGISTER_CONFIG, modbus_units=units)))
+    try:
+        scheduler.start()
+        time.sleep(1.5)
+        extra_threads = client_threads() - threads_before
+    finally:
+        scheduler.stop()
+        fast.shutdown()
+        slow.shutdown()
+    stats = {unit['name']: unit for unit in scheduler.stats()['units']}
+    fast_polls = [stats[f'unit_{i}']['polls'] for i in range(30)]
+    print(f"   {len(samples)} samples, polls per fast unit {min(fast_polls)}-{max(fast_polls)}, "
+          f"scheduler threads: {extra_threads}")
+    print(f"   slow: {stats['slow']['polls']} polls, {stats['slow']['missed_deadlines']} missed deadlines, "
+          f"avg {stats['slow']['avg_latency_ms']} ms; down: {stats['down']['failures']} failures")
+    ok = min(fast_polls) >= 4 and all(stats[f'unit_{i}']['missed_deadlines'] == 0 for i in range(30))
+    ok &= stats['slow']['polls'] >= 1 and stats['slow']['missed_deadlines'] >= 1
+    ok &= stats['down']['polls'] == 0 and stats['down']['failures'] >= 1
+    ok &= extra_threads == 1 and {sample['device_id'] for sample in samples} >= {'unit_0', 'slow'}
+    return ok
+
+
+def poll_real_device(host, port):
+    unit = ModbusUnit(f"modbus_{host}", host, port)
+    print(f"\n🔌 Polling {host}:{port} ({len(unit.blocks)} reads)...")
+    try:
+        sample = poll_unit_once(unit)
+        print(f"   {len(sample['data'])} registers in {unit.last_latency_ms:.1f} ms")
+        return True
+    except (OSError, ModbusError, asyncio.TimeoutError) as e:
+        print(f"   ❌ {e or type(e).__name__}")
+        return False
+
+
+def main():
+    tests = [
+        ("Block Read Plan", test_block_plan),
+        ("Single Poll", test_single_poll),
+        ("Exception Response", test_exception_response),
+        ("Unit Interval", test_unit_interval),
+        ("Unit Configuration", test_build_units),
+        ("Asyncio Scheduler", test_scheduler),
+    ]
+    if '--device' in sys.argv:
+        args = sys.argv[sys.argv.index('--device') + 1:]
+        host = args[0] if args else REGISTER_CONFIG['modbus_ip']
+        port = int(args[1]) if len(args) > 1 else int(REGISTER_CONFIG['modbus_port'] or 502)
+        tests.append(("Real Device", lambda: poll_real_device(host, port)))
+
+    results = []
+    for test_name, test_func in tests:
+        print(f"\n{'='*20} {test_name} {'='*20}")
+        results.append((test_name, test_func()))
+
+    print("\n" + "="*60)
+    print("📊 Test Results Summary")
+    print("="*60)
+    for test_name, result in results:
+        print(f"{test_name:<25} {'✅ PASS' if result else '❌ FAIL'}")
+    print("="*60)
+    sys.exit(0 if all(result for _, result in results) else 1)
+
+
+if __name__ == "__main__":
+    main()
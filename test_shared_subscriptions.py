@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+"""
+Test script for the MQTT shared-subscription scale-out (MQTT_SUBSCRIBER_WORKERS
+in app.py) and the device-keyed writer partitions (api/batch_writer.py)
+
+Starts a minimal MQTT 3.1.1 broker stand-in that load-balances
+$share/<group>/... subscriptions round-robin (like mosquitto), runs three
+subscriber workers of app.py against it and checks that every bulk message is
+ingested and acknowledged exactly once, spread over the workers, even when
+worker 0 resumes a session that still holds a plain bulk subscription. The
+writer partitions, and a row PostgreSQL rejects inside a partition's batch,
+are checked against the PostgreSQL database in .env when it is reachable.
+
+Usage:
+    python test_shared_subscriptions.py
+    python test_shared_subscriptions.py --broker localhost[:1883]   # use a real broker (mosquitto >= 1.6)
+"""
+
+import os
+import sys
+import json
+import time
+import struct
+import socketserver
+import threading
+
+os.environ.setdefault('MQTT_SUBSCRIBER_WORKERS', '3')
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+import paho.mqtt.client as mqtt
+
+import app
+from api.batch_writer import PartitionedBatchWriter
+from api.db_pool import get_connection
+
+
+def _topic_matches(topic_filter, topic):
+    levels, parts = topic_filter.split('/'), topic.split('/')
+    for i, level in enumerate(levels):
+        if level == '#':
+            return True
+        if i >= len(parts) or (level != '+' and level != parts[i]):
+            return False
+    return len(levels) == len(parts)
+
+
+def _encode_length(length):
+    encoded = bytearray()
+    while True:
+        byte, length = length % 128, length // 128
+        encoded.append(byte | (0x80 if length else 0))
+        if not length:
+            return bytes(encoded)
+
+
+def _string(data, offset):
+    size = struct.unpack_from('>H', data, offset)[0]
+    return data[offset + 2:offset + 2 + size].decode('utf-8'), offset + 2 + size
+
+
+class MQTTStandInBroker(socketserver.ThreadingTCPServer):
+    """QoS 0/1 broker with plain and $share/<group>/<filter> subscriptions (round-robin within a group).
+
+    `sessions` maps client ids to topic filters left subscribed by an earlier
+    connection; that client's CONNACK reports a present session.
+    """
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, sessions=None):
+        self.lock = threading.Lock()
+        self.sessions = dict(sessions or {})
+        self.unsubscribed = []  # (client id, topic filter)
+        self.subscriptions = []  # (session, topic filter, qos)
+        self.groups = {}  # (group, topic filter) -> {'members': [(session, qos)], 'next': int}
+        self.unacked = {}  # (client id, packet id) -> topic
+        self.delivered = {}  # client id -> messages delivered
+        super().__init__(('127.0.0.1', 0), _BrokerSession)
+
+    def subscribe(self, session, topic_filter, qos):
+        with self.lock:
+            if topic_filter.startswith('$share/'):
+                _, group, shared_filter = topic_filter.split('/', 2)
+                entry = self.groups.setdefault((group, shared_filter), {'members': [], 'next': 0})
+                entry['members'].append((session, qos))
+            else:
+                self.subscriptions.append((session, topic_filter, qos))
+
+    def unsubscribe(self, session, topic_filter):
+        with self.lock:
+            self.unsubscribed.append((session.client_id, topic_filter))
+            if topic_filter.startswith('$share/'):
+                _, group, shared_filter = topic_filter.split('/', 2)
+                entry = self.groups.get((group, shared_filter), {'members': []})
+                entry['members'] = [member for member in entry['members'] if member[0] is not session]
+            else:
+                self.subscriptions = [sub for sub in self.subscriptions
+                                      if sub[0] is not session or sub[1] != topic_filter]
+
+    def unsubscribe_all(self, session):
+        with self.lock:
+            self.subscriptions = [sub for sub in self.subscriptions if sub[0] is not session]
+            for entry in self.groups.values():
+                entry['members'] = [member for member in entry['members'] if member[0] is not session]
+
+    def route(self, topic, payload, qos):
+        targets = []
+        with self.lock:
+            targets += [(session, min(qos, sub_qos)) for session, topic_filter, sub_qos in self.subscriptions
+                        if _topic_matches(topic_filter, topic)]
+            for (group, topic_filter), entry in self.groups.items():
+                if entry['members'] and _topic_matches(topic_filter, topic):
+                    session, sub_qos = entry['members'][entry['next'] % len(entry['members'])]
+                    entry['next'] += 1
+                    targets.append((session, min(qos, sub_qos)))
+        for session, delivery_qos in targets:
+            session.deliver(topic, payload, delivery_qos)
+
+
+class _BrokerSession(socketserver.BaseRequestHandler):
+    def setup(self):
+        self.client_id = None
+        self.send_lock = threading.Lock()
+        self.next_packet_id = 0
+
+    def send(self, data):
+        with self.send_lock:
+            self.request.sendall(data)
+
+    def deliver(self, topic, payload, qos):
+        encoded_topic = topic.encode('utf-8')
+        body = struct.pack('>H', len(encoded_topic)) + encoded_topic
+        if qos:
+            with self.server.lock:
+                self.next_packet_id = self.next_packet_id % 65535 + 1
+                packet_id = self.next_packet_id
+                self.server.unacked[(self.client_id, packet_id)] = topic
+            body += struct.pack('>H', packet_id)
+        with self.server.lock:
+            self.server.delivered[self.client_id] = self.server.delivered.get(self.client_id, 0) + 1
+        body += payload
+        self.send(bytes([0x30 | (qos << 1)]) + _encode_length(len(body)) + body)
+
+    def handle(self):
+        try:
+            while True:
+                header = self._recv(1)
+                if header is None:
+                    return
+                length, multiplier = 0, 1
+                while True:
+                    byte = self._recv(1)[0]
+                    length += (byte & 0x7F) * multiplier
+                    multiplier *= 128
+                    if not byte & 0x80:
+                        break
+                body = self._recv(length) if length else b''
+                packet_type, flags = header[0] >> 4, header[0] & 0x0F
+                if packet_type == 1:  # CONNECT: protocol name, level, flags, keepalive, client id
+                    _, offset = _string(body, 0)
+                    self.client_id, _ = _string(body, offset + 4)
+                    with self.server.lock:
+                        resumed = self.server.sessions.pop(self.client_id, [])
+                    for topic_filter in resumed:
+                        self.server.subscribe(self, topic_filter, 1)
+                    self.send(b'\x20\x02' + bytes([1 if resumed else 0, 0]))
+                elif packet_type == 8:  # SUBSCRIBE
+                    packet_id, offset, granted = struct.unpack_from('>H', body)[0], 2, []
+                    while offset < len(body):
+                        topic_filter, offset = _string(body, offset)
+                        qos = min(body[offset], 1)
+                        offset += 1
+                        self.server.subscribe(self, topic_filter, qos)
+                        granted.append(qos)
+                    self.send(bytes([0x90, 2 + len(granted)]) + struct.pack('>H', packet_id) + bytes(granted))
+                elif packet_type == 10:  # UNSUBSCRIBE
+                    packet_id, offset = struct.unpack_from('>H', body)[0], 2
+                    while offset < len(body):
+                        topic_filter, offset = _string(body, offset)
+                        self.server.unsubscribe(self, topic_filter)
+                    self.send(b'\xb0\x02' + struct.pack('>H', packet_id))
+                elif packet_type == 3:  # PUBLISH
+                    qos = (flags >> 1) & 0x03
+                    topic, offset = _string(body, 0)
+                    if qos:
+                        packet_id = struct.unpack_from('>H', body, offset)[0]
+                        offset += 2
+                    self.server.route(topic, body[offset:], min(qos, 1))
+                    if qos:
+                        self.send(b'\x40\x02' + struct.pack('>H', packet_id))
+                elif packet_type == 4:  # PUBACK
+                    with self.server.lock:
+                        self.server.unacked.pop((self.client_id, struct.unpack('>H', body)[0]), None)
+                elif packet_type == 12:  # PINGREQ
+                    self.send(b'\xd0\x00')
+                elif packet_type == 14:  # DISCONNECT
+                    return
+        except OSError:
+            return
+        finally:
+            self.server.unsubscribe_all(self)
+
+    def _recv(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+
+def start_broker(sessions=None):
+    broker = MQTTStandInBroker(sessions)
+    threading.Thread(target=broker.serve_forever, daemon=True).start()
+    return broker
+
+
+def test_subscriptions():
+    """Every worker joins the shared bulk subscription; only worker 0 takes the per-sensor and status topics."""
+    print("\n🧾 Testing subscription plan...")
+    plan = {app.mqtt_client_id(worker): app.mqtt_subscriptions(worker) for worker in range(app.MQTT_SUBSCRIBER_WORKERS)}
+    for client_id, topics in plan.items():
+        print(f"   {client_id}: {topics}")
+    bulk = f"$share/{app.MQTT_SHARED_GROUP}/{app.MQTT_BASE_TOPIC}/data/bulk"
+    ok = app.MQTT_SUBSCRIBER_WORKERS == 3 and all(bulk in topics for topics in plan.values())
+    ok &= len(plan[app.MQTT_CLIENT_ID]) == 3 and all(len(topics) == 1 for topics in list(plan.values())[1:])
+    ok &= app.mqtt_stale_subscriptions(0) == [f"{app.MQTT_BASE_TOPIC}/data/bulk"]
+    return ok
+
+
+def test_shared_delivery(host=None, port=None):
+    """Bulk messages are load-balanced over the workers and each is ingested and acknowledged exactly once."""
+    print("\n📬 Testing shared-subscription delivery...")
+    broker = None
+    bulk_topic = f"{app.MQTT_BASE_TOPIC}/data/bulk"
+    if host is None:
+        # Worker 0 resumes a session from a run without shared subscriptions
+        broker = start_broker(sessions={app.MQTT_CLIENT_ID: [bulk_topic]})
+        host, port = '127.0.0.1', broker.server_address[1]
+    os.environ['MQTT_BROKER_HOST'], os.environ['MQTT_BROKER_PORT'] = host, str(port)
+
+    ingested = []
+    ingested_lock = threading.Lock()
+
+    def record(payload, ack=None):
+        with ingested_lock:
+            ingested.append((payload['device_id'], payload['data']['seq'], threading.current_thread().name))
+        if ack:
+            ack()
+
+    app.ingest_live_data = record  # Stands in for the cache/database path; acks like the batch writer
+    app.ingestion_queue.start()
+    for worker in range(app.MQTT_SUBSCRIBER_WORKERS):
+        threading.Thread(target=app.run_minimal_mqtt_thread, args=(worker,), daemon=True).start()
+    time.sleep(1.0)  # Connect and subscribe
+
+    publisher = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1, client_id=f"test_publisher_{os.getpid()}")
+    publisher.connect(host, port)
+    publisher.loop_start()
+    sent = 300
+    for seq in range(sent):
+        sample = {'device_id': f"unit_{seq % 6}", 'timestamp': f"2025-01-01T00:{seq // 60:02d}:{seq % 60:02d}Z", 'seq': seq}
+        publisher.publish(f"{app.MQTT_BASE_TOPIC}/data/bulk", json.dumps(sample), qos=1).wait_for_publish(5)
+    deadline = time.monotonic() + 10
+    while len(ingested) < sent and time.monotonic() < deadline:
+        time.sleep(0.05)
+    time.sleep(0.3)  # Late duplicates would show up here
+    publisher.loop_stop()
+    publisher.disconnect()
+
+    per_worker = list(app.mqtt_worker_message_counts)
+    seqs = sorted(seq for _, seq, _ in ingested)
+    threads = {name for _, _, name in ingested}
+    print(f"   {len(ingested)}/{sent} ingested, per worker {per_worker}, ingestion threads: {sorted(threads)}")
+    ok = seqs == list(range(sent)) and all(count > 0 for count in per_worker)
+    ok &= len(threads) == app.MQTT_SUBSCRIBER_WORKERS
+    if broker:
+        time.sleep(0.2)
+        print(f"   broker: delivered {broker.delivered}, unacknowledged {len(broker.unacked)}, "
+              f"unsubscribed {broker.unsubscribed}")
+        ok &= not broker.unacked and broker.unsubscribed == [(app.MQTT_CLIENT_ID, bulk_topic)]
+        broker.shutdown()
+    return ok
+
+
+def test_writer_partitions():
+    """Each device's rows are written by one partition; the schema hook runs once for all partitions."""
+    print("\n🗄️  Testing device-keyed writer partitions...")
+    conn = get_connection()
+    if not conn:
+        print("   ⏭️  PostgreSQL not reachable, skipped")
+        return True
+    table = f"test_writer_partitions_{os.getpid()}"
+    prepared = []
+
+    def prepare(cursor):
+        prepared.append(threading.current_thread().name)
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {table} (timestamp TIMESTAMPTZ, device_id TEXT, raw_data JSONB, "
+                       f"UNIQUE (device_id, timestamp));")
+
+    writer = PartitionedBatchWriter(4, get_connection, table, prepare=prepare, batch_size=50, flush_interval=0.1)
+    try:
+        def produce(thread_index):
+            for i in range(100):
+                device = f"unit_{(thread_index * 100 + i) % 12}"
+                writer.add(("2025-01-01T00:00:00Z", device, json.dumps({'i': i})), None)
+                writer.add((f"2025-01-02T{i // 60:02d}:{i % 60:02d}:{thread_index:02d}Z", device, '{}'), None)
+
+        threads = [threading.Thread(target=produce, args=(t,)) for t in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        writer.stop()
+        stats = writer.stats()
+        with conn.cursor() as cursor:
+            cursor.execute(f"SELECT device_id, count(*) FROM {table} GROUP BY device_id;")
+            per_device = dict(cursor.fetchall())
+        print(f"   prepare ran in {prepared}, rows {stats['rows_written']} written / {stats['rows_duplicate']} duplicates, "
+              f"per partition {[p['rows_written'] for p in stats['partitions']]}")
+        ok = len(prepared) == 1 and stats['rows_written'] == sum(per_device.values()) == 400 + len(per_device)
+        ok &= stats['rows_duplicate'] == 400 - len(per_device) and stats['rows_failed'] == 0
+        ok &= all(stats['partitions'][p]['rows_written'] ==
+                  sum(count for device, count in per_device.items() if writer.partition_for(device) == p)
+                  for p in range(4))
+        return ok
+    finally:
+        writer.stop()
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {table};")
+        conn.commit()
+        conn.close()
+
+
+def test_rejected_row():
+    """A row PostgreSQL rejects loses only itself: the other devices' rows in its batch are stored, all are acked."""
+    print("\n🧪 Testing a rejected row in a partition batch...")
+    conn = get_connection()
+    if not conn:
+        print("   ⏭️  PostgreSQL not reachable, skipped")
+        return True
+    table = f"test_rejected_row_{os.getpid()}"
+    with conn.cursor() as cursor:
+        cursor.execute(f"CREATE TABLE {table} (timestamp TIMESTAMPTZ, device_id TEXT, raw_data JSONB, "
+                       f"UNIQUE (device_id, timestamp));")
+    conn.commit()
+    writer = PartitionedBatchWriter(2, get_connection, table, batch_size=100, flush_interval=0.1)
+    acks = []
+    try:
+        devices = [f"unit_{i}" for i in range(8)]
+        for i, device in enumerate(devices):
+            writer.add((f"2025-01-01T00:00:0{i}Z", device, '{}'), lambda i=i: acks.append(i))
+        bad_device = devices[0]
+        writer.add(("not a timestamp", bad_device, '{}'), lambda: acks.append('bad'))
+        writer.stop()
+        stats = writer.stats()
+        with conn.cursor() as cursor:
+            cursor.execute(f"SELECT count(*) FROM {table};")
+            stored = cursor.fetchone()[0]
+        same_partition = sum(1 for device in devices if writer.partition_for(device) == writer.partition_for(bad_device))
+        print(f"   stored {stored}/{len(devices)} good rows ({same_partition} shared the bad row's partition), "
+              f"failed {stats['rows_failed']}, acked {len(acks)}")
+        return stored == len(devices) and stats['rows_failed'] == 1 and len(acks) == len(devices) + 1
+    finally:
+        writer.stop()
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {table};")
+        conn.commit()
+        conn.close()
+
+
+def main():
+    broker_host, broker_port = None, None
+    if '--broker' in sys.argv:
+        args = sys.argv[sys.argv.index('--broker') + 1:]
+        address = args[0] if args else 'localhost'
+        broker_host, _, port = address.partition(':')
+        broker_port = int(port or 1883)
+    tests = [
+        ("Subscription Plan", test_subscriptions),
+        ("Shared Delivery", lambda: test_shared_delivery(broker_host, broker_port)),
+        ("Writer Partitions", test_writer_partitions),
+        ("Rejected Row", test_rejected_row),
+    ]
+    results = []
+    for test_name, test_func in tests:
+        print(f"\n{'='*20} {test_name} {'='*20}")
+        results.append((test_name, test_func()))
+
+    print("\n" + "="*60)
+    print("📊 Test Results Summary")
+    print("="*60)
+    for test_name, result in results:
+        print(f"{test_name:<25} {'✅ PASS' if result else '❌ FAIL'}")
+    print("="*60)
+    sys.exit(0 if all(result for _, result in results) else 1)
+
+
+if __name__ == "__main__":
+    main()
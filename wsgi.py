@@ -0,0 +1,14 @@
+"""
+WSGI entry point for running the dashboard with several worker processes.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Each worker imports app.py and calls start_worker(): one worker wins the
+ingestion leader lock (api/leader.py) and runs MQTT, Modbus, the batch writer
+and the background jobs; the others serve HTTP and mirror its live data
+(api/shared_state.py).
+"""
+
+from app import app, start_worker
+
+start_worker()